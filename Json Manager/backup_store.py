@@ -0,0 +1,162 @@
+import datetime
+import difflib
+import hashlib
+import json
+import os
+import zlib
+
+# Dimensioni dei chunk: i confini cadono a fine riga quando il CRC della riga
+# soddisfa la maschera, così un'aggiunta in mezzo al file sposta solo i chunk vicini
+MIN_CHUNK_SIZE = 2 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+BOUNDARY_MASK = 0x7F
+
+BACKUP_DIR_NAME = ".json_backups"
+
+
+def default_store_dir(file_path):
+    """Cartella dello store di backup accanto al file."""
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), BACKUP_DIR_NAME)
+
+
+def _iter_chunks(f):
+    """Divide il contenuto del file in chunk ancorati a fine riga (content-defined)."""
+    pending = []
+    size = 0
+    for line in f:
+        # Righe enormi (JSON compatto su una riga): taglio a dimensione fissa
+        while len(line) > MAX_CHUNK_SIZE:
+            if pending:
+                yield b"".join(pending)
+                pending, size = [], 0
+            yield line[:MAX_CHUNK_SIZE]
+            line = line[MAX_CHUNK_SIZE:]
+        pending.append(line)
+        size += len(line)
+        if size >= MAX_CHUNK_SIZE or (size >= MIN_CHUNK_SIZE and zlib.crc32(line) & BOUNDARY_MASK == 0):
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BackupStore:
+    """
+    Store di backup deduplicato e indirizzato per contenuto.
+
+    Ogni snapshot è un manifest con la lista ordinata degli hash SHA-256 dei
+    chunk; i chunk sono salvati (compressi) una sola volta, quindi backup
+    successivi di un file quasi invariato scrivono solo i chunk cambiati.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        self.manifests_dir = os.path.join(store_dir, "manifests")
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _manifest_dir(self, file_name):
+        return os.path.join(self.manifests_dir, file_name)
+
+    def snapshot(self, file_path):
+        """
+        Crea uno snapshot del file. Restituisce (snapshot_id, chunk_nuovi, chunk_totali).
+        Se il file è identico all'ultimo snapshot non crea nulla e restituisce quello.
+        """
+        file_name = os.path.basename(file_path)
+        whole = hashlib.sha256()
+        digests = []
+        new_chunks = 0
+        size = 0
+
+        with open(file_path, 'rb') as f:
+            for chunk in _iter_chunks(f):
+                whole.update(chunk)
+                size += len(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                digests.append(digest)
+                chunk_path = self._chunk_path(digest)
+                if not os.path.exists(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                    _write_atomic(chunk_path, zlib.compress(chunk))
+                    new_chunks += 1
+
+        file_hash = whole.hexdigest()
+        snapshots = self.list_snapshots(file_name)
+        if snapshots and snapshots[-1]["sha256"] == file_hash:
+            return snapshots[-1]["id"], 0, len(digests)
+
+        now = datetime.datetime.now()
+        snapshot_id = f"{now.strftime('%Y%m%d_%H%M%S_%f')}_{file_hash[:8]}"
+        manifest = {
+            "id": snapshot_id,
+            "file": file_name,
+            "created": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "size": size,
+            "sha256": file_hash,
+            "chunks": digests,
+        }
+        os.makedirs(self._manifest_dir(file_name), exist_ok=True)
+        _write_atomic(os.path.join(self._manifest_dir(file_name), f"{snapshot_id}.json"),
+                      json.dumps(manifest).encode('utf-8'))
+        return snapshot_id, new_chunks, len(digests)
+
+    def list_snapshots(self, file_name):
+        """Manifest degli snapshot di un file, dal più vecchio al più recente."""
+        manifest_dir = self._manifest_dir(os.path.basename(file_name))
+        if not os.path.isdir(manifest_dir):
+            return []
+        snapshots = []
+        for entry in sorted(os.listdir(manifest_dir)):
+            if entry.endswith(".json"):
+                with open(os.path.join(manifest_dir, entry), 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+        return snapshots
+
+    def _load_manifest(self, file_name, snapshot_id):
+        path = os.path.join(self._manifest_dir(os.path.basename(file_name)), f"{snapshot_id}.json")
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def read_snapshot(self, file_name, snapshot_id):
+        """Ricostruisce il contenuto completo di uno snapshot verificandone l'integrità."""
+        manifest = self._load_manifest(file_name, snapshot_id)
+        parts = []
+        for digest in manifest["chunks"]:
+            with open(self._chunk_path(digest), 'rb') as f:
+                parts.append(zlib.decompress(f.read()))
+        data = b"".join(parts)
+        if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+            raise ValueError(f"Snapshot {snapshot_id} corrotto: hash non corrispondente")
+        return data
+
+    def restore(self, file_path, snapshot_id):
+        """Sovrascrive il file con il contenuto dello snapshot."""
+        _write_atomic(file_path, self.read_snapshot(os.path.basename(file_path), snapshot_id))
+
+    def diff(self, file_path, snapshot_id, other_snapshot_id=None):
+        """
+        Diff unificato tra uno snapshot e il file attuale su disco,
+        oppure tra due snapshot se other_snapshot_id è indicato.
+        """
+        file_name = os.path.basename(file_path)
+        old = self.read_snapshot(file_name, snapshot_id)
+        if other_snapshot_id:
+            new = self.read_snapshot(file_name, other_snapshot_id)
+            new_label = other_snapshot_id
+        else:
+            with open(file_path, 'rb') as f:
+                new = f.read()
+            new_label = f"{file_name} (attuale)"
+        return "".join(difflib.unified_diff(
+            old.decode('utf-8', errors='replace').splitlines(keepends=True),
+            new.decode('utf-8', errors='replace').splitlines(keepends=True),
+            fromfile=snapshot_id, tofile=new_label))
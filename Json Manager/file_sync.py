@@ -0,0 +1,180 @@
+# Modulo condiviso: copie identiche in claude-chat-system/modular-version,
+# claudia-chat-system/modular-version e Json Manager. Ogni modifica va
+# riportata in tutte e tre.
+import hashlib
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_MISSING = object()
+
+
+class FileLock:
+    """
+    Lock consultivo su un file tramite un file ".lock" accanto ad esso.
+    Tutti i programmi che scrivono la memoria (chat, JSON Manager,
+    manage_json.py) lo acquisiscono prima di leggere-unire-scrivere.
+    """
+    def __init__(self, path, timeout=10.0, poll_interval=0.05):
+        self.lock_path = f"{path}.lock"
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._handle = None
+
+    def acquire(self):
+        handle = open(self.lock_path, 'a+')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                self._handle = handle
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    raise TimeoutError(f"Impossibile bloccare {self.lock_path}: file in uso da un altro programma")
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        if not self._handle:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class FileSignature:
+    """
+    Rileva le modifiche esterne a un file: confronto veloce di mtime e
+    dimensione, confermato dall'hash del contenuto (un semplice "touch"
+    non viene considerato una modifica).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = None
+        self.size = None
+        self.digest = None
+
+    def update(self, data):
+        """Registra lo stato del file dopo averne letto o scritto il contenuto (bytes)."""
+        self.digest = hashlib.sha256(data).hexdigest()
+        try:
+            stat = os.stat(self.path)
+            self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        except OSError:
+            self.mtime_ns, self.size = None, None
+
+    def assume(self, digest):
+        """Registra lo stato attuale del file di cui si conosce già l'hash (es. da uno snapshot)."""
+        self.digest = digest
+        try:
+            stat = os.stat(self.path)
+            self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+        except OSError:
+            self.mtime_ns, self.size = None, None
+
+    def changed(self):
+        """True se il contenuto su disco è diverso da quello registrato."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self.digest is not None
+        if (stat.st_mtime_ns, stat.st_size) == (self.mtime_ns, self.size):
+            return False
+        with open(self.path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest == self.digest:
+            self.mtime_ns, self.size = stat.st_mtime_ns, stat.st_size
+            return False
+        return True
+
+
+def read_json(path):
+    """Legge un file JSON restituendo (dati, bytes grezzi)."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return json.loads(raw.decode('utf-8')), raw
+
+
+def write_json_atomic(path, data, indent=2):
+    """Scrive il JSON su un file temporaneo e lo sostituisce atomicamente. Restituisce i bytes scritti."""
+    raw = json.dumps(data, indent=indent, ensure_ascii=False).encode('utf-8')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
+    return raw
+
+
+def _merge_lists(base, ours, theirs):
+    # Parte dalla versione su disco, aggiunge le nostre novità e applica le nostre rimozioni
+    removed = [item for item in base if item not in ours]
+    merged = [item for item in theirs if item not in removed]
+    for item in ours:
+        if item not in base and item not in merged:
+            merged.append(item)
+    return merged
+
+
+def merge(base, ours, theirs):
+    """
+    Merge a tre vie tra la versione letta all'ultimo caricamento (base), quella
+    locale (ours) e quella trovata su disco (theirs). Le chiavi modificate da
+    una sola parte prendono quel valore; per i conflitti le liste vengono unite,
+    i contatori sommano gli incrementi e negli altri casi vince la versione locale.
+    """
+    if ours == base:
+        return theirs
+    if theirs == base:
+        return ours
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in (base, ours, theirs)):
+        # Contatori (es. sessioni_totali): si sommano gli incrementi di entrambi
+        return theirs + (ours - base)
+    if ours == theirs:
+        return ours
+    if isinstance(base, dict) and isinstance(ours, dict) and isinstance(theirs, dict):
+        merged = {}
+        for key in list(theirs) + [k for k in ours if k not in theirs]:
+            b = base.get(key, _MISSING)
+            o = ours.get(key, _MISSING)
+            t = theirs.get(key, _MISSING)
+            if o is _MISSING and t is not _MISSING and t == b:
+                continue  # rimossa localmente
+            if t is _MISSING and o is not _MISSING and o == b:
+                continue  # rimossa da un altro programma
+            if o is _MISSING:
+                merged[key] = t
+            elif t is _MISSING:
+                merged[key] = o
+            else:
+                if b is _MISSING:
+                    # Chiave aggiunta da entrambi: per i container si parte da uno vuoto
+                    b = type(o)() if type(o) is type(t) and isinstance(o, (dict, list)) else None
+                merged[key] = merge(b, o, t)
+        return merged
+    if isinstance(ours, list) and isinstance(theirs, list) and isinstance(base, list):
+        return _merge_lists(base, ours, theirs)
+    return ours
@@ -0,0 +1,131 @@
+import copy
+import json
+import os
+
+# Stesso formato di operazioni usato dalla cronologia della memoria
+# (memory_history.py del sistema di chat):
+#   ["set", path, valore], ["del", path], ["splice", path, indice, n_rimossi, elementi]
+
+
+def history_file_for(file_path):
+    """Percorso del file cronologia associato a un file di memoria."""
+    return os.path.splitext(file_path)[0] + ".history.jsonl"
+
+
+def diff(old, new, path=None):
+    """Differenza strutturale tra due documenti JSON, lineare nella dimensione."""
+    path = path or []
+    ops = []
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(["del", path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["set", path + [key], value])
+            else:
+                ops.extend(diff(old[key], value, path + [key]))
+    elif isinstance(old, list) and isinstance(new, list):
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and old[start] == new[start]:
+            start += 1
+        old_end, new_end = len(old), len(new)
+        while old_end > start and new_end > start and old[old_end - 1] == new[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if old_end - start == new_end - start:
+            for i in range(start, old_end):
+                ops.extend(diff(old[i], new[i], path + [i]))
+        else:
+            ops.append(["splice", path, start, old_end - start, new[start:new_end]])
+    elif type(old) is not type(new) or old != new:
+        ops.append(["set", path, new])
+    return ops
+
+
+def apply_delta(document, ops):
+    """Applica le operazioni prodotte da diff() e restituisce il nuovo documento."""
+    document = copy.deepcopy(document)
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path and kind == "set":
+            document = copy.deepcopy(op[2])
+            continue
+        target = document
+        last = path[-1] if path else None
+        for key in (path[:-1] if kind != "splice" else path):
+            target = target[key]
+        if kind == "set":
+            target[last] = copy.deepcopy(op[2])
+        elif kind == "del":
+            del target[last]
+        elif kind == "splice":
+            index, removed, items = op[2], op[3], op[4]
+            target[index:index + removed] = copy.deepcopy(items)
+    return document
+
+
+def _lookup(document, path):
+    for key in path:
+        document = document[key]
+    return document
+
+
+def _format_value(value, limit=120):
+    text = json.dumps(value, ensure_ascii=False)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def format_diff(old, ops):
+    """
+    Descrizione leggibile delle operazioni: lista di (tipo, testo) con tipo
+    "add", "remove" o "change", pronta per essere colorata nel visualizzatore.
+    """
+    lines = []
+    for op in ops:
+        kind, path = op[0], op[1]
+        label = " -> ".join(str(p) for p in path) or "(radice)"
+        if kind == "del":
+            lines.append(("remove", f"- {label}: {_format_value(_lookup(old, path))}"))
+        elif kind == "set":
+            try:
+                previous = _lookup(old, path)
+            except (KeyError, IndexError, TypeError):
+                lines.append(("add", f"+ {label}: {_format_value(op[2])}"))
+                continue
+            lines.append(("change", f"~ {label}: {_format_value(previous)} → {_format_value(op[2])}"))
+        elif kind == "splice":
+            index, removed, items = op[2], op[3], op[4]
+            for i, value in enumerate(_lookup(old, path)[index:index + removed]):
+                lines.append(("remove", f"- {label} -> [{index + i}]: {_format_value(value)}"))
+            for i, value in enumerate(items):
+                lines.append(("add", f"+ {label} -> [{index + i}]: {_format_value(value)}"))
+    return lines
+
+
+def read_history(history_file):
+    """
+    Legge la cronologia della memoria e ricostruisce tutte le versioni in un
+    solo passaggio. Restituisce una lista di (metadati, documento).
+    """
+    versions = []
+    state = None
+    with open(history_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "snapshot" in entry:
+                state = entry["snapshot"]
+            elif state is not None:
+                state = apply_delta(state, entry["delta"])
+            else:
+                continue
+            meta = {k: v for k, v in entry.items() if k not in ("delta", "snapshot")}
+            versions.append((meta, state))
+    return versions
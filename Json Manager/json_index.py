@@ -0,0 +1,190 @@
+import json
+import mmap
+import os
+import re
+from array import array
+
+# Oltre questa dimensione un .json viene aperto in sola lettura tramite indice
+LAZY_OPEN_THRESHOLD = 50 * 1024 * 1024
+
+# Prossimo carattere strutturale (gruppo 1), saltando valori e stringhe JSON
+# (con escape): le parentesi dentro le stringhe vengono "saltate" dal match
+# della stringa intera. Forma "srotolata" senza ambiguità, quindi senza
+# backtracking esponenziale sui file troncati.
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_NEXT_STRUCTURAL = re.compile(rb'[^"\[\]{},]*(?:' + _STRING + rb'[^"\[\]{},]*)*([\[\]{},])')
+_NEXT_BRACKET = re.compile(rb'[^"\[\]{}]*(?:' + _STRING + rb'[^"\[\]{}]*)*([\[\]{}])')
+_STRING_RE = re.compile(_STRING)
+_WHITESPACE = b" \t\r\n"
+# Ogni quanti byte scansionati build_index() chiama la funzione di avanzamento
+PROGRESS_BYTES = 8 * 1024 * 1024
+
+
+class IndexingCancelled(Exception):
+    """La funzione di avanzamento ha chiesto di interrompere l'indicizzazione."""
+
+
+def should_open_lazily(file_path):
+    """Indica se il file va aperto come visualizzatore mmap in sola lettura."""
+    if file_path.lower().endswith(".jsonl"):
+        return True
+    try:
+        return os.path.getsize(file_path) > LAZY_OPEN_THRESHOLD
+    except OSError:
+        return False
+
+
+class LazyJSONFile:
+    """
+    Accesso in sola lettura a file JSON/JSONL molto grandi tramite mmap.
+
+    Il file non viene mai caricato per intero: build_index() costruisce un
+    indice di offset in byte dei record di primo livello (righe per JSONL,
+    elementi per un array, coppie chiave/valore per un oggetto) e ogni
+    record viene decodificato solo quando richiesto.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap non accetta file vuoti
+            self._file.close()
+            raise ValueError(f"File vuoto: {os.path.basename(file_path)}")
+        self.kind = self._detect_kind()
+        # array('Q') occupa 8 byte per offset contro i ~28 di un int Python in lista
+        self._starts = array('Q')
+        self._ends = array('Q')
+
+    def _detect_kind(self):
+        if self.file_path.lower().endswith(".jsonl"):
+            return "jsonl"
+        first = self._first_non_whitespace(0)
+        if first == ord('['):
+            return "array"
+        if first == ord('{'):
+            return "object"
+        return "jsonl"
+
+    def _first_non_whitespace(self, pos):
+        size = len(self._mm)
+        while pos < size and self._mm[pos] in _WHITESPACE:
+            pos += 1
+        return self._mm[pos] if pos < size else None
+
+    def build_index(self, progress=None):
+        """
+        Scansiona il file e registra gli offset dei record di primo livello.
+        progress(byte_letti, byte_totali) viene chiamata ogni PROGRESS_BYTES:
+        se restituisce False l'indicizzazione si ferma con IndexingCancelled
+        e il file viene chiuso.
+        """
+        self._progress = progress
+        self._next_report = PROGRESS_BYTES
+        try:
+            if self.kind == "jsonl":
+                self._index_lines()
+            else:
+                self._index_container()
+        except IndexingCancelled:
+            self.close()
+            raise
+        return len(self)
+
+    def _report(self, pos):
+        if pos < self._next_report:
+            return
+        self._next_report = pos + PROGRESS_BYTES
+        if self._progress and self._progress(pos, len(self._mm)) is False:
+            raise IndexingCancelled(self.file_path)
+
+    def _index_lines(self):
+        mm = self._mm
+        size = len(mm)
+        pos = 0
+        while pos < size:
+            self._report(pos)
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+            if mm[pos:end].strip():
+                self._starts.append(pos)
+                self._ends.append(end)
+            pos = end + 1
+
+    def _index_container(self):
+        # Ogni match salta in C stringhe e valori fino al prossimo carattere
+        # strutturale: il ciclo Python gira solo sulle parentesi e, al primo
+        # livello, sulle virgole (quelle interne ai record non servono)
+        mm = self._mm
+        depth = 0
+        start = None
+        pos = 0
+        while True:
+            match = (_NEXT_STRUCTURAL if depth <= 1 else _NEXT_BRACKET).match(mm, pos)
+            if not match:
+                return
+            token = match.group(1)
+            token_pos = match.start(1)
+            pos = match.end()
+            self._report(token_pos)
+            if token in (b'[', b'{'):
+                depth += 1
+                if depth == 1:
+                    start = pos
+            elif token in (b']', b'}'):
+                if depth == 1:
+                    self._add_record(start, token_pos)
+                    return
+                depth -= 1
+            elif depth == 1:  # virgola tra due record
+                self._add_record(start, token_pos)
+                start = pos
+
+    def _add_record(self, start, end):
+        # Ignora container vuoti ("[]", "{}")
+        if self._mm[start:end].strip():
+            self._starts.append(start)
+            self._ends.append(end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def record_bytes(self, index):
+        """Restituisce i byte grezzi del record (senza spazi esterni)."""
+        return self._mm[self._starts[index]:self._ends[index]].strip()
+
+    def record_label(self, index):
+        """Etichetta del record per l'albero: chiave per gli oggetti, indice altrimenti."""
+        if self.kind == "object":
+            return self._split_pair(index)[0]
+        return f"[{index}]"
+
+    def load_record(self, index):
+        """Decodifica e restituisce il valore del record richiesto."""
+        if self.kind == "object":
+            _, value_start = self._split_pair(index)
+            return json.loads(self._mm[value_start:self._ends[index]])
+        return json.loads(self.record_bytes(index))
+
+    def _split_pair(self, index):
+        """Per un oggetto: restituisce (chiave, offset di inizio del valore)."""
+        pos = self._starts[index]
+        while self._mm[pos] in _WHITESPACE:
+            pos += 1
+        match = _STRING_RE.match(self._mm, pos)
+        if not match:
+            raise ValueError(f"Chiave non valida all'offset {pos}")
+        colon = self._mm.find(b':', match.end(), self._ends[index])
+        return json.loads(match.group()), colon + 1
+
+    def preview(self, index, max_bytes=200):
+        """Anteprima testuale troncata del record, senza decodificarlo."""
+        raw = self.record_bytes(index)
+        text = raw[:max_bytes].decode('utf-8', errors='replace')
+        return text + "..." if len(raw) > max_bytes else text
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
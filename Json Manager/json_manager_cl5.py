@@ -1,22 +1,100 @@
 import wx
 import json
 import os
-import datetime
-import shutil
+import threading
+import queue
 from pathlib import Path
 
+from json_index import IndexingCancelled, LazyJSONFile, should_open_lazily
+from backup_store import BackupStore, default_store_dir
+from json_diff import diff, format_diff, history_file_for, read_history
+from undo_journal import UndoJournal, apply_ops, content_hash, journal_file_for, replace_ops
+from file_sync import FileLock, FileSignature, merge, read_json, write_json_atomic
+
+# Ritardo (ms) della validazione live del tab raw dopo l'ultima battitura
+LIVE_VALIDATION_DELAY_MS = 400
+
+# Record per gruppo nell'albero della modalità sola lettura (file enormi)
+RECORDS_PER_GROUP = 1000
+
+# Intervallo (ms) di controllo delle modifiche al file fatte da altri programmi
+EXTERNAL_CHANGE_POLL_MS = 2000
+
+class JSONParseWorker:
+    """
+    Esegue parsing e serializzazione JSON su un thread in background,
+    consegnando i risultati al thread principale con wx.CallAfter.
+
+    Ogni job appartiene a un canale ("file", "validate", "format", "apply"):
+    un nuovo job o una chiamata a cancel() su un canale rende obsoleti quelli
+    precedenti dello stesso canale, i cui risultati vengono scartati senza
+    toccare la UI. Le validazioni live hanno un canale proprio, così non
+    possono mai annullare una formattazione o un'applicazione.
+    """
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="JSONParseWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, channel, func, on_done, on_error=None, on_discard=None):
+        """
+        Accoda func() sul canale indicato annullando i job precedenti dello
+        stesso canale. on_discard riceve il risultato di un job superato
+        (per chiudere le risorse che nessuno userà).
+        """
+        with self._lock:
+            generation = self._generations.get(channel, 0) + 1
+            self._generations[channel] = generation
+        self._jobs.put((channel, generation, func, on_done, on_error, on_discard))
+        return generation
+
+    def cancel(self, channel):
+        """Annulla i job in coda o in esecuzione sul canale indicato."""
+        with self._lock:
+            self._generations[channel] = self._generations.get(channel, 0) + 1
+
+    def is_current(self, channel, generation):
+        with self._lock:
+            return self._generations.get(channel, 0) == generation
+
+    def _run(self):
+        while True:
+            channel, generation, func, on_done, on_error, on_discard = self._jobs.get()
+            # Job superato da uno più recente: non vale la pena eseguirlo
+            if not self.is_current(channel, generation):
+                continue
+            try:
+                result = func()
+            except Exception as e:
+                if on_error:
+                    wx.CallAfter(self._deliver, channel, generation, on_error, e)
+                continue
+            wx.CallAfter(self._deliver, channel, generation, on_done, result, on_discard)
+
+    def _deliver(self, channel, generation, callback, payload, on_discard=None):
+        # Ricontrolla sul thread principale: l'utente potrebbe aver digitato nel frattempo
+        if self.is_current(channel, generation):
+            callback(payload)
+        elif on_discard:
+            on_discard(payload)
+
 class JSONTreeCtrl(wx.TreeCtrl):
     def __init__(self, parent):
         super().__init__(parent, style=wx.TR_DEFAULT_STYLE | wx.TR_EDIT_LABELS)
         self.root = None
         self.data = {}
+        self.lazy_file = None
         
         # Bind eventi
         self.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_selection_changed)
         self.Bind(wx.EVT_TREE_ITEM_RIGHT_CLICK, self.on_right_click)
+        self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_item_expanding)
         
     def load_json_data(self, data):
         self.data = data
+        self.lazy_file = None
         self.DeleteAllItems()
         
         if not data:
@@ -65,6 +143,71 @@ class JSONTreeCtrl(wx.TreeCtrl):
                     # Mostra il valore completo senza truncarlo
                     self.SetItemText(item, f"[{i}]: {str(value)}")
     
+    def load_lazy_file(self, lazy_file):
+        """Mostra un file indicizzato: i record vengono letti solo quando espansi"""
+        self.data = {}
+        self.lazy_file = lazy_file
+        self.DeleteAllItems()
+        
+        self.root = self.AddRoot("JSON Root")
+        total = len(lazy_file)
+        if total <= RECORDS_PER_GROUP:
+            self.append_lazy_records(self.root, 0, total)
+        else:
+            # Raggruppa i record per non creare milioni di nodi in una volta
+            for start in range(0, total, RECORDS_PER_GROUP):
+                end = min(start + RECORDS_PER_GROUP, total)
+                item = self.AppendItem(self.root, f"[{start}-{end - 1}]")
+                self.SetItemData(item, {'key': f"[{start}-{end - 1}]", 'value': None, 'parent_path': [],
+                                        'group': (start, end), 'loaded': False})
+                self.AppendItem(item, "...")
+    
+    def append_lazy_records(self, parent, start, end):
+        for i in range(start, end):
+            try:
+                label = self.lazy_file.record_label(i)
+            except (ValueError, json.JSONDecodeError) as e:
+                item = self.AppendItem(parent, f"[{i}]: ⚠ record non valido ({e})")
+                self.SetItemData(item, {'key': i, 'value': None, 'parent_path': [], 'error': str(e)})
+                continue
+            if self.lazy_file.kind == "object":
+                item = self.AppendItem(parent, str(label))
+            else:
+                item = self.AppendItem(parent, f"{label}: {self.lazy_file.preview(i, 80)}")
+                label = i
+            self.SetItemData(item, {'key': label, 'value': None, 'parent_path': [],
+                                    'record': i, 'loaded': False})
+            # Segnaposto: il contenuto reale arriva all'espansione
+            self.AppendItem(item, "...")
+    
+    def load_record_value(self, item_data):
+        """Decodifica (una sola volta) il record associato a un nodo lazy"""
+        if item_data['value'] is None and 'record' in item_data:
+            item_data['value'] = self.lazy_file.load_record(item_data['record'])
+        return item_data['value']
+    
+    def on_item_expanding(self, event):
+        item = event.GetItem()
+        data = self.GetItemData(item) if item and item != self.root else None
+        if not data or data.get('loaded', True):
+            return
+        
+        self.DeleteChildren(item)
+        data['loaded'] = True
+        if 'group' in data:
+            self.append_lazy_records(item, *data['group'])
+            return
+        
+        try:
+            value = self.load_record_value(data)
+        except (ValueError, json.JSONDecodeError) as e:
+            # Record malformato: lo si segnala nel nodo invece di lasciarlo espanso a metà
+            error_item = self.AppendItem(item, f"⚠ Record non valido: {e}")
+            self.SetItemData(error_item, {'key': data['key'], 'value': None, 'parent_path': [], 'error': str(e)})
+            return
+        if isinstance(value, (dict, list)):
+            self.build_tree(item, value)
+    
     def get_item_path(self, item):
         path = []
         current = item
@@ -117,6 +260,35 @@ class JSONTreeCtrl(wx.TreeCtrl):
         # Implementa l'aggiunta di un figlio
         pass
 
+class JSONDiffDialog(wx.Dialog):
+    """Visualizza una differenza strutturale: aggiunte in verde, rimozioni in rosso, modifiche in blu"""
+    COLORS = {
+        "add": wx.Colour(0, 128, 0),
+        "remove": wx.Colour(200, 0, 0),
+        "change": wx.Colour(0, 0, 200),
+    }
+    
+    def __init__(self, parent, title, old, new):
+        super().__init__(parent, title=title, size=(900, 600), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        
+        lines = format_diff(old, diff(old, new))
+        summary = wx.StaticText(self, label=f"{len(lines)} differenze")
+        sizer.Add(summary, 0, wx.ALL, 5)
+        
+        text = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_RICH2 | wx.HSCROLL)
+        text.SetFont(wx.Font(10, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        if not lines:
+            text.AppendText("Nessuna differenza")
+        for kind, line in lines:
+            text.SetDefaultStyle(wx.TextAttr(self.COLORS[kind]))
+            text.AppendText(line + "\n")
+        text.SetInsertionPoint(0)
+        sizer.Add(text, 1, wx.EXPAND | wx.ALL, 5)
+        
+        sizer.Add(self.CreateButtonSizer(wx.OK), 0, wx.ALIGN_RIGHT | wx.ALL, 5)
+        self.SetSizer(sizer)
+
 class JSONEditorPanel(wx.Panel):
     def __init__(self, parent):
         super().__init__(parent)
@@ -264,11 +436,29 @@ class JSONEditorPanel(wx.Panel):
         self.validate_btn.Bind(wx.EVT_BUTTON, self.on_validate_json)
         self.apply_raw_btn.Bind(wx.EVT_BUTTON, self.on_apply_raw)
         self.search_ctrl.Bind(wx.EVT_TEXT_ENTER, self.on_search)
+        self.raw_text.Bind(wx.EVT_TEXT, self.on_raw_text_changed)
         
         # Variabili
         self.current_data = {}
         self.selected_item_data = None
         self.file_path = None
+        self.lazy_file = None  # File enorme aperto in sola lettura tramite mmap
+        self.index_job = None  # Indicizzazione in corso: sostituirla la interrompe
+        self.journal = UndoJournal()  # Annulla/Ripeti con operazioni inverse
+        
+        # Modifiche concorrenti (chat, manage_json.py): contenuto letto dal disco
+        # come base del merge, firma del file e modifiche locali non salvate
+        self.signature = None
+        self.base_data = None
+        self.dirty = False
+        self.external_change_notified = False
+        self.external_change_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_check_external_changes, self.external_change_timer)
+        self.external_change_timer.Start(EXTERNAL_CHANGE_POLL_MS)
+        
+        # Parsing in background e validazione live con debounce
+        self.worker = JSONParseWorker()
+        self.live_validation_timer = None
         
     def create_toolbar(self):
         toolbar = wx.Panel(self)
@@ -323,15 +513,42 @@ class JSONEditorPanel(wx.Panel):
         path = " -> ".join(str(p) for p in item_data['parent_path'] + [item_data['key']])
         self.info_text.SetLabel(f"Percorso: {path}")
         
+        if 'error' in item_data:
+            # Record malformato della modalità sola lettura
+            self.key_ctrl.SetValue("")
+            self.value_ctrl.SetValue("")
+            self.status_text.SetLabel(f"Record non valido: {item_data['error']}")
+            return
+        
+        if 'group' in item_data:
+            # Gruppo di record della modalità sola lettura: niente da mostrare
+            self.key_ctrl.SetValue("")
+            self.value_ctrl.SetValue("")
+            return
+        
         # Aggiorna editor
         self.key_ctrl.SetValue(str(item_data['key']))
         
-        value = item_data['value']
+        if 'record' in item_data:
+            try:
+                value = self.tree.load_record_value(item_data)
+            except (ValueError, json.JSONDecodeError) as e:
+                self.value_ctrl.SetValue("")
+                self.status_text.SetLabel(f"Record non valido: {str(e)}")
+                return
+        else:
+            value = item_data['value']
         if isinstance(value, (dict, list)):
             self.value_ctrl.SetValue(json.dumps(value, indent=2, ensure_ascii=False))
         else:
             self.value_ctrl.SetValue(str(value))
         
+        if self.lazy_file:
+            # In sola lettura il tab raw mostra il record selezionato
+            self.raw_text.ChangeValue(json.dumps(value, indent=2, ensure_ascii=False))
+            self.hide_all_buttons()
+            return
+        
         # Determina se è una chiave o una voce e mostra i pulsanti appropriati
         if len(item_data['parent_path']) == 0:
             # È una chiave principale
@@ -368,9 +585,7 @@ class JSONEditorPanel(wx.Panel):
             new_key = dialog.GetValue()
             if new_key and new_key not in self.current_data:
                 # Crea la chiave con una voce vuota per permettere l'editing
-                self.current_data[new_key] = [""]
-                self.tree.load_json_data(self.current_data)
-                self.update_raw_json()
+                self.execute(f"Aggiungi chiave '{new_key}'", [["set", [new_key], [""]]], [["del", [new_key]]])
                 self.status_text.SetLabel(f"Aggiunta chiave: {new_key} (con voce vuota da completare)")
             elif new_key in self.current_data:
                 wx.MessageBox(f"La chiave '{new_key}' esiste già!", "Errore", wx.OK | wx.ICON_ERROR)
@@ -387,10 +602,8 @@ class JSONEditorPanel(wx.Panel):
             new_key = dialog.GetValue()
             if new_key and new_key != old_key:
                 if new_key not in self.current_data:
-                    self.current_data[new_key] = self.current_data[old_key]
-                    del self.current_data[old_key]
-                    self.tree.load_json_data(self.current_data)
-                    self.update_raw_json()
+                    self.execute(f"Rinomina chiave '{old_key}'",
+                                 [["rename", [], old_key, new_key]], [["rename", [], new_key, old_key]])
                     self.status_text.SetLabel(f"Chiave rinominata: {old_key} → {new_key}")
                 else:
                     wx.MessageBox(f"La chiave '{new_key}' esiste già!", "Errore", wx.OK | wx.ICON_ERROR)
@@ -404,9 +617,9 @@ class JSONEditorPanel(wx.Panel):
         key = self.selected_item_data['key']
         if wx.MessageBox(f"Sei sicuro di voler eliminare la chiave '{key}' e tutto il suo contenuto?", 
                         "Conferma Eliminazione", wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
-            del self.current_data[key]
-            self.tree.load_json_data(self.current_data)
-            self.update_raw_json()
+            position = list(self.current_data).index(key)
+            self.execute(f"Elimina chiave '{key}'", [["del", [key]]],
+                         [["set", [key], self.current_data[key], position]])
             self.hide_all_buttons()
             self.key_ctrl.SetValue("")
             self.value_ctrl.SetValue("")
@@ -432,12 +645,15 @@ class JSONEditorPanel(wx.Panel):
             new_voice = dialog.GetValue()
             if new_voice:
                 if isinstance(self.current_data[main_key], list):
-                    self.current_data[main_key].append(new_voice)
+                    size = len(self.current_data[main_key])
+                    self.execute(f"Aggiungi voce a '{main_key}'",
+                                 [["splice", [main_key], size, 0, [new_voice]]],
+                                 [["splice", [main_key], size, 1, []]])
                 else:
-                    self.current_data[main_key] = [new_voice]
+                    self.execute(f"Aggiungi voce a '{main_key}'",
+                                 [["set", [main_key], [new_voice]]],
+                                 [["set", [main_key], self.current_data[main_key]]])
                 
-                self.tree.load_json_data(self.current_data)
-                self.update_raw_json()
                 self.status_text.SetLabel(f"Aggiunta voce a '{main_key}'")
         dialog.Destroy()
     
@@ -454,9 +670,9 @@ class JSONEditorPanel(wx.Panel):
         if dialog.ShowModal() == wx.ID_OK:
             new_voice = dialog.GetValue()
             if new_voice:
-                self.current_data[main_key][voice_index] = new_voice
-                self.tree.load_json_data(self.current_data)
-                self.update_raw_json()
+                self.execute(f"Modifica voce in '{main_key}'",
+                             [["set", [main_key, voice_index], new_voice]],
+                             [["set", [main_key, voice_index], self.current_data[main_key][voice_index]]])
                 self.status_text.SetLabel(f"Modificata voce in '{main_key}'")
         dialog.Destroy()
     
@@ -477,9 +693,9 @@ class JSONEditorPanel(wx.Panel):
         
         if wx.MessageBox(f"Sei sicuro di voler eliminare questa voce da '{main_key}'?\n\n{voice_text}", 
                         "Conferma Eliminazione", wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
-            del self.current_data[main_key][voice_index]
-            self.tree.load_json_data(self.current_data)
-            self.update_raw_json()
+            self.execute(f"Elimina voce da '{main_key}'",
+                         [["splice", [main_key], voice_index, 1, []]],
+                         [["splice", [main_key], voice_index, 0, [self.current_data[main_key][voice_index]]]])
             self.hide_all_buttons()
             self.key_ctrl.SetValue("")
             self.value_ctrl.SetValue("")
@@ -488,45 +704,157 @@ class JSONEditorPanel(wx.Panel):
             self.status_text.SetLabel(f"Eliminata voce da '{main_key}'")
     
     def on_format_json(self, event):
-        """Formatta il JSON nel tab raw"""
-        try:
-            raw_text = self.raw_text.GetValue()
-            if raw_text.strip():
-                parsed = json.loads(raw_text)
-                formatted = json.dumps(parsed, indent=2, ensure_ascii=False)
-                self.raw_text.SetValue(formatted)
-                self.status_text.SetLabel("JSON formattato")
-        except json.JSONDecodeError as e:
-            wx.MessageBox(f"JSON non valido: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        """Formatta il JSON nel tab raw (parsing in background)"""
+        raw_text = self.raw_text.GetValue()
+        if not raw_text.strip():
+            return
+        
+        def format_text():
+            return json.dumps(json.loads(raw_text), indent=2, ensure_ascii=False)
+        
+        def on_done(formatted):
+            self.raw_text.ChangeValue(formatted)
+            self.set_json_status("valid")
+            self.status_text.SetLabel("JSON formattato")
+        
+        def on_error(e):
+            if isinstance(e, json.JSONDecodeError):
+                wx.MessageBox(f"JSON non valido: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+            else:
+                wx.MessageBox(f"Errore nella formattazione: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        
+        self.stop_live_validation()
+        self.status_text.SetLabel("Formattazione in corso...")
+        self.worker.submit("format", format_text, on_done, on_error)
     
     def on_validate_json(self, event):
-        """Valida il JSON nel tab raw"""
-        try:
-            raw_text = self.raw_text.GetValue()
-            if raw_text.strip():
-                json.loads(raw_text)
-                self.json_status.SetForegroundColour(wx.Colour(0, 128, 0))  # Verde
-                self.json_status.SetLabel("● JSON Valido")
-                self.status_text.SetLabel("JSON valido")
-            else:
-                self.json_status.SetForegroundColour(wx.Colour(128, 128, 128))  # Grigio
-                self.json_status.SetLabel("● Vuoto")
-        except json.JSONDecodeError as e:
+        """Valida il JSON nel tab raw (parsing in background)"""
+        raw_text = self.raw_text.GetValue()
+        if not raw_text.strip():
+            self.worker.cancel("validate")
+            self.set_json_status("empty")
+            return
+        
+        def on_done(_):
+            self.set_json_status("valid")
+            self.status_text.SetLabel("JSON valido")
+        
+        def on_error(e):
+            self.set_json_status("invalid")
+            self.status_text.SetLabel(f"JSON non valido: {str(e)}")
+        
+        # Canale separato: una validazione non deve mai annullare formattazione o applicazione
+        self.worker.submit("validate", lambda: json.loads(raw_text), on_done, on_error)
+    
+    def stop_live_validation(self):
+        """Ferma la validazione live in attesa o in corso (formattazione e applicazione validano già)"""
+        if self.live_validation_timer and self.live_validation_timer.IsRunning():
+            self.live_validation_timer.Stop()
+        self.worker.cancel("validate")
+    
+    def set_json_status(self, state):
+        """Aggiorna l'indicatore di validità JSON nella toolbar"""
+        if state == "valid":
+            self.json_status.SetForegroundColour(wx.Colour(0, 128, 0))  # Verde
+            self.json_status.SetLabel("● JSON Valido")
+        elif state == "invalid":
             self.json_status.SetForegroundColour(wx.Colour(255, 0, 0))  # Rosso
             self.json_status.SetLabel("● JSON Non Valido")
-            self.status_text.SetLabel(f"JSON non valido: {str(e)}")
+        elif state == "pending":
+            self.json_status.SetForegroundColour(wx.Colour(255, 165, 0))  # Arancione
+            self.json_status.SetLabel("● Verifica...")
+        else:
+            self.json_status.SetForegroundColour(wx.Colour(128, 128, 128))  # Grigio
+            self.json_status.SetLabel("● Vuoto")
+    
+    def on_raw_text_changed(self, event):
+        """Validazione live con debounce: riparte ad ogni battitura"""
+        # L'utente sta digitando: validazione e formattazione del testo vecchio non servono più
+        # (un'applicazione già richiesta resta valida: usa il testo del momento del clic)
+        self.worker.cancel("validate")
+        self.worker.cancel("format")
+        self.set_json_status("pending")
+        if self.live_validation_timer and self.live_validation_timer.IsRunning():
+            self.live_validation_timer.Restart(LIVE_VALIDATION_DELAY_MS)
+        else:
+            self.live_validation_timer = wx.CallLater(LIVE_VALIDATION_DELAY_MS, self.on_validate_json, None)
+        event.Skip()
     
     def on_apply_raw(self, event):
-        """Applica le modifiche dal tab raw"""
-        try:
-            raw_text = self.raw_text.GetValue()
-            if raw_text.strip():
-                self.current_data = json.loads(raw_text)
-                self.tree.load_json_data(self.current_data)
-                self.status_text.SetLabel("Modifiche applicate dal raw JSON")
-                self.on_validate_json(None)
-        except json.JSONDecodeError as e:
+        """Applica le modifiche dal tab raw (parsing in background)"""
+        raw_text = self.raw_text.GetValue()
+        if not raw_text.strip():
+            return
+        
+        def on_done(parsed):
+            # Il journal conserva solo le differenze, non le due versioni del documento
+            forward, inverse = replace_ops(self.current_data, parsed)
+            if not forward:
+                self.set_json_status("valid")
+                self.status_text.SetLabel("Nessuna modifica da applicare")
+                return
+            # Come execute(): il documento è ricostruito dalle operazioni, senza oggetti in comune con il journal
+            self.current_data = apply_ops(self.current_data, forward)
+            self.journal.record("Modifiche dal raw JSON", forward, inverse)
+            self.dirty = True
+            self.tree.load_json_data(self.current_data)
+            self.set_json_status("valid")
+            self.status_text.SetLabel("Modifiche applicate dal raw JSON")
+        
+        def on_error(e):
+            self.set_json_status("invalid")
             wx.MessageBox(f"JSON non valido: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        
+        self.stop_live_validation()
+        self.status_text.SetLabel("Applicazione modifiche in corso...")
+        self.worker.submit("apply", lambda: json.loads(raw_text), on_done, on_error)
+    
+    def execute(self, label, forward, inverse):
+        """Esegue una modifica registrandone l'inversa nel journal annulla/ripeti"""
+        self.current_data = apply_ops(self.current_data, forward)
+        self.journal.record(label, forward, inverse)
+        self.dirty = True
+        self.tree.load_json_data(self.current_data)
+        self.update_raw_json()
+    
+    def reset_editor(self):
+        """Pulisce l'editor quando la selezione non è più valida"""
+        self.hide_all_buttons()
+        self.key_ctrl.SetValue("")
+        self.value_ctrl.SetValue("")
+        self.info_text.SetLabel("Seleziona un elemento dall'albero")
+        self.selected_item_data = None
+    
+    def on_undo(self, event):
+        """Annulla l'ultima modifica"""
+        # Nel tab raw Ctrl+Z annulla la digitazione, come ci si aspetta da un editor di testo
+        if self.raw_text.HasFocus() and self.raw_text.CanUndo():
+            self.raw_text.Undo()
+            return
+        if self.lazy_file or not self.journal.can_undo():
+            self.status_text.SetLabel("Niente da annullare")
+            return
+        self.current_data, label = self.journal.undo(self.current_data)
+        self.dirty = True
+        self.tree.load_json_data(self.current_data)
+        self.update_raw_json()
+        self.reset_editor()
+        self.status_text.SetLabel(f"Annullato: {label}")
+    
+    def on_redo(self, event):
+        """Ripete l'ultima modifica annullata"""
+        if self.raw_text.HasFocus() and self.raw_text.CanRedo():
+            self.raw_text.Redo()
+            return
+        if self.lazy_file or not self.journal.can_redo():
+            self.status_text.SetLabel("Niente da ripetere")
+            return
+        self.current_data, label = self.journal.redo(self.current_data)
+        self.dirty = True
+        self.tree.load_json_data(self.current_data)
+        self.update_raw_json()
+        self.reset_editor()
+        self.status_text.SetLabel(f"Ripetuto: {label}")
     
     def on_search(self, event):
         """Cerca nel JSON"""
@@ -535,15 +863,48 @@ class JSONEditorPanel(wx.Panel):
             # Implementa ricerca nell'albero
             self.status_text.SetLabel(f"Ricerca: {search_term}")
     
-    def update_raw_json(self):
+    def update_raw_json(self, formatted=None):
         """Aggiorna il contenuto del tab raw JSON"""
         if self.current_data:
-            formatted = json.dumps(self.current_data, indent=2, ensure_ascii=False)
-            self.raw_text.SetValue(formatted)
-            self.on_validate_json(None)
+            if formatted is None:
+                formatted = json.dumps(self.current_data, indent=2, ensure_ascii=False)
+            # ChangeValue non genera EVT_TEXT: il testo deriva da dati già validi
+            self.stop_live_validation()
+            self.worker.cancel("format")
+            self.raw_text.ChangeValue(formatted)
+            self.set_json_status("valid")
+    
+    def set_read_only(self, read_only):
+        """Abilita/disabilita la modifica (modalità visualizzatore per file enormi)"""
+        self.raw_text.SetEditable(not read_only)
+        self.format_btn.Enable(not read_only)
+        self.apply_raw_btn.Enable(not read_only)
+        if read_only:
+            self.hide_all_buttons()
+    
+    def close_lazy_file(self):
+        """Chiude l'eventuale file aperto in sola lettura (e interrompe un'indicizzazione in corso)"""
+        self.index_job = None
+        if self.lazy_file:
+            self.lazy_file.close()
+            self.lazy_file = None
+            self.set_read_only(False)
+    
+    def check_writable(self):
+        """Avvisa se il documento corrente è in sola lettura"""
+        if self.lazy_file:
+            wx.MessageBox("Il file è aperto in sola lettura (modalità visualizzatore per file di grandi dimensioni).",
+                          "Sola lettura", wx.OK | wx.ICON_INFORMATION)
+            return False
+        return True
     
     def on_new_file(self, event):
         """Crea un nuovo file JSON"""
+        self.close_lazy_file()
+        self.journal.clear()
+        self.signature = None
+        self.base_data = None
+        self.dirty = False
         self.current_data = {}
         self.tree.load_json_data(self.current_data)
         self.update_raw_json()
@@ -553,36 +914,109 @@ class JSONEditorPanel(wx.Panel):
     
     def on_open_file(self, event):
         """Apre un file JSON esistente"""
-        with wx.FileDialog(self, "Apri file JSON", wildcard="JSON files (*.json)|*.json", style=wx.FD_OPEN) as dialog:
+        with wx.FileDialog(self, "Apri file JSON", wildcard="JSON files (*.json;*.jsonl)|*.json;*.jsonl", style=wx.FD_OPEN) as dialog:
             if dialog.ShowModal() == wx.ID_OK:
                 self.file_path = dialog.GetPath()
                 self.load_file(self.file_path)
     
     def load_file(self, file_path):
-        """Carica un file JSON"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                self.current_data = json.load(f)
-            
+        """Carica un file JSON (lettura e parsing in background)"""
+        if should_open_lazily(file_path):
+            self.open_lazy_file(file_path)
+            return
+        self.index_job = None  # Interrompe un'eventuale indicizzazione in corso
+        
+        def read_and_parse():
+            signature = FileSignature(file_path)
+            with FileLock(file_path):
+                data, raw = read_json(file_path)
+            signature.update(raw)
+            base_data = json.loads(raw.decode('utf-8'))
+            return data, json.dumps(data, indent=2, ensure_ascii=False), content_hash(raw), signature, base_data
+        
+        def on_done(result):
+            self.close_lazy_file()
+            self.current_data, formatted, saved_hash, self.signature, self.base_data = result
+            self.dirty = False
+            self.external_change_notified = False
             self.tree.load_json_data(self.current_data)
-            self.update_raw_json()
+            self.update_raw_json(formatted)
             self.file_path = file_path
             self.file_label.SetLabel(os.path.basename(file_path))
-            self.status_text.SetLabel(f"File caricato: {os.path.basename(file_path)}")
-            
-        except Exception as e:
+            if self.journal.load(journal_file_for(file_path), saved_hash):
+                self.status_text.SetLabel(f"File caricato: {os.path.basename(file_path)} "
+                                          f"({len(self.journal.undo_stack)} modifiche annullabili)")
+            else:
+                self.status_text.SetLabel(f"File caricato: {os.path.basename(file_path)}")
+        
+        def on_error(e):
+            self.status_text.SetLabel("Caricamento fallito")
             wx.MessageBox(f"Errore nel caricamento del file: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        
+        self.status_text.SetLabel(f"Caricamento di {os.path.basename(file_path)}...")
+        self.worker.submit("file", read_and_parse, on_done, on_error)
+    
+    def open_lazy_file(self, file_path):
+        """Apre un file JSON/JSONL enorme in sola lettura tramite mmap e indice dei record"""
+        job = self.index_job = object()
+        name = os.path.basename(file_path)
+        
+        def progress(done, total):
+            # Un'altra apertura o la chiusura della finestra interrompono la scansione
+            if self.index_job is not job:
+                return False
+            wx.CallAfter(self.show_index_progress, job, name, done, total)
+            return True
+        
+        def build_index():
+            lazy_file = LazyJSONFile(file_path)
+            lazy_file.build_index(progress)
+            return lazy_file
+        
+        def on_done(lazy_file):
+            self.index_job = None
+            self.close_lazy_file()
+            self.journal.clear()
+            self.signature = None
+            self.base_data = None
+            self.dirty = False
+            self.lazy_file = lazy_file
+            self.current_data = {}
+            self.selected_item_data = None
+            self.tree.load_lazy_file(lazy_file)
+            self.raw_text.ChangeValue("")
+            self.set_read_only(True)
+            self.file_path = file_path
+            self.file_label.SetLabel(f"{os.path.basename(file_path)} (sola lettura)")
+            self.status_text.SetLabel(f"Indicizzati {len(lazy_file)} record: espandi l'albero per leggerli")
+        
+        def on_error(e):
+            if isinstance(e, IndexingCancelled):
+                return
+            self.index_job = None
+            self.status_text.SetLabel("Indicizzazione fallita")
+            wx.MessageBox(f"Errore nell'apertura del file: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        
+        self.status_text.SetLabel(f"Indicizzazione di {name}...")
+        # Se nel frattempo viene aperto un altro file l'indice pronto non serve più: va chiuso
+        self.worker.submit("file", build_index, on_done, on_error, on_discard=lambda lazy_file: lazy_file.close())
+    
+    def show_index_progress(self, job, name, done, total):
+        if self.index_job is job:
+            self.status_text.SetLabel(f"Indicizzazione di {name}... {done * 100 // total}%")
     
     def on_save_file(self, event):
         """Salva il file JSON"""
+        if not self.check_writable():
+            return
+        
         if not self.file_path:
             # Se non c'è un percorso, usa "Salva con nome"
             self.on_save_as_file(event)
             return
         
         try:
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_data, f, indent=2, ensure_ascii=False)
+            self.write_file(self.file_path)
             
             self.file_label.SetLabel(os.path.basename(self.file_path))
             self.status_text.SetLabel(f"File salvato: {os.path.basename(self.file_path)}")
@@ -592,12 +1026,14 @@ class JSONEditorPanel(wx.Panel):
     
     def on_save_as_file(self, event):
         """Salva il file JSON con un nuovo nome"""
+        if not self.check_writable():
+            return
+        
         with wx.FileDialog(self, "Salva file JSON con nome", wildcard="JSON files (*.json)|*.json", style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as dialog:
             if dialog.ShowModal() == wx.ID_OK:
                 new_path = dialog.GetPath()
                 try:
-                    with open(new_path, 'w', encoding='utf-8') as f:
-                        json.dump(self.current_data, f, indent=2, ensure_ascii=False)
+                    self.write_file(new_path)
                     
                     # Aggiorna il file corrente
                     self.file_path = new_path
@@ -607,21 +1043,181 @@ class JSONEditorPanel(wx.Panel):
                 except Exception as e:
                     wx.MessageBox(f"Errore nel salvataggio del file: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
     
+    def write_file(self, path):
+        """
+        Scrive il documento sotto lock. Se il file è stato modificato da un altro
+        programma dopo il caricamento, le modifiche vengono unite a quelle locali
+        invece di essere sovrascritte. Salva poi il journal annulla/ripeti.
+        """
+        with FileLock(path):
+            if path == self.file_path and self.base_data is not None and self.signature and self.signature.changed():
+                theirs, _ = read_json(path)
+                merged = merge(self.base_data, self.current_data, theirs)
+                if merged != self.current_data:
+                    # Le operazioni inverse si riferiscono al documento prima del merge
+                    self.journal.clear()
+                    self.current_data = merged
+                    self.tree.load_json_data(self.current_data)
+                    self.update_raw_json()
+                    wx.MessageBox("Il file era stato modificato da un altro programma: le modifiche sono state unite alle tue.",
+                                  "Modifiche unite", wx.OK | wx.ICON_INFORMATION)
+            raw = write_json_atomic(path, self.current_data)
+        self.signature = FileSignature(path)
+        self.signature.update(raw)
+        self.base_data = json.loads(raw.decode('utf-8'))
+        self.dirty = False
+        self.external_change_notified = False
+        try:
+            self.journal.save(journal_file_for(path), content_hash(raw))
+        except OSError as e:
+            # Il documento è salvato: la perdita della cronologia annulla non è bloccante
+            self.status_text.SetLabel(f"Journal annulla/ripeti non salvato: {str(e)}")
+    
+    def on_check_external_changes(self, event):
+        """Rileva (polling) le modifiche al file fatte da altri programmi"""
+        if not self.file_path or self.lazy_file or not self.signature:
+            return
+        try:
+            changed = self.signature.changed()
+        except OSError:
+            return
+        if not changed:
+            return
+        if not self.dirty:
+            # Nessuna modifica locale da perdere: ricarica direttamente
+            self.status_text.SetLabel("File modificato da un altro programma: ricaricamento...")
+            self.signature = None
+            self.load_file(self.file_path)
+        elif not self.external_change_notified:
+            self.external_change_notified = True
+            self.status_text.SetLabel("File modificato da un altro programma: le modifiche saranno unite al salvataggio")
+    
     def on_backup_file(self, event):
-        """Crea un backup del file corrente"""
+        """Crea un backup deduplicato del file corrente (solo i chunk nuovi vengono scritti)"""
         if not self.file_path:
             wx.MessageBox("Nessun file da cui fare backup", "Attenzione", wx.OK | wx.ICON_WARNING)
             return
         
+        file_path = self.file_path
+        store = BackupStore(default_store_dir(file_path))
+        
+        def on_done(result):
+            snapshot_id, new_chunks, total_chunks = result
+            if new_chunks == 0 and total_chunks:
+                self.status_text.SetLabel(f"Backup {snapshot_id}: nessun chunk nuovo ({total_chunks} riutilizzati)")
+            else:
+                self.status_text.SetLabel(f"Backup creato: {snapshot_id} ({new_chunks} chunk nuovi su {total_chunks})")
+        
+        def on_error(e):
+            wx.MessageBox(f"Errore nella creazione del backup: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+        
+        self.worker.submit("backup", lambda: store.snapshot(file_path), on_done, on_error)
+    
+    def choose_snapshot(self, title):
+        """Mostra l'elenco degli snapshot del file corrente e restituisce l'id scelto"""
+        if not self.file_path:
+            wx.MessageBox("Nessun file aperto", "Attenzione", wx.OK | wx.ICON_WARNING)
+            return None
+        
+        store = BackupStore(default_store_dir(self.file_path))
+        snapshots = list(reversed(store.list_snapshots(self.file_path)))
+        if not snapshots:
+            wx.MessageBox("Nessun backup disponibile per questo file", "Attenzione", wx.OK | wx.ICON_WARNING)
+            return None
+        
+        choices = [f"{s['created']}  -  {s['size']} byte  ({s['id']})" for s in snapshots]
+        with wx.SingleChoiceDialog(self, "Seleziona un backup:", title, choices) as dialog:
+            if dialog.ShowModal() == wx.ID_OK:
+                return snapshots[dialog.GetSelection()]['id']
+        return None
+    
+    def on_restore_backup(self, event):
+        """Ripristina il file corrente da uno snapshot"""
+        if not self.check_writable():
+            return
+        
+        snapshot_id = self.choose_snapshot("Ripristina Backup")
+        if not snapshot_id:
+            return
+        
+        if wx.MessageBox(f"Sovrascrivere '{os.path.basename(self.file_path)}' con il backup {snapshot_id}?",
+                         "Conferma Ripristino", wx.YES_NO | wx.ICON_QUESTION) != wx.YES:
+            return
+        
         try:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = f"{self.file_path}.backup_{timestamp}"
-            shutil.copy2(self.file_path, backup_path)
-            
-            self.status_text.SetLabel(f"Backup creato: {os.path.basename(backup_path)}")
-            
+            BackupStore(default_store_dir(self.file_path)).restore(self.file_path, snapshot_id)
+            self.load_file(self.file_path)
+            self.status_text.SetLabel(f"Ripristinato backup: {snapshot_id}")
         except Exception as e:
-            wx.MessageBox(f"Errore nella creazione del backup: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+            wx.MessageBox(f"Errore nel ripristino del backup: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+    
+    def on_diff_backup(self, event):
+        """Mostra le differenze tra uno snapshot e il file su disco"""
+        snapshot_id = self.choose_snapshot("Confronta con Backup")
+        if not snapshot_id:
+            return
+        
+        try:
+            diff_text = BackupStore(default_store_dir(self.file_path)).diff(self.file_path, snapshot_id)
+        except Exception as e:
+            wx.MessageBox(f"Errore nel confronto: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+            return
+        
+        dialog = wx.Dialog(self, title=f"Differenze con {snapshot_id}", size=(800, 600),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        text = wx.TextCtrl(dialog, value=diff_text or "Nessuna differenza", style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
+        text.SetFont(wx.Font(10, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        sizer.Add(text, 1, wx.EXPAND | wx.ALL, 5)
+        sizer.Add(dialog.CreateButtonSizer(wx.OK), 0, wx.ALIGN_RIGHT | wx.ALL, 5)
+        dialog.SetSizer(sizer)
+        dialog.ShowModal()
+        dialog.Destroy()
+
+    def on_compare_file(self, event):
+        """Confronto strutturale tra il documento corrente e un altro file JSON"""
+        with wx.FileDialog(self, "Confronta con file JSON", wildcard="JSON files (*.json)|*.json", style=wx.FD_OPEN) as dialog:
+            if dialog.ShowModal() != wx.ID_OK:
+                return
+            other_path = dialog.GetPath()
+        
+        try:
+            with open(other_path, 'r', encoding='utf-8') as f:
+                other_data = json.load(f)
+        except Exception as e:
+            wx.MessageBox(f"Errore nel caricamento del file: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+            return
+        
+        with JSONDiffDialog(self, f"Differenze: {os.path.basename(other_path)} → documento corrente",
+                            other_data, self.current_data) as dialog:
+            dialog.ShowModal()
+    
+    def on_memory_history(self, event):
+        """Mostra le versioni registrate della memoria e le differenze introdotte da ognuna"""
+        history_file = history_file_for(self.file_path) if self.file_path else None
+        if not history_file or not os.path.exists(history_file):
+            wx.MessageBox("Nessuna cronologia disponibile per questo file", "Attenzione", wx.OK | wx.ICON_WARNING)
+            return
+        
+        try:
+            versions = read_history(history_file)
+        except Exception as e:
+            wx.MessageBox(f"Errore nella lettura della cronologia: {str(e)}", "Errore", wx.OK | wx.ICON_ERROR)
+            return
+        
+        choices = []
+        for meta, _ in versions:
+            details = " - ".join(str(meta[k]) for k in ("origin", "model", "session_id") if meta.get(k))
+            choices.append(f"v{meta['version']}  {meta['timestamp']}  {details}")
+        with wx.SingleChoiceDialog(self, "Seleziona una versione:", "Cronologia Memoria", choices[::-1]) as dialog:
+            if dialog.ShowModal() != wx.ID_OK:
+                return
+            index = len(versions) - 1 - dialog.GetSelection()
+        
+        meta, state = versions[index]
+        previous = versions[index - 1][1] if index > 0 else {}
+        with JSONDiffDialog(self, f"Versione {meta['version']} ({meta['timestamp']})", previous, state) as dialog:
+            dialog.ShowModal()
 
 class JSONEditorFrame(wx.Frame):
     def __init__(self):
@@ -640,6 +1236,9 @@ class JSONEditorFrame(wx.Frame):
         self.CreateStatusBar()
         self.SetStatusText("Pronto")
         
+        # Alla chiusura va rilasciato il mmap dell'eventuale file in sola lettura
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        
         # Se esiste claudia_memory.json, caricalo automaticamente
         if os.path.exists('claudia_memory.json'):
             self.panel.load_file('claudia_memory.json')
@@ -668,6 +1267,11 @@ class JSONEditorFrame(wx.Frame):
         tools_menu.Append(1001, "&Valida JSON\tF5")
         tools_menu.Append(1002, "&Formatta JSON\tF6")
         tools_menu.Append(1003, "&Backup\tF7")
+        tools_menu.Append(1004, "&Ripristina backup...")
+        tools_menu.Append(1005, "&Confronta con backup...")
+        tools_menu.AppendSeparator()
+        tools_menu.Append(1006, "Confronta con &file JSON...")
+        tools_menu.Append(1007, "Cronologia &memoria...")
         
         # Help menu
         help_menu = wx.Menu()
@@ -686,14 +1290,24 @@ class JSONEditorFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.panel.on_save_file, id=wx.ID_SAVE)
         self.Bind(wx.EVT_MENU, self.panel.on_save_as_file, id=wx.ID_SAVEAS)
         self.Bind(wx.EVT_MENU, self.on_exit, id=wx.ID_EXIT)
+        self.Bind(wx.EVT_MENU, self.panel.on_undo, id=wx.ID_UNDO)
+        self.Bind(wx.EVT_MENU, self.panel.on_redo, id=wx.ID_REDO)
         self.Bind(wx.EVT_MENU, self.panel.on_validate_json, id=1001)
         self.Bind(wx.EVT_MENU, self.panel.on_format_json, id=1002)
         self.Bind(wx.EVT_MENU, self.panel.on_backup_file, id=1003)
+        self.Bind(wx.EVT_MENU, self.panel.on_restore_backup, id=1004)
+        self.Bind(wx.EVT_MENU, self.panel.on_diff_backup, id=1005)
+        self.Bind(wx.EVT_MENU, self.panel.on_compare_file, id=1006)
+        self.Bind(wx.EVT_MENU, self.panel.on_memory_history, id=1007)
         self.Bind(wx.EVT_MENU, self.on_about, id=wx.ID_ABOUT)
     
     def on_exit(self, event):
         self.Close()
     
+    def on_close(self, event):
+        self.panel.close_lazy_file()
+        event.Skip()
+    
     def on_about(self, event):
         info = wx.adv.AboutDialogInfo()
         info.SetName("JSON Editor Professionale")
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+from collections import deque
+
+from json_diff import diff
+
+# Limite complessivo (in byte serializzati) dei comandi conservati: oltre,
+# i comandi più vecchi vengono scartati
+MAX_JOURNAL_BYTES = 4 * 1024 * 1024
+
+
+def journal_file_for(file_path):
+    """File nascosto accanto al documento che conserva annulla/ripeti tra un avvio e l'altro."""
+    folder, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(folder, f".{name}.undo.jsonl")
+
+
+def content_hash(data):
+    """Hash del contenuto salvato: lega il journal alla versione del file a cui si riferisce."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def _set_key_at(target, key, value, position):
+    """Inserisce key in un dict alla posizione indicata preservando l'ordine delle altre chiavi."""
+    items = list(target.items())
+    target.clear()
+    for i, (k, v) in enumerate(items):
+        if i == position:
+            target[key] = value
+        target[k] = v
+    if key not in target:
+        target[key] = value
+
+
+def apply_ops(document, ops):
+    """
+    Applica le operazioni direttamente sul documento (senza copiarlo) e
+    restituisce il documento risultante. Oltre alle operazioni di json_diff
+    supporta ["set", path, valore, posizione] e ["rename", path, vecchia, nuova].
+    """
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path and kind == "set":
+            document = json.loads(json.dumps(op[2]))
+            continue
+        target = document
+        for key in (path if kind in ("splice", "rename") else path[:-1]):
+            target = target[key]
+        # Copia dei valori: il journal non deve condividere oggetti col documento
+        if kind == "set":
+            value = json.loads(json.dumps(op[2]))
+            if len(op) > 3 and isinstance(target, dict) and path[-1] not in target:
+                _set_key_at(target, path[-1], value, op[3])
+            else:
+                target[path[-1]] = value
+        elif kind == "del":
+            del target[path[-1]]
+        elif kind == "splice":
+            index, removed, items = op[2], op[3], op[4]
+            target[index:index + removed] = json.loads(json.dumps(items))
+        elif kind == "rename":
+            old_key, new_key = op[2], op[3]
+            position = list(target).index(old_key)
+            value = target.pop(old_key)
+            _set_key_at(target, new_key, value, position)
+    return document
+
+
+def replace_ops(old, new):
+    """Coppia (operazioni, inverse) per sostituire l'intero documento, es. da raw JSON."""
+    return diff(old, new), diff(new, old)
+
+
+class UndoJournal:
+    """
+    Pila annulla/ripeti basata su comandi: ogni voce contiene solo le
+    operazioni per rifare e quelle inverse, mai copie del documento.
+    La dimensione totale è limitata a MAX_JOURNAL_BYTES.
+    """
+    def __init__(self, max_bytes=MAX_JOURNAL_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self._undo_bytes = 0
+
+    @staticmethod
+    def _make_command(label, forward, inverse):
+        # Copia tramite JSON: le operazioni non devono condividere oggetti col documento,
+        # altrimenti le modifiche successive cambierebbero i comandi già registrati
+        text = json.dumps({"label": label, "do": forward, "undo": inverse}, ensure_ascii=False)
+        command = json.loads(text)
+        command["size"] = len(text)
+        return command
+
+    def record(self, label, forward, inverse):
+        """Registra un comando già eseguito; una nuova modifica invalida i 'ripeti'."""
+        self._push_undo(self._make_command(label, forward, inverse))
+        self.redo_stack.clear()
+
+    def _push_undo(self, command):
+        self.undo_stack.append(command)
+        self._undo_bytes += command["size"]
+        while self._undo_bytes > self.max_bytes and len(self.undo_stack) > 1:
+            self._undo_bytes -= self.undo_stack.popleft()["size"]
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, document):
+        """Annulla l'ultimo comando. Restituisce (documento, etichetta)."""
+        command = self.undo_stack.pop()
+        self._undo_bytes -= command["size"]
+        self.redo_stack.append(command)
+        return apply_ops(document, command["undo"]), command["label"]
+
+    def redo(self, document):
+        """Ripete l'ultimo comando annullato. Restituisce (documento, etichetta)."""
+        command = self.redo_stack.pop()
+        self._push_undo(command)
+        return apply_ops(document, command["do"]), command["label"]
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._undo_bytes = 0
+
+    def save(self, journal_path, saved_hash):
+        """Scrive il journal su disco legandolo all'hash del contenuto appena salvato."""
+        tmp_path = f"{journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"doc_hash": saved_hash}) + "\n")
+            for stack, commands in (("u", self.undo_stack), ("r", self.redo_stack)):
+                for command in commands:
+                    f.write(json.dumps({"s": stack, "label": command["label"], "do": command["do"],
+                                        "undo": command["undo"]}, ensure_ascii=False,
+                                       separators=(",", ":")) + "\n")
+        os.replace(tmp_path, journal_path)
+
+    def load(self, journal_path, current_hash):
+        """Ripristina il journal se si riferisce esattamente al contenuto attuale del file."""
+        self.clear()
+        if not os.path.exists(journal_path):
+            return False
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get("doc_hash") != current_hash:
+                    # Il file è stato modificato altrove: il journal non è più applicabile
+                    return False
+                for line in f:
+                    entry = json.loads(line)
+                    command = self._make_command(entry["label"], entry["do"], entry["undo"])
+                    if entry["s"] == "u":
+                        self._push_undo(command)
+                    else:
+                        self.redo_stack.append(command)
+        except (ValueError, KeyError, OSError):
+            self.clear()
+            return False
+        return True
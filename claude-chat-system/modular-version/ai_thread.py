@@ -1,62 +1,364 @@
-import json
+import logging
+import queue
+import threading
+import time
 from PyQt5.QtCore import QThread, pyqtSignal
-from anthropic import Anthropic
+
+from chat_logging import get_logger, log_event
+from chat_message import estimate_tokens
+from generation_profiles import request_options, resolve_profile
+from job_scheduler import JobCancelled, job_class_for
+from prompt_pipeline import chat_pipeline
+
+logger = get_logger("engine")
+
+# Tentativi gestiti qui (e non dal client) per poterli contare nelle metriche
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 1.0
+
+# Hedging della chat, solo per i modelli con hedge_percentile in models.json: se il
+# primo token tarda oltre quel percentile dei tempi recenti parte anche il fallback
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 5.0  # secondi, finché non ci sono abbastanza campioni
+HEDGE_MIN_DELAY = 0.5
+# Campioni di latenza del modello scelto necessari per stimare il risparmio del router
+ROUTE_BASELINE_SAMPLES = 5
+
+
+def _is_retryable(error):
+    # Import locale: anthropic viene caricato solo quando serve il client
+    from anthropic import APIConnectionError, APIStatusError
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in (408, 409, 429) or error.status_code >= 500)
+
+
+def _is_overloaded(error):
+    """Modello sovraccarico (529) o limite di richieste (429): con un fallback non conviene ritentare."""
+    from anthropic import APIStatusError
+    return isinstance(error, APIStatusError) and error.status_code in (429, 529)
+
+
+class RequestCancelled(Exception):
+    """Richiesta annullata perché un'altra della stessa gara ha risposto prima."""
+
+
+class _Attempt:
+    """Richiesta verso un modello della catena di fallback, eseguita in un thread a parte."""
+    def __init__(self, model_config, events, can_fall_back):
+        self.model_config = model_config
+        self.stats = {"model": model_config['api_model'], "retries": 0}
+        self.events = events
+        self.can_fall_back = can_fall_back
+        self.cancelled = threading.Event()
+        self.stream = None  # Stream aperto della richiesta in corso
+        self.response = None
+        self.error = None
+        self.done = False
+
+    def first_token(self):
+        self.events.put(("token", self))
+
+    def cancel(self):
+        """Annulla la richiesta chiudendone subito lo stream, anche se è fermo in attesa di dati."""
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def usage(self):
+        """Token (input, output) consumati finora, anche se lo stream è stato interrotto."""
+        try:
+            snapshot = self.stream.current_message_snapshot
+        except Exception:
+            return 0, 0  # Nessun message_start ricevuto
+        text = "".join(getattr(block, "text", "") for block in snapshot.content)
+        return snapshot.usage.input_tokens or 0, max(snapshot.usage.output_tokens or 0, estimate_tokens(text))
+
+    def run(self, thread, messages, started):
+        try:
+            self.response = thread._stream_with_retries(messages, self.stats, started, self.model_config, self)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            if self.cancelled.is_set():
+                thread._record_cancelled_attempt(self)
+            self.events.put(("done", self))
+
 
 class AIResponseThread(QThread):
     response_received = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
+    metrics_recorded = pyqtSignal(dict)
     
-    def __init__(self, client: Anthropic, message: str, conversation_history: list, memory: dict, model_config: dict):
+    def __init__(self, client, message: str, conversation_history: list, memory: dict, model_config: dict,
+                 metrics=None, purpose="chat", memory_revision=None, pipeline=None,
+                 message_list=None, scheduler=None, fallback_configs=None, route=None, profile=None):
         super().__init__()
         self.client = client
         self.message = message
         self.conversation_history = conversation_history
         self.memory = memory
         self.model_config = model_config  # Configurazione modello completa
+        # Profilo di generazione (max_tokens, temperatura, stop, cosa includere); predefinito: chat
+        self.profile = profile or resolve_profile("chat", model_config)
+        # Modelli di riserva (campo "fallback" di models.json), in ordine
+        self.fallback_configs = list(fallback_configs or ())
+        # RouteDecision del router: model_config è già quello del modello veloce
+        self.route = route
+        self.metrics = metrics  # MetricsRecorder opzionale
+        self.purpose = purpose
+        # Revisione della memoria: se nota, il messaggio di memoria costruito al turno prima viene riusato
+        self.memory_revision = memory_revision
+        self.pipeline = pipeline or chat_pipeline
+        # IncrementalMessages della conversazione: a ogni turno si aggiungono solo i messaggi nuovi
+        self.message_list = message_list
+        # JobScheduler condiviso: la richiesta parte quando ottiene un posto per la sua classe
+        self.scheduler = scheduler
+        self.job_class = job_class_for(purpose)
+        self.stage_sizes = {}
+        self.created_at = time.monotonic()
+    
+    def build_messages(self):
+        """Costruisce la lista dei messaggi da inviare all'API (vedi prompt_pipeline.py)."""
+        builder = self.message_list or self.pipeline
+        include_memory = self.profile["include_memory"]
+        messages, self.stage_sizes = builder.build({
+            "preferences": self.model_config.get('preferences_prompt') if self.profile["include_preferences"] else None,
+            "memory": self.memory if include_memory else None,
+            "memory_revision": self.memory_revision if include_memory else None,
+            "history": self.conversation_history,
+            "message": self.message,
+        })
+        return messages
     
     def run(self):
+        if self.scheduler is None:
+            self._run()
+            return
         try:
-            print(f"\n=== THREAD RUN AVVIATO ===")
-            print(f"Modello selezionato: {self.model_config['api_model']}")
-            print(f"Messaggio: '{self.message}'")
-            
-            messages = []
-            
-            # AGGIUNGI IL PROMPT PREFERENZE COME PRIMO MESSAGGIO
-            if self.model_config.get('preferences_prompt'):
-                messages.append({
-                    "role": "user", 
-                    "content": f"PROMPT INIZIALE: {self.model_config['preferences_prompt']}"
-                })
-            
-            # Aggiungi memoria se presente
-            if self.memory:
-                memory_context = f"MEMORIA PERSISTENTE: {json.dumps(self.memory, ensure_ascii=False)}"
-                messages.append({
-                    "role": "user",
-                    "content": memory_context
-                })
-                           
-            # Aggiungi cronologia conversazione
-            for msg in self.conversation_history:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Aggiungi messaggio corrente
-            messages.append({
-                "role": "user",
-                "content": self.message
-            })
+            with self.scheduler.slot(self.job_class):
+                self._run()
+        except JobCancelled:
+            # Annullata mentre era in coda (chiusura dell'app): nessuna risposta da consegnare
+            log_event(logger, logging.INFO, "request.cancelled", purpose=self.purpose, job_class=self.job_class)
+    
+    def _run(self):
+        started = time.monotonic()
+        stats = {"model": self.model_config['api_model'], "purpose": self.purpose, "job_class": self.job_class,
+                 "profile": self.profile["name"],
+                 "queue_wait": started - self.created_at, "retries": 0}
+        try:
+            messages = self.build_messages()
+            stats["prompt_chars"] = self.stage_sizes
             
-            print(f"DEBUG: Chiamando modello: {self.model_config['api_model']}")
+            log_event(logger, logging.DEBUG, "request.start", model=stats["model"], purpose=self.purpose,
+                      message=self.message, messages=len(messages), queue_wait=stats["queue_wait"],
+                      stage_sizes=self.stage_sizes)
             
-            response = self.client.messages.create(
-                model=self.model_config['api_model'],
-                max_tokens=3000,
-                messages=messages
-            )
-            self.response_received.emit(response.content[0].text)
+            response = self._request(messages, stats, started)
+            usage = response.usage
+            stats.update(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens,
+                         cache_read_tokens=getattr(usage, 'cache_read_input_tokens', None) or 0,
+                         cache_write_tokens=getattr(usage, 'cache_creation_input_tokens', None) or 0)
+            stats["latency"] = time.monotonic() - started
+            if self.route is not None and self.route.routed:
+                self._record_route(stats)
+            self._record(stats)
+            log_event(logger, logging.INFO, "request.done", **{k: v for k, v in stats.items() if k != "queue_wait"})
+            self._emit(response)
         except Exception as e:
+            stats["latency"] = time.monotonic() - started
+            stats["error"] = str(e)
+            self._record(stats)
+            log_event(logger, logging.ERROR, "request.error", **stats)
             self.error_occurred.emit(f"Errore API: {str(e)}")
+    
+    def _request(self, messages, stats, started):
+        """Esegue la richiesta (con catena di fallback se configurata) e restituisce la risposta."""
+        if self.fallback_configs:
+            return self._stream_with_fallback(messages, stats, started)
+        return self._stream_with_retries(messages, stats, started)
+    
+    def _emit(self, response):
+        self.response_received.emit(response.content[0].text)
+    
+    def request_extra(self):
+        """Parametri aggiuntivi della richiesta (es. strumenti); le sottoclassi li estendono."""
+        return {}
+    
+    def hedge_delay(self):
+        """
+        Secondi di attesa del primo token prima di far partire anche il
+        fallback: il percentile hedge_percentile dei tempi al primo token
+        recenti del modello. None se il modello non lo chiede (la seconda
+        richiesta si paga).
+        """
+        pct = self.model_config.get('hedge_percentile')
+        if not pct or self.job_class != "interactive":
+            return None
+        delay = None
+        if self.metrics:
+            delay = self.metrics.recent_percentile(self.model_config['api_model'], pct, "ttft", HEDGE_MIN_SAMPLES)
+        return max(HEDGE_MIN_DELAY, delay) if delay is not None else HEDGE_DEFAULT_DELAY
+    
+    def _stream_with_fallback(self, messages, stats, started):
+        """
+        Catena di fallback con hedging. Parte il modello principale; se fallisce
+        (sovraccarico, errori ripetuti) prima di rispondere si passa al successivo
+        della catena. Per la chat, se il primo token non arriva entro
+        hedge_delay() parte in parallelo anche il modello di riserva: vince chi
+        produce per primo un token e l'altra richiesta viene annullata.
+        """
+        chain = [self.model_config] + self.fallback_configs
+        events = queue.Queue()
+        attempts = []
+
+        def launch():
+            attempt = _Attempt(chain[len(attempts)], events, can_fall_back=len(attempts) + 1 < len(chain))
+            attempts.append(attempt)
+            threading.Thread(target=attempt.run, args=(self, messages, started), daemon=True).start()
+
+        launch()
+        delay = self.hedge_delay()
+        hedge_at = started + delay if delay is not None else None
+        winner = None
+        while True:
+            timeout = None
+            if hedge_at is not None and winner is None and len(attempts) == 1 and len(chain) > 1:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            try:
+                kind, attempt = events.get(timeout=timeout)
+            except queue.Empty:
+                log_event(logger, logging.INFO, "request.hedge", model=stats["model"],
+                          fallback=chain[1]['api_model'], after=delay)
+                stats["hedged"] = True
+                launch()
+                continue
+
+            if kind == "token":
+                if winner is None:
+                    winner = attempt
+                    for other in attempts:
+                        if other is not attempt:
+                            other.cancel()
+                continue
+            if attempt is winner or (winner is None and attempt.error is None):
+                break
+            if winner is not None or any(not other.done for other in attempts):
+                continue  # Richiesta annullata, o l'altra della gara è ancora in corso
+            if attempt.can_fall_back and _is_retryable(attempt.error):
+                log_event(logger, logging.WARNING, "request.fallback", model=attempt.stats["model"],
+                          fallback=chain[len(attempts)]['api_model'], error=str(attempt.error))
+                launch()
+                continue
+            break  # Nessun modello della catena ha risposto
+
+        for other in attempts:
+            if other is not attempt and not other.done:
+                other.cancel()
+        if attempt.model_config is not self.model_config:
+            stats["requested_model"] = stats["model"]
+        stats["model"] = attempt.stats["model"]
+        stats["retries"] = sum(other.stats["retries"] for other in attempts)
+        stats["attempts"] = len(attempts)
+        if "ttft" in attempt.stats:
+            stats["ttft"] = attempt.stats["ttft"]
+        if attempt.error is not None:
+            raise attempt.error
+        return attempt.response
+    
+    def _stream_with_retries(self, messages, stats, started, model_config=None, attempt=None):
+        """
+        Chiamata in streaming (per misurare il tempo al primo token) con
+        ritentativi. Con attempt (_Attempt) la richiesta è una della catena di
+        fallback: segnala il primo token e si interrompe se viene annullata
+        (prima di ogni tentativo, durante le attese e chiudendo lo stream).
+        """
+        model_config = model_config or self.model_config
+        client = self.client.with_options(max_retries=0)
+        while True:
+            if attempt and attempt.cancelled.is_set():
+                raise RequestCancelled(stats["model"])
+            try:
+                with client.messages.stream(
+                    model=model_config['api_model'],
+                    messages=messages,
+                    **request_options(self.profile),
+                    **self.request_extra()
+                ) as stream:
+                    if attempt:
+                        attempt.stream = stream
+                        if attempt.cancelled.is_set():  # Annullata mentre lo stream si apriva
+                            raise RequestCancelled(stats["model"])
+                    return self._consume_stream(stream, stats, started, attempt)
+            except Exception as e:
+                # Stream chiuso dall'annullamento: l'errore di lettura non va ritentato
+                if attempt and attempt.cancelled.is_set():
+                    if isinstance(e, RequestCancelled):
+                        raise
+                    raise RequestCancelled(stats["model"]) from e
+                # Dopo il primo token la risposta è già parziale: non si ritenta
+                if "ttft" in stats or stats["retries"] >= MAX_RETRIES or not _is_retryable(e):
+                    raise
+                # Con un modello di riserva il sovraccarico passa subito al fallback
+                if attempt and attempt.can_fall_back and _is_overloaded(e):
+                    raise
+                stats["retries"] += 1
+                log_event(logger, logging.WARNING, "request.retry", model=stats["model"],
+                          attempt=stats["retries"], error=str(e))
+                delay = RETRY_BASE_DELAY * 2 ** (stats["retries"] - 1)
+                if attempt is None:
+                    time.sleep(delay)
+                elif attempt.cancelled.wait(delay):
+                    raise RequestCancelled(stats["model"])
+    
+    def _consume_stream(self, stream, stats, started, attempt=None):
+        """Legge lo stream di testo fino alla fine e restituisce il messaggio completo."""
+        for text in stream.text_stream:
+            self._on_chunk(stats, started, attempt)
+            log_event(logger, logging.DEBUG, "request.chunk", model=stats["model"], text=text)
+        return stream.get_final_message()
+    
+    def _on_chunk(self, stats, started, attempt):
+        """Per ogni chunk: interrompe le richieste annullate e segna il tempo al primo token."""
+        if attempt and attempt.cancelled.is_set():
+            raise RequestCancelled(stats["model"])
+        if "ttft" not in stats:
+            stats["ttft"] = time.monotonic() - started
+            if attempt:
+                attempt.first_token()
+    
+    def _record_route(self, stats):
+        """Registra il risparmio del router: latenza mediana recente del modello scelto meno quella ottenuta."""
+        requested = self.route.requested_config['api_model']
+        stats["routed_from"] = requested
+        stats["route_reason"] = self.route.reason
+        baseline = None
+        if self.metrics:
+            baseline = self.metrics.recent_percentile(requested, 50, "latency", ROUTE_BASELINE_SAMPLES)
+        if baseline is not None:
+            stats["route_saving"] = baseline - stats["latency"]
+        log_event(logger, logging.INFO, "router.saving", requested=requested, model=stats["model"],
+                  reason=self.route.reason, latency=stats["latency"], baseline=baseline,
+                  saving=stats.get("route_saving"))
+    
+    def _record_cancelled_attempt(self, attempt):
+        """
+        Registra la richiesta che ha perso la gara (hedging o fallback
+        annullato) con i token consumati: anche lei ha un costo.
+        """
+        input_tokens, output_tokens = attempt.usage()
+        entry = {"model": attempt.stats["model"], "purpose": self.purpose, "job_class": self.job_class,
+                 "profile": self.profile["name"], "retries": attempt.stats["retries"],
+                 "input_tokens": input_tokens, "output_tokens": output_tokens, "cancelled": True}
+        log_event(logger, logging.INFO, "request.cancelled_attempt", **entry)
+        self._record(entry)
+    
+    def _record(self, stats):
+        if self.metrics:
+            self.metrics_recorded.emit(self.metrics.record(stats))
@@ -1,13 +1,16 @@
 import os
 import sys
-from dotenv import load_dotenv
-from anthropic import Anthropic
 from PyQt5.QtWidgets import QMessageBox
 
 def setup_anthropic_client():
     """
     Carica la chiave API Anthropic e inizializza il client.
+    Gli import di dotenv e anthropic avvengono qui, al primo invio, per non
+    rallentare l'avvio della finestra.
     """
+    from dotenv import load_dotenv
+    from anthropic import Anthropic
+    
     load_dotenv()
     api_key = os.getenv('ANTHROPIC_API_KEY')
     if not api_key:
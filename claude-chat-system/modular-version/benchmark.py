@@ -0,0 +1,299 @@
+"""
+Benchmark del sistema di chat contro il server finto della Messages API
+(fake_anthropic_server.py), senza rete. Misura:
+  - turn_latency: latenza end-to-end di un turno tramite AIResponseThread
+  - prompt_assembly: costruzione e serializzazione dei messaggi al crescere della cronologia
+    (e costruzione incrementale della lista, come nella GUI)
+  - consolidation: aggiornamento della memoria (diff, cronologia, scrittura) al crescere della memoria
+  - gui_append: aggiunta di un messaggio alla chat al crescere della trascrizione
+
+Uso:
+    python benchmark.py --output bench_report.json
+    python benchmark.py --only prompt_assembly consolidation --baseline bench_report.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from chat_message import ChatMessage
+from fake_anthropic_server import FakeAnthropicServer, add_server_arguments, config_from_args
+
+BENCHMARKS = ("turn_latency", "prompt_assembly", "consolidation", "gui_append")
+HISTORY_LENGTHS = (0, 10, 50, 200, 1000)
+MEMORY_SIZES = (10, 100, 1000, 5000)
+TRANSCRIPT_LENGTHS = (0, 100, 500, 2000)
+MODELS_FILE = "models.json"
+
+SAMPLE_USER_TEXT = "Ciao Claudia, oggi ho finito il modulo di Python per la classe terza e vorrei un parere."
+SAMPLE_AI_TEXT = ("Che bello! Raccontami come hai strutturato gli esercizi: partirei da esempi concreti "
+                  "e poi passerei ai cicli, magari con un piccolo progetto finale da fare in coppia.")
+
+
+def percentile(values, pct):
+    """Percentile con il metodo nearest-rank (valori già in secondi)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples):
+    """Statistiche di una serie di durate in secondi."""
+    if not samples:
+        return {"n": 0}
+    return {
+        "n": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "min": min(samples),
+        "max": max(samples),
+    }
+
+
+def load_model_config(models_file=MODELS_FILE):
+    """Configurazione del modello selezionato in models.json (o una sintetica)."""
+    try:
+        with open(models_file, 'r', encoding='utf-8') as f:
+            models = json.load(f)
+        for name, config in models.items():
+            if config.get('selected'):
+                return name, config
+        return next(iter(models.items()))
+    except (OSError, ValueError, StopIteration):
+        return "Benchmark", {"api_model": "claude-sonnet-4-20250514", "preferences_prompt": "Prompt di prova."}
+
+
+def synthetic_history(length):
+    return [ChatMessage("user", SAMPLE_USER_TEXT) if i % 2 == 0 else ChatMessage("assistant", SAMPLE_AI_TEXT)
+            for i in range(length)]
+
+
+def synthetic_memory(size):
+    """Memoria con `size` voci distribuite tra progetti e note."""
+    return {
+        "profilo_utente": "Luca - Insegnante di scuola media, funzione strumentale di informatica",
+        "progetti_attivi": [f"Progetto {i}: chat con memoria persistente" for i in range(size // 4)],
+        "preferenze": ["Comunicazione diretta", "Italiano"],
+        "note_varie": [f"Nota {i}: dettaglio ricordato durante una sessione precedente" for i in range(size - size // 4)],
+        "ultimo_aggiornamento": "",
+        "sessioni_totali": 0,
+    }
+
+
+def bench_turn_latency(args, model_config):
+    from anthropic import Anthropic
+    from ai_thread import AIResponseThread
+    from metrics import MetricsRecorder
+
+    recorder = MetricsRecorder(log_file=None)
+    history = []
+    memory = synthetic_memory(20)
+    errors = 0
+    samples = []
+    with FakeAnthropicServer(config_from_args(args)) as server:
+        client = Anthropic(api_key="finta", base_url=server.base_url)
+        for _ in range(args.turns):
+            result = {}
+            thread = AIResponseThread(client, SAMPLE_USER_TEXT, history, memory, model_config, metrics=recorder)
+            thread.response_received.connect(lambda text: result.update(text=text))
+            thread.error_occurred.connect(lambda error: result.update(error=error))
+            started = time.perf_counter()
+            thread.run()  # Eseguito nel thread corrente: si misura il turno, non lo scheduling di Qt
+            samples.append(time.perf_counter() - started)
+            if "error" in result:
+                errors += 1
+                continue
+            history.extend([ChatMessage("user", SAMPLE_USER_TEXT), ChatMessage("assistant", result["text"])])
+        server_stats = dict(server.config.stats)
+
+    ttft = [entry["ttft"] for entry in recorder.recent if entry.get("ttft") is not None]
+    return {
+        "turns": args.turns,
+        "errors": errors,
+        "latency": summarize(samples),
+        "ttft": summarize(ttft),
+        # Tempo speso dal client oltre alla latenza simulata del server
+        "client_overhead_p50": (summarize(samples)["p50"] - args.latency) if samples else None,
+        "server": server_stats,
+    }
+
+
+def bench_prompt_assembly(args, model_config):
+    from ai_thread import AIResponseThread
+    from prompt_pipeline import IncrementalMessages
+
+    memory = synthetic_memory(50)
+    results = []
+    for length in HISTORY_LENGTHS:
+        # Revisione fissa: come nella GUI, la memoria invariata non viene riserializzata a ogni turno
+        thread = AIResponseThread(None, SAMPLE_USER_TEXT, synthetic_history(length), memory, model_config,
+                                  memory_revision=("benchmark", length))
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            messages = thread.build_messages()
+            body = json.dumps({"model": model_config['api_model'], "messages": messages}, ensure_ascii=False, default=dict)
+            samples.append(time.perf_counter() - started)
+        stage_chars = thread.stage_sizes
+
+        # Lista incrementale della GUI: a ogni turno entrano solo domanda e risposta nuove
+        history = synthetic_history(length)
+        thread = AIResponseThread(None, SAMPLE_USER_TEXT, history, memory, model_config,
+                                  memory_revision=("benchmark", length), message_list=IncrementalMessages())
+        thread.build_messages()
+        incremental = []
+        for _ in range(args.repeat):
+            history.extend([ChatMessage("user", SAMPLE_USER_TEXT), ChatMessage("assistant", SAMPLE_AI_TEXT)])
+            started = time.perf_counter()
+            thread.build_messages()
+            incremental.append(time.perf_counter() - started)
+        results.append({"history_length": length, "request_bytes": len(body.encode('utf-8')),
+                        "stage_chars": stage_chars, "incremental": summarize(incremental),
+                        **summarize(samples)})
+    return results
+
+
+def bench_consolidation(args, model_config):
+    from memory_manager import MemoryManager
+    from prompt_pipeline import build_consolidation_prompt
+
+    history = synthetic_history(10)
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in MEMORY_SIZES:
+            memory_file = os.path.join(folder, f"memoria_{size}.json")
+            with open(memory_file, 'w', encoding='utf-8') as f:
+                json.dump(synthetic_memory(size), f, ensure_ascii=False, indent=2)
+            manager = MemoryManager(memory_file)
+            prompt_samples, update_samples = [], []
+            for i in range(args.repeat):
+                started = time.perf_counter()
+                build_consolidation_prompt(manager.get_memory_content(), history)
+                prompt_samples.append(time.perf_counter() - started)
+
+                updated = copy.deepcopy(manager.get_memory_content())
+                updated["note_varie"].append(f"Nuova nota {i}")
+                started = time.perf_counter()
+                manager.update_memory_data(updated, session_id="benchmark", model=model_config['api_model'])
+                update_samples.append(time.perf_counter() - started)
+            results.append({"memory_items": size, "file_bytes": os.path.getsize(memory_file),
+                            "prompt": summarize(prompt_samples), "update": summarize(update_samples)})
+    return results
+
+
+def bench_gui_append(args, model_config):
+    from types import SimpleNamespace
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication, QTextEdit
+    from gui import MemoryChatGUI
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = []
+    for length in TRANSCRIPT_LENGTHS:
+        host = SimpleNamespace(chat_display=QTextEdit())
+        for i in range(length):
+            MemoryChatGUI.add_message_to_chat(host, "Tu" if i % 2 == 0 else "Claudia",
+                                              SAMPLE_USER_TEXT if i % 2 == 0 else SAMPLE_AI_TEXT, "#2196F3")
+        app.processEvents()
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            MemoryChatGUI.add_message_to_chat(host, "Claudia", SAMPLE_AI_TEXT, "#2196F3")
+            app.processEvents()
+            samples.append(time.perf_counter() - started)
+        results.append({"transcript_length": length, **summarize(samples)})
+        host.chat_display.deleteLater()
+    return results
+
+
+def _series_key(entry):
+    for key in ("history_length", "memory_items", "transcript_length"):
+        if key in entry:
+            return f"{key}={entry[key]}"
+    return ""
+
+
+def _p50_points(report):
+    """Punti confrontabili del report: {(benchmark, serie, metrica): p50}."""
+    points = {}
+    for name, result in report.get("benchmarks", {}).items():
+        entries = result if isinstance(result, list) else [result]
+        for entry in entries:
+            for metric, value in entry.items():
+                if isinstance(value, dict) and value.get("p50") is not None:
+                    points[(name, _series_key(entry), metric)] = value["p50"]
+            if entry.get("p50") is not None:
+                points[(name, _series_key(entry), "time")] = entry["p50"]
+    return points
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Confronta le mediane con un report precedente; restituisce le regressioni."""
+    current, previous = _p50_points(report), _p50_points(baseline)
+    regressions = []
+    for key, value in current.items():
+        old = previous.get(key)
+        if old and value > old * (1 + tolerance):
+            regressions.append({"benchmark": key[0], "series": key[1], "metric": key[2],
+                                "baseline_p50": old, "p50": value, "ratio": value / old})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del sistema di chat")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--turns", type=int, default=20, help="Turni per turn_latency")
+    parser.add_argument("--repeat", type=int, default=30, help="Ripetizioni per punto di misura")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--baseline", help="Report precedente con cui confrontare le mediane")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Peggioramento accettato (0.25 = +25%%)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    model_name, model_config = load_model_config()
+    runners = {
+        "turn_latency": bench_turn_latency,
+        "prompt_assembly": bench_prompt_assembly,
+        "consolidation": bench_consolidation,
+        "gui_append": bench_gui_append,
+    }
+    report = {
+        "generated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "model": model_name, "api_model": model_config['api_model']},
+        "server": {"latency": args.latency, "jitter": args.jitter, "chunk_rate": args.chunk_rate,
+                   "response_words": args.response_words, "error_rate": args.error_rate,
+                   "rate_limit": args.rate_limit},
+        "benchmarks": {},
+    }
+    for name in args.only:
+        print(f"⏱️  {name}...")
+        report["benchmarks"][name] = runners[name](args, model_config)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report["regressions"] = compare_with_baseline(report, baseline, args.tolerance)
+        for item in report["regressions"]:
+            print(f"❌ {item['benchmark']} {item['series']} {item['metric']}: "
+                  f"{item['baseline_p50'] * 1000:.2f}ms → {item['p50'] * 1000:.2f}ms (x{item['ratio']:.2f})")
+        exit_code = 1 if report["regressions"] else 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Report salvato in {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = "chat.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+ROOT_LOGGER = "chat"
+
+# Campi che contengono testo della conversazione: nel log finisce solo la lunghezza
+REDACTED_FIELDS = ("message", "content", "prompt", "response", "text", "memory")
+_SECRET_PATTERN = re.compile(r"sk-ant-[A-Za-z0-9_\-]+")
+
+# Eventi ad alto volume: ne viene registrato uno ogni N
+SAMPLE_EVERY = {
+    "request.chunk": 50,
+    "memory.watch": 10,
+}
+
+_listener = None
+
+
+def get_logger(name):
+    """Logger di un modulo dell'applicazione (figlio di "chat")."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_event(logger, level, event, **fields):
+    """Registra un evento strutturato: nome dell'evento più campi chiave/valore."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
+
+
+class RedactionFilter(logging.Filter):
+    """Sostituisce i testi della conversazione con la loro lunghezza e maschera le chiavi API."""
+    def __init__(self, enabled=True):
+        super().__init__()
+        self.enabled = enabled
+
+    def filter(self, record):
+        fields = getattr(record, "fields", None)
+        if self.enabled and fields:
+            record.fields = {key: (f"<redatto: {len(str(value))} caratteri>"
+                                   if key in REDACTED_FIELDS and value is not None else value)
+                             for key, value in fields.items()}
+        if isinstance(record.msg, str):
+            record.msg = _SECRET_PATTERN.sub("sk-ant-***", record.msg)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lascia passare un evento ad alto volume ogni N (sempre se WARNING o superiore)."""
+    def __init__(self, sample_every=None):
+        super().__init__()
+        self.sample_every = dict(SAMPLE_EVERY if sample_every is None else sample_every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        every = self.sample_every.get(getattr(record, "event", None))
+        if not every or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self._counts.get(record.event, 0)
+            self._counts[record.event] = count + 1
+        return count % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record: ora, livello, modulo, evento e campi."""
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """QueueHandler che conserva il traceback come campo (prepare() scarta exc_info)."""
+    def prepare(self, record):
+        if record.exc_info:
+            record.fields = dict(getattr(record, "fields", None) or {},
+                                 exc=logging.Formatter().formatException(record.exc_info))
+        return super().prepare(record)
+
+
+def setup_logging(level=None, log_file=LOG_FILE, console=None, redact=None):
+    """
+    Configura il logging dell'applicazione. I record passano da una coda:
+    chi registra non fa mai I/O, la scrittura su file (JSON a rotazione) e
+    sulla console avviene nel thread del QueueListener.
+
+    Variabili d'ambiente: LOG_LEVEL (predefinito INFO, DEBUG con DEBUG_MODE=true)
+    e LOG_CONTENT=true per non redarre i testi (solo per il debug locale).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    debug_mode = os.getenv("DEBUG_MODE", "false").lower() == "true"
+    if level is None:
+        level = os.getenv("LOG_LEVEL", "DEBUG" if debug_mode else "INFO").upper()
+    if console is None:
+        console = debug_mode
+    if redact is None:
+        redact = os.getenv("LOG_CONTENT", "false").lower() != "true"
+
+    handlers = []
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(JsonFormatter())
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    # I filtri girano prima dell'accodamento: i testi non escono mai dal thread chiamante
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(RedactionFilter(enabled=redact))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.propagate = False
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Svuota la coda e chiude i file di log."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    _listener = None
@@ -0,0 +1,87 @@
+import uuid
+from datetime import datetime
+
+from prompt_pipeline import IncrementalMessages
+from session_journal import SessionJournal, recording_enabled
+
+
+def new_session_id():
+    """Identificativo della sessione, registrato nella cronologia della memoria."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+class ChatSession:
+    """
+    Stato di una conversazione (una scheda della finestra): persona in uso,
+    cronologia, messaggi mostrati e journal. Client, metriche e memorie
+    sono della finestra e condivisi tra le schede. La chat visibile è una
+    sola e viene ridisegnata dalla trascrizione al cambio di scheda, così
+    una scheda inattiva tiene solo questi oggetti compatti.
+    """
+    def __init__(self, model_name, model_config, memory_manager):
+        self.session_id = new_session_id()
+        self.model_name = model_name
+        self.model_config = model_config
+        self.memory_manager = memory_manager
+        self.history = []        # ChatMessage dei turni completi
+        self.transcript = []     # (mittente, colore, ChatMessage) mostrati nella chat
+        self.pending_message = None  # Messaggio utente in attesa di risposta
+        self.message_list = None     # IncrementalMessages, solo mentre la scheda è attiva
+        self.journal = None
+        self.busy = False
+        self.unread = False
+        self.draft = ""
+        self.topic = None        # Titolo generato dal primo scambio ("" mentre è in corso)
+        self.memory_turns = set()  # Indici in history dei messaggi utente da ricordare (memory_filter.py)
+
+    @property
+    def ai_name(self):
+        return "Claudia" if "Sonnet 4" in self.model_name else self.model_name
+
+    @property
+    def color(self):
+        return "#2196F3" if "Sonnet 4" in self.model_name else "#FF9800"
+
+    @property
+    def title(self):
+        title = f"{self.ai_name}: {self.topic}" if self.topic else self.ai_name
+        return f"● {title}" if self.unread else title
+
+    def set_persona(self, model_name, model_config, memory_manager):
+        self.model_name = model_name
+        self.model_config = model_config
+        self.memory_manager = memory_manager
+
+    def messages(self):
+        """Lista incrementale dei messaggi per l'API (ricreata se la scheda era inattiva)."""
+        if self.message_list is None:
+            self.message_list = IncrementalMessages()
+        return self.message_list
+
+    def open_journal(self):
+        """Registra la sessione per replay.py (solo con RECORD_SESSIONS=true)."""
+        if recording_enabled():
+            self.journal = SessionJournal(self.session_id, self.memory_manager.get_memory_content())
+
+    def suspend(self, draft=""):
+        """Scheda non più attiva: conserva la bozza e libera la lista per l'API."""
+        self.draft = draft
+        if not self.busy:
+            self.message_list = None
+
+    def restart(self):
+        """Nuova sessione nella stessa scheda (chat pulita); la memoria resta."""
+        self.close()
+        self.session_id = new_session_id()
+        self.history = []
+        self.transcript = []
+        self.pending_message = None
+        self.message_list = None
+        self.topic = None
+        self.memory_turns = set()
+        self.open_journal()
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
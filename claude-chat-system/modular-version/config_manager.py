@@ -1,7 +1,13 @@
 import json
+import logging
 import sys
 from PyQt5.QtWidgets import QMessageBox
 
+from chat_logging import get_logger, log_event
+from generation_profiles import resolve_profile
+
+logger = get_logger("config")
+
 class ModelConfigManager:
     def __init__(self, models_file="models.json"):
         self.models_file = models_file
@@ -14,6 +20,8 @@ class ModelConfigManager:
             with open(self.models_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
+            logger.exception("config.load_failed", extra={"event": "config.load_failed",
+                                                           "fields": {"file": self.models_file}})
             QMessageBox.critical(None, "Errore Caricamento Configurazione", 
                                  f"Impossibile caricare {self.models_file}: {str(e)}")
             sys.exit(1)
@@ -33,6 +41,32 @@ class ModelConfigManager:
         name = model_name if model_name else self.current_model_name
         return self.models_config.get(name)
 
+    def get_fallback_configs(self, model_name=None):
+        """Configurazioni dei modelli di riserva (campo "fallback"), nell'ordine della catena."""
+        config = self.get_model_config(model_name) or {}
+        fallbacks = []
+        for name in config.get('fallback', []):
+            fallback_config = self.models_config.get(name)
+            if fallback_config is None:
+                log_event(logger, logging.WARNING, "config.fallback_not_found", model=model_name, fallback=name)
+                continue
+            fallbacks.append(fallback_config)
+        return fallbacks
+
+    def get_generation_profile(self, task, model_name=None):
+        """
+        Profilo di generazione `task` (vedi generation_profiles.py) con le modifiche
+        del modello indicato. Restituisce (profilo, nome e configurazione del modello
+        che esegue il lavoro): quello del profilo se configurato, altrimenti model_name.
+        """
+        name = model_name or self.current_model_name
+        profile = resolve_profile(task, self.get_model_config(name))
+        if profile["model"] and profile["model"] in self.models_config:
+            name = profile["model"]
+        elif profile["model"]:
+            log_event(logger, logging.DEBUG, "config.profile_model_missing", profile=task, model=profile["model"])
+        return profile, name, self.models_config.get(name)
+
     def save_models_config(self):
         """Salva la configurazione dei modelli nel file JSON."""
         with open(self.models_file, 'w', encoding='utf-8') as f:
@@ -49,7 +83,9 @@ class ModelConfigManager:
             self.models_config[new_model_name]['selected'] = True
             self.current_model_name = new_model_name
             self.save_models_config()
+            log_event(logger, logging.DEBUG, "config.model_selected", model=new_model_name)
             return True
+        log_event(logger, logging.WARNING, "config.model_not_found", model=new_model_name)
         return False
         
     def get_all_model_names(self):
@@ -0,0 +1,222 @@
+"""
+Server locale che imita la Messages API di Anthropic (POST /v1/messages),
+per benchmark e test di carico senza rete né costi.
+
+Uso:
+    python fake_anthropic_server.py --port 8765 --latency 0.3 --chunk-rate 40 --rate-limit 0.05
+
+e poi avviare la chat (o benchmark.py / replay.py) con
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=finta
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM = ("la memoria persistente permette di ricordare progetti preferenze e note tra una sessione "
+         "e l'altra mentre il modello risponde in modo naturale e coerente con il profilo").split()
+
+
+class FakeAPIConfig:
+    """Comportamento del server: latenza, velocità dello streaming ed errori iniettati."""
+    def __init__(self, latency=0.2, jitter=0.0, chunk_rate=50.0, words_per_chunk=3, response_words=60,
+                 error_rate=0.0, rate_limit_rate=0.0, overload_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency                  # secondi prima del primo byte
+        self.jitter = jitter                    # variazione casuale della latenza (+/- secondi)
+        self.chunk_rate = chunk_rate            # chunk SSE al secondo (0 = tutti insieme)
+        self.words_per_chunk = words_per_chunk
+        self.response_words = response_words
+        self.error_rate = error_rate            # probabilità di errore 500
+        self.rate_limit_rate = rate_limit_rate  # probabilità di 429
+        self.overload_rate = overload_rate      # probabilità di 529 (modello sovraccarico)
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0, "overloaded": 0}
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def roll(self):
+        with self._lock:
+            return self.random.random()
+
+
+def estimate_tokens(text):
+    """Stima grossolana (circa 4 caratteri per token), sufficiente per le metriche."""
+    return max(1, len(text) // 4)
+
+
+def _response_words(config):
+    return [LOREM[i % len(LOREM)] for i in range(config.response_words)]
+
+
+def make_handler(config):
+    class FakeMessagesHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_event(self, event, data):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/v1/messages":
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            config.count("requests")
+
+            roll = config.roll()
+            if roll < config.rate_limit_rate:
+                config.count("rate_limited")
+                self._send_json(429, {"type": "error", "error": {"type": "rate_limit_error",
+                                                                 "message": "Rate limit simulato"}},
+                                {"retry-after": str(config.retry_after)})
+                return
+            if roll < config.rate_limit_rate + config.error_rate:
+                config.count("errors")
+                self._send_json(500, {"type": "error", "error": {"type": "api_error", "message": "Errore simulato"}})
+                return
+            if roll < config.rate_limit_rate + config.error_rate + config.overload_rate:
+                config.count("overloaded")
+                self._send_json(529, {"type": "error", "error": {"type": "overloaded_error",
+                                                                 "message": "Sovraccarico simulato"}})
+                return
+
+            delay = config.latency + (config.jitter * (2 * config.roll() - 1) if config.jitter else 0)
+            time.sleep(max(0.0, delay))
+
+            input_tokens = estimate_tokens(json.dumps(request.get("messages", []), ensure_ascii=False))
+            words = _response_words(config)
+            text = " ".join(words)
+            output_tokens = estimate_tokens(text)
+            message = {
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model", "fake-model"),
+                "content": [],
+                "stop_reason": None,
+                "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 0,
+                          "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0},
+            }
+            if not request.get("stream"):
+                message.update(content=[{"type": "text", "text": text}], stop_reason="end_turn")
+                message["usage"]["output_tokens"] = output_tokens
+                self._send_json(200, message)
+                return
+
+            config.count("streamed")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            self._send_event("message_start", {"type": "message_start", "message": message})
+            self._send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                     "content_block": {"type": "text", "text": ""}})
+            interval = 1.0 / config.chunk_rate if config.chunk_rate else 0
+            step = max(1, config.words_per_chunk)
+            for i in range(0, len(words), step):
+                chunk = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+                self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                         "delta": {"type": "text_delta", "text": chunk}})
+                if interval:
+                    time.sleep(interval)
+            self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self._send_event("message_delta", {"type": "message_delta",
+                                               "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                               "usage": {"output_tokens": output_tokens}})
+            self._send_event("message_stop", {"type": "message_stop"})
+
+    return FakeMessagesHandler
+
+
+class FakeAnthropicServer:
+    """Server finto avviabile in un thread (per i benchmark) o da riga di comando."""
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeAPIConfig()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.config))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def add_server_arguments(parser):
+    """Opzioni del server finto, condivise con benchmark.py e replay.py."""
+    parser.add_argument("--latency", type=float, default=0.2, help="Secondi prima del primo byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variazione casuale della latenza")
+    parser.add_argument("--chunk-rate", type=float, default=50.0, help="Chunk SSE al secondo (0 = senza pause)")
+    parser.add_argument("--response-words", type=int, default=60, help="Parole per risposta")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilità di errore 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Probabilità di errore 429")
+    parser.add_argument("--overload", type=float, default=0.0, help="Probabilità di errore 529 (sovraccarico)")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args):
+    return FakeAPIConfig(latency=args.latency, jitter=args.jitter, chunk_rate=args.chunk_rate,
+                         response_words=args.response_words, error_rate=args.error_rate,
+                         rate_limit_rate=args.rate_limit, overload_rate=args.overload, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server finto della Messages API di Anthropic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(config_from_args(args), args.host, args.port)
+    print(f"Server finto in ascolto su {server.base_url} (Ctrl+C per fermare)")
+    print(f"Avviare la chat con ANTHROPIC_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Richieste servite: {server.config.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Profili di generazione: parametri della richiesta per ogni tipo di lavoro.
+
+    model                nome del modello in models.json (None = quello della scheda)
+    max_tokens           lunghezza massima della risposta
+    temperature          None = predefinita dell'API
+    stop_sequences       sequenze che chiudono la risposta
+    include_preferences  invia il prompt iniziale della persona
+    include_memory       invia la memoria persistente
+
+Ogni modello di models.json può sovrascrivere i campi con la chiave "profiles":
+
+    "profiles": {"consolidation": {"max_tokens": 4000}, "title": {"model": "Haiku 3"}}
+
+I lavori in background non hanno bisogno della persona: il prompt di
+consolidamento contiene già la memoria, quindi non la ripete.
+"""
+
+GENERATION_PROFILES = {
+    "chat": {
+        "model": None, "max_tokens": 3000, "temperature": None, "stop_sequences": [],
+        "include_preferences": True, "include_memory": True,
+    },
+    "consolidation": {
+        "model": "Sonnet 4", "max_tokens": 3000, "temperature": 0.2, "stop_sequences": [],
+        "include_preferences": False, "include_memory": False,
+    },
+    "summarisation": {
+        "model": "Haiku 3.5", "max_tokens": 800, "temperature": 0.3, "stop_sequences": [],
+        "include_preferences": False, "include_memory": False,
+    },
+    "title": {
+        "model": "Haiku 3.5", "max_tokens": 20, "temperature": 0.3, "stop_sequences": ["\n"],
+        "include_preferences": False, "include_memory": False,
+    },
+}
+
+# `purpose` di AIResponseThread per ogni profilo (usato per le metriche e la coda)
+PROFILE_PURPOSES = {
+    "chat": "chat",
+    "consolidation": "memoria",
+    "summarisation": "riassunto",
+    "title": "titolo",
+}
+
+
+def resolve_profile(task, model_config=None):
+    """Profilo `task` con le eventuali modifiche del modello (chiave "profiles"); include "name"."""
+    if task not in GENERATION_PROFILES:
+        raise ValueError(f"Profilo di generazione sconosciuto: {task}")
+    overrides = ((model_config or {}).get('profiles') or {}).get(task) or {}
+    return {**GENERATION_PROFILES[task], **overrides, "name": task}
+
+
+def request_options(profile):
+    """Parametri della Messages API derivati dal profilo."""
+    options = {"max_tokens": profile["max_tokens"]}
+    if profile.get("temperature") is not None:
+        options["temperature"] = profile["temperature"]
+    if profile.get("stop_sequences"):
+        options["stop_sequences"] = list(profile["stop_sequences"])
+    return options
@@ -1,52 +1,367 @@
 import json
+import logging
+import os
 import sys
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                             QWidget, QTextEdit, QLineEdit, QPushButton, QLabel,
-                            QMessageBox, QSplitter, QGroupBox, QScrollArea, QComboBox, QToolBar)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
-from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor
+                            QMessageBox, QSplitter, QGroupBox, QScrollArea, QComboBox, QToolBar,
+                            QTabBar, QShortcut)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QFileSystemWatcher
+from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor, QKeySequence
 
 # Importa i moduli personalizzati
 from anthropic_client_setup import setup_anthropic_client
 from config_manager import ModelConfigManager
-from memory_manager import MemoryManager
+from memory_manager import MemoryStore
 from ai_thread import AIResponseThread
+from memory_consolidation import (MemoryConsolidationThread, CHUNK_TOKENS, history_tokens, chunk_history,
+                                  build_facts_prompt, parse_facts, merge_facts, build_reduce_prompt)
+from chat_message import ChatMessage
+from chat_session import ChatSession
+from prompt_pipeline import build_consolidation_prompt, build_title_prompt
+from generation_profiles import PROFILE_PURPOSES
+from metrics import MetricsRecorder
+from job_scheduler import JobScheduler
+from model_router import ModelRouter
+from memory_filter import MemoryFilter, prefilter_enabled, select_memory_turns
+from chat_logging import get_logger, log_event
+from startup_profiler import profiler
+
+logger = get_logger("gui")
+
+# Consolidamenti rifatti al massimo quando la memoria cambia in conflitto con l'aggiornamento
+CONSOLIDATION_RERUNS = 1
+# Titolo delle schede generato dal primo scambio: una richiesta in più per scheda, quindi spento di default
+AUTO_TITLES_ENV = "AUTO_TITLES"
+
+
+# Scopi delle richieste che aggiornano la memoria: all'uscita si aspettano con un messaggio dedicato
+MEMORY_PURPOSES = (PROFILE_PURPOSES["consolidation"], "estrazione")
+
+
+def auto_titles_enabled():
+    return os.getenv(AUTO_TITLES_ENV, "false").lower() == "true"
+
+
+def message_html(sender, message, color):
+    """HTML di un messaggio della chat (testo o ChatMessage)."""
+    if isinstance(message, ChatMessage):
+        timestamp = message.time_label()
+        message = message.content
+    else:
+        timestamp = datetime.now().strftime("%H:%M")
+    return f"""
+<div style="margin: 10px 0;">
+    <strong style="color: {color};">[{timestamp}] {sender}:</strong><br>
+    <span style="color: #FFFFFF; margin-left: 20px;">{message.replace(chr(10), '<br>')}</span>
+</div>
+        """
+
+
+class MemoryLoadThread(QThread):
+    """Carica la memoria della persona in background mentre la finestra è già visibile."""
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, memory_store, model_name, model_config):
+        super().__init__()
+        self.memory_store = memory_store
+        self.model_name = model_name
+        self.model_config = model_config
+    
+    def run(self):
+        try:
+            memory_manager = self.memory_store.for_model(self.model_name, self.model_config)
+        except Exception as e:
+            # Un'eccezione nel thread andrebbe persa e la finestra resterebbe in caricamento
+            logger.exception("memory.startup_failed", extra={"event": "memory.startup_failed",
+                                                              "fields": {"model": self.model_name}})
+            self.failed.emit(str(e))
+            return
+        self.loaded.emit(memory_manager)
+
 
 class MemoryChatGUI(QMainWindow):
     def __init__(self):
         super().__init__()
-        
-        self.client = setup_anthropic_client()
+
+        # Il client (e l'import di anthropic) viene creato al primo invio: vedi get_client()
+        self.client = None
         self.config_manager = ModelConfigManager()
-        self.memory_manager = MemoryManager()
-        
-        self.session_history = []
-        
-        # Imposta modello corrente
-        self.current_model_name = self.config_manager.current_model_name
-        self.current_model_config = self.config_manager.get_model_config()
-        
+        self.router = ModelRouter(self.config_manager)
+        self.memory_filter = MemoryFilter()
+
+        # Una ChatSession per scheda; client, metriche e memorie sono condivisi tra le schede
+        self.sessions = []
+        self.active_session = None
+        self.memory_watcher = None
+        # Thread in corso di tutte le schede (anche di quelle già chiuse)
+        self.running_threads = set()
+        # Chiusura in corso: l'app esce quando tutti i thread sono terminati
+        self.closing = False
+        # Errori di aggiornamento della memoria durante la chiusura, mostrati prima di uscire
+        self.exit_errors = []
+
+        # Memoria per persona: viene caricata solo quella del modello in uso,
+        # in background, così la finestra compare subito
+        self.memory_store = MemoryStore()
+        self.metrics = None
+        self.scheduler = None
+
         self.init_ui()
-        self.show_initial_message()
+        self.set_controls_enabled(False)
+        self.start_memory_load()
+
+    def start_memory_load(self):
+        self.status_label.setText("Caricamento memoria... ⏳")
+        self.memory_load_thread = MemoryLoadThread(self.memory_store, self.current_model_name,
+                                                   self.current_model_config)
+        self.memory_load_thread.loaded.connect(self.on_memory_loaded)
+        self.memory_load_thread.failed.connect(self.on_memory_load_failed)
+        self.memory_load_thread.start()
+
+    @property
+    def current_model_name(self):
+        """Modello della scheda attiva (prima della prima scheda, quello salvato in models.json)."""
+        if self.active_session:
+            return self.active_session.model_name
+        return self.config_manager.current_model_name
+
+    @property
+    def current_model_config(self):
+        if self.active_session:
+            return self.active_session.model_config
+        return self.config_manager.get_model_config()
+
+    @property
+    def memory_manager(self):
+        return self.active_session.memory_manager if self.active_session else None
+
+    def on_memory_loaded(self, memory_manager):
+        """Completa l'avvio quando la memoria è pronta."""
+        profiler.mark("memoria caricata")
+
+        # Metriche delle richieste: log JSONL a rotazione ed endpoint Prometheus opzionale
+        self.metrics = MetricsRecorder()
+        self.metrics.start_http_server_from_env()
+        # Coda con priorità condivisa dalle schede: la chat passa davanti ai consolidamenti
+        self.scheduler = JobScheduler(metrics=self.metrics)
+
+        self.add_session(memory_manager)
+        self.setup_memory_watcher()
+        self.set_controls_enabled(True)
+        self.status_label.setText("Pronta! 💙")
+        self.message_input.setFocus()
+        profiler.mark("pronta")
+        profiler.report()
+
+    def on_memory_load_failed(self, error):
+        """Memoria non caricata all'avvio (es. file bloccato da un altro programma): riprova o chiudi."""
+        self.status_label.setText(f"Errore caricamento memoria: {error} ❌")
+        reply = QMessageBox.critical(self, "Memoria non caricata",
+                                     f"Impossibile caricare la memoria:\n{error}\n\nVuoi riprovare?",
+                                     QMessageBox.Retry | QMessageBox.Close)
+        if reply == QMessageBox.Retry:
+            self.start_memory_load()
+        else:
+            self.close()
+
+    def memory_for(self, model_name, model_config):
+        """Memoria della persona, o None (con l'errore nello stato) se il file è bloccato da un altro programma."""
+        try:
+            return self.memory_store.for_model(model_name, model_config)
+        except TimeoutError as e:
+            log_event(logger, logging.WARNING, "memory.load_locked", model=model_name, error=str(e))
+            self.status_label.setText(f"Errore caricamento memoria: {e} ❌")
+            return None
+
+    def add_session(self, memory_manager=None):
+        """Apre una nuova scheda di chat con il modello usato per ultimo."""
+        model_name = self.config_manager.current_model_name
+        model_config = self.config_manager.get_model_config()
+        if memory_manager is None:
+            memory_manager = self.memory_for(model_name, model_config)
+            if memory_manager is None:
+                return None
+        session = ChatSession(model_name, model_config, memory_manager)
+        session.open_journal()
+        self.sessions.append(session)
+        self.show_initial_message(session)
+
+        self.session_tabs.blockSignals(True)
+        index = self.session_tabs.addTab(session.title)
+        self.session_tabs.setTabData(index, session)
+        self.session_tabs.setCurrentIndex(index)
+        self.session_tabs.blockSignals(False)
+        self.activate_session(session)
+        if self.memory_watcher:
+            self.watch_memory_files()
+        log_event(logger, logging.INFO, "session.opened", session=session.session_id,
+                  model=model_name, tabs=len(self.sessions))
+        return session
+
+    def on_tab_changed(self, index):
+        session = self.session_tabs.tabData(index)
+        if session is not None and session is not self.active_session:
+            self.activate_session(session)
+
+    def activate_session(self, session):
+        """Mostra la sessione: ridisegna la chat dalla trascrizione e aggiorna i comandi."""
+        previous = self.active_session
+        if previous is not None and previous is not session:
+            previous.suspend(self.message_input.toPlainText())
+        self.active_session = session
+        session.unread = False
+        self.refresh_tab(session)
+
+        self.chat_display.setHtml("".join(message_html(*entry) for entry in session.transcript))
+        self.chat_display.verticalScrollBar().setValue(self.chat_display.verticalScrollBar().maximum())
+        self.message_input.setPlainText(session.draft)
+
+        self.model_combo.blockSignals(True)
+        self.model_combo.setCurrentText(session.model_name)
+        self.model_combo.blockSignals(False)
+        self.update_window_title()
+        self.update_model_info()
+        self.update_chat_title()
+        if self.memory_group.isVisible():
+            self.show_memory_content()
+        self.update_input_state()
+
+    def refresh_tab(self, session):
+        for index in range(self.session_tabs.count()):
+            if self.session_tabs.tabData(index) is session:
+                self.session_tabs.setTabText(index, session.title)
+
+    def close_session_tab(self, index):
+        """Chiude una scheda, proponendo di aggiornare la memoria con la sua sessione."""
+        session = self.session_tabs.tabData(index)
+        if session is None or len(self.sessions) == 1:
+            return
+        if session.history:
+            reply = QMessageBox.question(self, "Chiudi Chat",
+                                       "Vuoi aggiornare la memoria con questa chat prima di chiuderla?",
+                                       QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            if reply == QMessageBox.Cancel:
+                return
+            if reply == QMessageBox.Yes:
+                self.update_memory_from_session(session)
+
+        self.sessions.remove(session)
+        if session is self.active_session:
+            self.active_session = None
+        self.session_tabs.removeTab(index)  # Attiva un'altra scheda tramite currentChanged
+        session.close()
+        self.watch_memory_files()
+        log_event(logger, logging.INFO, "session.closed", session=session.session_id, tabs=len(self.sessions))
+
+    def close_current_tab(self):
+        self.close_session_tab(self.session_tabs.currentIndex())
+
+    def new_session_tab(self):
+        if self.new_tab_button.isEnabled():
+            self.add_session()
+
+    def set_controls_enabled(self, enabled):
+        """Abilita i comandi che richiedono la memoria caricata."""
+        for widget in (self.message_input, self.send_button, self.model_combo, self.save_button,
+                       self.show_memory_button, self.reset_button, self.clear_chat_button, self.new_tab_button):
+            widget.setEnabled(enabled)
+
+    def update_input_state(self):
+        """L'invio è disponibile solo se la scheda attiva non attende una risposta."""
+        enabled = self.active_session is not None and not self.active_session.busy and not self.closing
+        self.message_input.setEnabled(enabled)
+        self.send_button.setEnabled(enabled)
+
+    def start_thread(self, thread):
+        """Avvia un thread tenendolo referenziato finché non termina."""
+        self.running_threads.add(thread)
+        thread.finished.connect(lambda t=thread: self.on_thread_finished(t))
+        thread.start()
+
+    def on_thread_finished(self, thread):
+        self.running_threads.discard(thread)
+        if self.closing:
+            self.quit_when_idle()
+
+    def get_client(self):
+        """Client Anthropic, creato al primo utilizzo."""
+        if self.client is None:
+            self.client = setup_anthropic_client()
+        return self.client
         
+    def setup_memory_watcher(self):
+        """Osserva il file memoria per ricaricarlo se lo modifica un altro programma."""
+        self.memory_watcher = QFileSystemWatcher(self)
+        self.watch_memory_files()
+        # Debounce: un salvataggio esterno può generare più eventi ravvicinati
+        self.memory_reload_timer = QTimer(self)
+        self.memory_reload_timer.setSingleShot(True)
+        self.memory_reload_timer.setInterval(300)
+        self.memory_reload_timer.timeout.connect(self.on_memory_file_changed)
+        self.memory_watcher.fileChanged.connect(lambda _: self.memory_reload_timer.start())
+    
+    def watch_memory_files(self):
+        """Osserva i file (condiviso e delle persone) delle memorie aperte nelle schede."""
+        watched = self.memory_watcher.files()
+        wanted = sorted({path for session in self.sessions for path in session.memory_manager.memory_files})
+        stale = [path for path in watched if path not in wanted]
+        if stale:
+            self.memory_watcher.removePaths(stale)
+        for path in wanted:
+            # Le scritture atomiche (rename) fanno perdere il watch: va ripristinato
+            if path not in watched and os.path.exists(path):
+                self.memory_watcher.addPath(path)
+
+    def on_memory_file_changed(self):
+        """Ricarica in modo incrementale le memorie modificate esternamente."""
+        self.watch_memory_files()
+
+        changed = []
+        managers = {id(session.memory_manager): session.memory_manager for session in self.sessions}
+        for memory_manager in managers.values():
+            log_event(logger, logging.DEBUG, "memory.watch", namespace=memory_manager.namespace)
+            changed += memory_manager.reload_if_changed()
+        if changed:
+            self.status_label.setText(f"🔄 Memoria ricaricata: {', '.join(sorted(set(changed)))}")
+            QTimer.singleShot(3000, lambda: self.status_label.setText("Pronta! 💙"))
+            if self.memory_group.isVisible():
+                self.show_memory_content()
+
     def on_model_changed(self, model_name):
-        """Gestisce il cambio di modello."""
-        if self.config_manager.set_current_model(model_name):
-            self.current_model_name = model_name
-            self.current_model_config = self.config_manager.get_model_config()
-            
+        """Cambia il modello (e la persona) della scheda attiva."""
+        session = self.active_session
+        model_config = self.config_manager.get_model_config(model_name)
+        if session and model_config:
+            # Passa alla memoria della nuova persona (già in cache se usata in precedenza)
+            memory_manager = self.memory_for(model_name, model_config)
+            if memory_manager is None:
+                # Memoria bloccata: la scheda resta sul modello di prima
+                self.model_combo.blockSignals(True)
+                self.model_combo.setCurrentText(session.model_name)
+                self.model_combo.blockSignals(False)
+                return
+            self.config_manager.set_current_model(model_name)
+            session.set_persona(model_name, model_config, memory_manager)
+            self.refresh_tab(session)
+            self.watch_memory_files()
+            if self.memory_group.isVisible():
+                self.show_memory_content()
+
             self.update_window_title()
             self.update_model_info()
             self.update_chat_title() # Aggiorna il titolo della chat con il nome del nuovo modello
             self.status_label.setText(f"Modello cambiato: {model_name} 🔄")
             QTimer.singleShot(3000, lambda: self.status_label.setText("Pronta! 💙"))
-            
-            print(f"DEBUG: Modello cambiato a {model_name}")
-            print(f"API Model: {self.current_model_config['api_model']}")
+
+            log_event(logger, logging.INFO, "model.changed", model=model_name,
+                      api_model=model_config['api_model'], session=session.session_id,
+                      memory_namespace=session.memory_manager.namespace)
         else:
-            print(f"Errore: Tentativo di selezionare modello non esistente: {model_name}")
-    
+            log_event(logger, logging.ERROR, "model.unknown", model=model_name)
+
     def update_window_title(self):
         """Aggiorna il titolo della finestra in base al modello corrente."""
         model_display = self.current_model_name
@@ -141,6 +456,25 @@ class MemoryChatGUI(QMainWindow):
         self.update_chat_title()
         chat_layout.addWidget(self.chat_title)
         
+        # Schede delle sessioni: ognuna con cronologia e persona proprie
+        tabs_layout = QHBoxLayout()
+        self.session_tabs = QTabBar()
+        self.session_tabs.setTabsClosable(True)
+        self.session_tabs.setMovable(True)
+        self.session_tabs.setExpanding(False)
+        self.session_tabs.currentChanged.connect(self.on_tab_changed)
+        self.session_tabs.tabCloseRequested.connect(self.close_session_tab)
+        tabs_layout.addWidget(self.session_tabs, 1)
+        
+        self.new_tab_button = QPushButton("➕ Nuova Chat")
+        self.new_tab_button.setToolTip("Nuova scheda di chat (Ctrl+T)")
+        self.new_tab_button.clicked.connect(self.new_session_tab)
+        tabs_layout.addWidget(self.new_tab_button)
+        chat_layout.addLayout(tabs_layout)
+        
+        QShortcut(QKeySequence("Ctrl+T"), self, activated=self.new_session_tab)
+        QShortcut(QKeySequence("Ctrl+W"), self, activated=self.close_current_tab)
+        
         # Area di visualizzazione chat
         self.chat_display = QTextEdit()
         self.chat_display.setReadOnly(True)
@@ -244,6 +578,11 @@ class MemoryChatGUI(QMainWindow):
         self.style_button(self.exit_with_saving_button, "#3F51B5")
         buttons_layout.addWidget(self.exit_with_saving_button)
         
+        self.show_metrics_button = QPushButton("📊 Mostra Metriche")
+        self.show_metrics_button.clicked.connect(self.toggle_metrics_display)
+        self.style_button(self.show_metrics_button, "#009688")
+        buttons_layout.addWidget(self.show_metrics_button)
+        
         control_layout.addLayout(buttons_layout)
         
         # Area memoria (inizialmente nascosta)
@@ -267,6 +606,27 @@ class MemoryChatGUI(QMainWindow):
         memory_group_layout.addWidget(self.memory_display)
         control_layout.addWidget(self.memory_group)
         
+        # Area metriche (inizialmente nascosta)
+        self.metrics_group = QGroupBox("Metriche Richieste:")
+        self.metrics_group.setVisible(False)
+        metrics_group_layout = QVBoxLayout(self.metrics_group)
+        
+        self.metrics_display = QTextEdit()
+        self.metrics_display.setReadOnly(True)
+        self.metrics_display.setFont(QFont("Consolas", 9))
+        self.metrics_display.setMaximumHeight(200)
+        self.metrics_display.setStyleSheet("""
+            QTextEdit {
+                background-color: #2d2d2d;
+                color: #99ffcc;
+                border: 1px solid #666666;
+                border-radius: 3px;
+                padding: 5px;
+            }
+        """)
+        metrics_group_layout.addWidget(self.metrics_display)
+        control_layout.addWidget(self.metrics_group)
+        
         # Status bar
         self.status_label = QLabel("Pronta! 💙")
         self.status_label.setStyleSheet("color: #4CAF50; font-weight: bold; margin: 10px;")
@@ -294,7 +654,7 @@ class MemoryChatGUI(QMainWindow):
     
     def update_model_info(self):
         """Aggiorna le info del modello corrente nella toolbar."""
-        model_config = self.config_manager.get_model_config()
+        model_config = self.current_model_config
         if model_config:
             api_model = model_config['api_model']
             info_text = f"API: {api_model}"
@@ -337,19 +697,19 @@ class MemoryChatGUI(QMainWindow):
             }}
         """)
     
-    def show_initial_message(self):
+    def show_initial_message(self, session):
         """Mostra il messaggio iniziale all'avvio della chat."""
-        current_memory = self.memory_manager.get_memory_content()
-        ai_name = "Claudia" if "Sonnet 4" in self.current_model_name else self.current_model_name
-        
-        if "Sonnet 4" in self.current_model_name:
+        current_memory = session.memory_manager.get_memory_content()
+        ai_name = session.ai_name
+
+        if "Sonnet 4" in session.model_name:
             if not any(value for key, value in current_memory.items() if key not in ["ultimo_aggiornamento", "sessioni_totali"]) or current_memory["sessioni_totali"] == 0:
                 initial_msg = "Ciao Luca! Sono Claudia 💙\n\nPrima volta che usiamo la memoria persistente! Dimmi qualcosa di te così posso iniziare a ricordarmi le cose importanti."
             else:
                 initial_msg = f"""Ciao Luca! Sono Claudia 💙
 
 Quello che ricordo di te:
-{self.memory_manager.format_memory_for_display()}
+{session.memory_manager.format_memory_for_display()}
 
 Sessioni totali: {current_memory['sessioni_totali']}
 Ultimo aggiornamento: {current_memory['ultimo_aggiornamento']}
@@ -357,132 +717,284 @@ Ultimo aggiornamento: {current_memory['ultimo_aggiornamento']}
 Di cosa parliamo oggi?"""
         else:
             initial_msg = f"Ciao! Sono {ai_name}. Come posso aiutarti oggi?"
-        
-        self.add_message_to_chat(ai_name, initial_msg, "#2196F3" if "Sonnet 4" in self.current_model_name else "#FF9800")
-    
+
+        self.append_message(session, ai_name, ChatMessage("assistant", initial_msg), session.color)
+
+    def append_message(self, session, sender, message, color):
+        """Aggiunge un ChatMessage alla trascrizione della sessione (e alla chat se è quella attiva)."""
+        session.transcript.append((sender, color, message))
+        if session is self.active_session:
+            self.add_message_to_chat(sender, message, color)
+        elif not session.unread:
+            session.unread = True
+            self.refresh_tab(session)
+
     def add_message_to_chat(self, sender, message, color):
-        """Aggiunge un messaggio alla chat display."""
-        timestamp = datetime.now().strftime("%H:%M")
-        
-        self.chat_display.append(f"""
-<div style="margin: 10px 0;">
-    <strong style="color: {color};">[{timestamp}] {sender}:</strong><br>
-    <span style="color: #FFFFFF; margin-left: 20px;">{message.replace(chr(10), '<br>')}</span>
-</div>
-        """)
-        
+        """Aggiunge un messaggio (testo o ChatMessage) alla chat display."""
+        self.chat_display.append(message_html(sender, message, color))
+
         scrollbar = self.chat_display.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
-    
+
     def send_message(self):
-        """Invia il messaggio dell'utente all'AI."""
+        """Invia il messaggio dell'utente all'AI dalla scheda attiva."""
+        session = self.active_session
         message = self.message_input.toPlainText().strip()
-        if not message:
+        if not message or session is None or session.busy:
             return
-        
-        self.add_message_to_chat("Tu", message, "#FF9800")
+
+        session.pending_message = ChatMessage("user", message)
+        self.append_message(session, "Tu", session.pending_message, "#FF9800")
         self.message_input.clear()
-        
-        self.message_input.setEnabled(False)
-        self.send_button.setEnabled(False)
+        if session.journal:
+            session.journal.record_message(session.pending_message, session.model_config['api_model'])
+
+        session.busy = True
+        self.update_input_state()
         self.status_label.setText("L'AI sta pensando... 🤔")
-        
-        self.ai_thread = AIResponseThread(
-            self.client, 
-            message, 
-            self.session_history, 
-            self.memory_manager.get_memory_content(), 
-            self.current_model_config
+
+        # I turni semplici possono andare al modello veloce (chiave "router" in models.json)
+        route = self.router.route(message, session.history, session.model_name, session.model_config)
+        fallback_configs = self.config_manager.get_fallback_configs(session.model_name)
+        if route.routed:
+            # Se il modello veloce non risponde si torna al modello scelto
+            fallback_configs = [session.model_config] + fallback_configs
+
+        ai_thread = AIResponseThread(
+            self.get_client(),
+            message,
+            session.history,
+            session.memory_manager.get_memory_content(),
+            route.model_config,
+            metrics=self.metrics,
+            memory_revision=session.memory_manager.revision,
+            message_list=session.messages(),
+            scheduler=self.scheduler,
+            fallback_configs=fallback_configs,
+            route=route,
+            profile=self.config_manager.get_generation_profile("chat", session.model_name)[0]
         )
-        self.ai_thread.response_received.connect(self.handle_ai_response)
-        self.ai_thread.error_occurred.connect(self.handle_ai_error)
-        self.ai_thread.start()
-    
-    def handle_ai_response(self, response):
+        ai_thread.metrics_recorded.connect(self.on_metrics_recorded)
+        # La risposta torna alla sessione che l'ha chiesta, anche se nel frattempo si è cambiata scheda
+        ai_thread.response_received.connect(lambda response, s=session: self.handle_ai_response(s, response))
+        ai_thread.error_occurred.connect(lambda error, s=session: self.handle_ai_error(s, error))
+        self.start_thread(ai_thread)
+
+    def handle_ai_response(self, session, response):
         """Gestisce la risposta ricevuta dall'AI."""
-        ai_name = "Claudia" if "Sonnet 4" in self.current_model_name else self.current_model_name
-        color = "#2196F3" if "Sonnet 4" in self.current_model_name else "#FF9800"
-        
-        self.add_message_to_chat(ai_name, response, color)
-        
-        self.session_history.append({"role": "assistant", "content": response})
-        
-        self.message_input.setEnabled(True)
-        self.send_button.setEnabled(True)
-        self.message_input.setFocus()
-        self.status_label.setText("Pronta! 💙")
-    
-    def handle_ai_error(self, error):
+        reply = ChatMessage("assistant", response)
+        self.append_message(session, session.ai_name, reply, session.color)
+
+        # Il turno entra in cronologia solo quando è completo (domanda e risposta)
+        if session.pending_message is not None:
+            # Pre-filtro locale: il consolidamento riceverà solo i turni segnalati
+            if prefilter_enabled() and self.memory_filter.is_memory_worthy(
+                    session.pending_message["content"], session.memory_manager):
+                session.memory_turns.add(len(session.history))
+            session.history.append(session.pending_message)
+            session.pending_message = None
+        session.history.append(reply)
+        if session.journal:
+            session.journal.record_message(reply)
+        if session.topic is None and not self.closing and auto_titles_enabled():
+            self.generate_title(session)
+
+        session.busy = False
+        if session is self.active_session:
+            self.update_input_state()
+            self.message_input.setFocus()
+            self.status_label.setText("Pronta! 💙")
+
+    def generate_title(self, session):
+        """Titolo breve della scheda dal primo scambio, generato in background (profilo "title")."""
+        session.topic = ""  # Già richiesto
+        profile, _, model_config = self.config_manager.get_generation_profile("title", session.model_name)
+        title_thread = AIResponseThread(
+            self.get_client(),
+            build_title_prompt(session.history),
+            [],
+            {},
+            model_config,
+            metrics=self.metrics,
+            purpose=PROFILE_PURPOSES["title"],
+            scheduler=self.scheduler,
+            profile=profile
+        )
+        title_thread.metrics_recorded.connect(self.on_metrics_recorded)
+        title_thread.response_received.connect(lambda title, s=session: self.set_session_topic(s, title))
+        self.start_thread(title_thread)
+
+    def set_session_topic(self, session, title):
+        session.topic = title.strip().strip('"*#').strip()[:40]
+        self.refresh_tab(session)
+
+    def handle_ai_error(self, session, error):
         """Gestisce gli errori durante la comunicazione con l'AI."""
-        self.add_message_to_chat("Sistema", f"Errore: {error}", "#F44336")
-        
-        self.message_input.setEnabled(True)
-        self.send_button.setEnabled(True)
-        self.message_input.setFocus()
-        self.status_label.setText("Errore! ❌")
-    
+        session.pending_message = None
+        self.append_message(session, "Sistema", ChatMessage("system", f"Errore: {error}"), "#F44336")
+        if session.journal:
+            session.journal.record_error(error)
+
+        session.busy = False
+        if session is self.active_session:
+            self.update_input_state()
+            self.message_input.setFocus()
+            self.status_label.setText("Errore! ❌")
+
     def save_memory_manual(self):
         """Salva manualmente la memoria dopo averla aggiornata dalla sessione."""
-        if not self.session_history:
+        if not self.active_session.history:
             QMessageBox.information(self, "Info", "Nessun dialogo da salvare in memoria.")
             return
-        
+
         self.status_label.setText("Aggiornando memoria... 🧠")
-        self.update_memory_from_session()
-    
-    def update_memory_from_session(self):
-        """Invia un prompt all'AI per aggiornare la memoria basandosi sulla sessione."""
-        if not self.session_history:
+        # Salvataggio richiesto esplicitamente: tutta la sessione, senza pre-filtro
+        self.update_memory_from_session(self.active_session, history=self.active_session.history)
+
+    def update_memory_from_session(self, session, reruns=0, facts=None, history=None):
+        """
+        Invia un prompt all'AI per aggiornare la memoria basandosi sulla sessione.
+        Senza `history` si usano solo i turni segnalati dal pre-filtro. Se i
+        turni non stanno in CHUNK_TOKENS token i fatti vengono prima estratti
+        a parti (extract_session_facts) e poi consolidati (`facts`).
+        """
+        if not session.history:
             return
-        
-        session_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in self.session_history[-10:]])
-        
-        prompt = f"""Aggiorna questo profilo utente con i nuovi concetti chiave dal dialogo.
-        
-PROFILO ATTUALE:
-{json.dumps(self.memory_manager.get_memory_content(), indent=2, ensure_ascii=False)}
+        if history is None:
+            history = self.prefilter_history(session)
+            if not history:
+                self.status_label.setText("🧠 Nessun turno da ricordare in questa sessione")
+                return
+        if facts is None and history_tokens(history) > CHUNK_TOKENS:
+            self.extract_session_facts(session, history)
+            return
+
+        memory_manager = session.memory_manager
+        # Versione di partenza: all'arrivo della risposta l'aggiornamento viene applicato con compare-and-swap
+        base = memory_manager.snapshot()
+        if facts is None:
+            # Pochi turni: entrano tutti nel prompt
+            prompt = build_consolidation_prompt(base[1], history, turns=len(history))
+        else:
+            prompt = build_reduce_prompt(base[1], facts)
 
-NUOVO DIALOGO:
-{session_text}
+        # Profilo "consolidation": Sonnet 4 (più intelligente), senza persona né copia della memoria
+        profile, memory_model_name, memory_model_config = self.config_manager.get_generation_profile(
+            "consolidation", session.model_name)
 
-Rispondi SOLO con un JSON aggiornato che integra le nuove informazioni importanti, mantenendo la stessa struttura.
-Estrai solo concetti significativi, non conversazione casuale."""
-        
-        # Usa sempre Sonnet 4 per aggiornare la memoria (più intelligente)
-        sonnet4_config = self.config_manager.get_model_config("Claude Sonnet 4 (multimodale)")
-        if not sonnet4_config:
-            # Fallback se Sonnet 4 non è configurato o non trovato
-            sonnet4_config = self.current_model_config 
-        
-        self.memory_update_thread = AIResponseThread(
-            self.client, 
-            prompt, 
-            [], # Nessuna cronologia conversazione per l'aggiornamento della memoria
-            self.memory_manager.get_memory_content(), 
-            sonnet4_config
+        # Output strutturato: la memoria aggiornata arriva come input dello strumento aggiorna_memoria
+        memory_update_thread = MemoryConsolidationThread(
+            self.get_client(),
+            prompt,
+            base[1],
+            memory_model_config,
+            metrics=self.metrics,
+            purpose=PROFILE_PURPOSES["consolidation"],
+            memory_revision=base[0],
+            scheduler=self.scheduler,
+            fallback_configs=self.config_manager.get_fallback_configs(memory_model_name),
+            profile=profile
         )
-        self.memory_update_thread.response_received.connect(self.handle_memory_update)
-        self.memory_update_thread.error_occurred.connect(lambda e: self.status_label.setText(f"Errore aggiornamento memoria: {e} ❌"))
-        self.memory_update_thread.start()
-    
-    def handle_memory_update(self, response):
-        """Gestisce la risposta dell'AI per l'aggiornamento della memoria."""
+        memory_update_thread.metrics_recorded.connect(self.on_metrics_recorded)
+        # La memoria aggiornata è quella della persona che ha condotto la sessione
+        memory_update_thread.memory_received.connect(
+            lambda data, s=session, m=memory_manager, model=memory_model_config['api_model'], b=base, r=reruns, f=facts,
+            h=history: self.handle_memory_update(s, m, model, data, b, r, f, h))
+        memory_update_thread.error_occurred.connect(lambda e: self.show_memory_error(f"Errore aggiornamento memoria: {e}"))
+        self.start_thread(memory_update_thread)
+
+    def prefilter_history(self, session):
+        """Turni segnalati con il loro contesto (tutta la sessione con MEMORY_PREFILTER=false)."""
+        if not prefilter_enabled():
+            return session.history
+        history = select_memory_turns(session.history, session.memory_turns)
+        turns = sum(1 for msg in session.history if msg["role"] == "user")
+        saved = history_tokens(session.history) - history_tokens(history)
+        self.metrics.record_prefilter(turns, len(session.memory_turns), saved)
+        log_event(logger, logging.INFO, "memory.prefilter", session=session.session_id, turns=turns,
+                  flagged=len(session.memory_turns), tokens_saved=saved)
+        return history
+
+    def extract_session_facts(self, session, history):
+        """
+        Fase map del consolidamento delle sessioni lunghe: un'estrazione dei
+        fatti (profilo "summarisation") per ogni parte della cronologia. Le
+        richieste partono insieme e lo scheduler ne esegue al massimo quante ne
+        consente la classe background; quando sono arrivate tutte, i fatti
+        uniti passano al consolidamento.
+        """
+        chunks = chunk_history(history)
+        job = {"history": history, "results": [None] * len(chunks), "pending": len(chunks), "failed": 0}
+        profile, _, model_config = self.config_manager.get_generation_profile("summarisation", session.model_name)
+        self.status_label.setText(f"Estraggo i fatti da {len(chunks)} parti della sessione... 🧠")
+        for index, chunk in enumerate(chunks):
+            facts_thread = AIResponseThread(
+                self.get_client(),
+                build_facts_prompt(chunk),
+                [],
+                {},
+                model_config,
+                metrics=self.metrics,
+                purpose="estrazione",
+                scheduler=self.scheduler,
+                profile=profile
+            )
+            facts_thread.metrics_recorded.connect(self.on_metrics_recorded)
+            facts_thread.response_received.connect(
+                lambda text, s=session, j=job, i=index: self.collect_session_facts(s, j, i, parse_facts(text)))
+            facts_thread.error_occurred.connect(
+                lambda e, s=session, j=job, i=index: self.collect_session_facts(s, j, i, None))
+            self.start_thread(facts_thread)
+
+    def collect_session_facts(self, session, job, index, facts):
+        """Raccoglie i fatti di una parte (None se l'estrazione è fallita); all'ultima parte avvia la fase reduce."""
+        job["results"][index] = facts or []
+        job["failed"] += facts is None
+        job["pending"] -= 1
+        if job["pending"]:
+            return
+        if job["failed"] == len(job["results"]):
+            self.show_memory_error("Errore aggiornamento memoria: estrazione dei fatti non riuscita")
+            return
+        merged = merge_facts(job["results"])
+        log_event(logger, logging.INFO, "memory.map_reduce", session=session.session_id, chunks=len(job["results"]),
+                  failed=job["failed"], facts=len(merged))
+        if not merged:
+            self.status_label.setText("🧠 Nessun fatto nuovo da ricordare")
+            return
+        self.update_memory_from_session(session, facts=merged, history=job["history"])
+
+    def handle_memory_update(self, session, memory_manager, model, updated_memory_data, base, reruns=0, facts=None,
+                             history=None):
+        """
+        Applica l'aggiornamento della memoria (già decodificato e validato dal
+        thread) solo se non sovrascrive modifiche più recenti della sua base:
+        se la memoria è cambiata nel frattempo le modifiche vengono riportate
+        sulla versione attuale; in caso di conflitto il consolidamento viene
+        rifatto una volta sulla memoria nuova.
+        """
         try:
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start != -1 and end != 0:
-                json_str = response[start:end]
-                updated_memory_data = json.loads(json_str)
-                self.memory_manager.update_memory_data(updated_memory_data)
-                self.status_label.setText("🧠 Memoria aggiornata!")
-                
-                if self.memory_group.isVisible():
-                    self.show_memory_content()
-            else:
-                self.status_label.setText("Errore nel parsing JSON della memoria! ❌")
+            status, conflicts = memory_manager.compare_and_update(
+                base[0], base[1], updated_memory_data, session_id=session.session_id, model=model,
+                rebase_conflicts=reruns >= CONSOLIDATION_RERUNS)
+            if status == "conflict":
+                self.status_label.setText("🔄 Memoria cambiata nel frattempo: aggiorno di nuovo...")
+                self.update_memory_from_session(session, reruns + 1, facts, history)
+                return
+            self.status_label.setText("🧠 Memoria aggiornata!" if not conflicts
+                                      else f"🧠 Memoria aggiornata (mantenuti i valori più recenti: {', '.join(conflicts)})")
+
+            if self.memory_group.isVisible():
+                self.show_memory_content()
         except Exception as e:
-            self.status_label.setText(f"Errore gestione aggiornamento memoria: {e} ❌")
-    
+            self.show_memory_error(f"Errore gestione aggiornamento memoria: {e}")
+
+    def show_memory_error(self, message):
+        """Mostra l'errore; durante la chiusura lo conserva per l'avviso finale."""
+        self.status_label.setText(f"{message} ❌")
+        if self.closing:
+            self.exit_errors.append(message)
+
     def toggle_memory_display(self):
         """Mostra/nasconde la visualizzazione del contenuto della memoria."""
         if self.memory_group.isVisible():
@@ -497,10 +1009,25 @@ Estrai solo concetti significativi, non conversazione casuale."""
         """Aggiorna il QTextEdit con il contenuto della memoria formattato."""
         self.memory_display.setText(json.dumps(self.memory_manager.get_memory_content(), indent=2, ensure_ascii=False))
     
+    def toggle_metrics_display(self):
+        """Mostra/nasconde il pannello con le metriche delle richieste."""
+        if self.metrics_group.isVisible():
+            self.metrics_group.setVisible(False)
+            self.show_metrics_button.setText("📊 Mostra Metriche")
+        else:
+            self.metrics_display.setText(self.metrics.format_summary())
+            self.metrics_group.setVisible(True)
+            self.show_metrics_button.setText("📊 Nascondi Metriche")
+    
+    def on_metrics_recorded(self, entry):
+        """Aggiorna il pannello metriche al termine di ogni richiesta."""
+        if self.metrics_group.isVisible():
+            self.metrics_display.setText(self.metrics.format_summary())
+    
     def reset_memory(self):
         """Reset della memoria utente."""
         reply = QMessageBox.question(self, "Conferma Reset", 
-                                   "Sei sicuro di voler cancellare tutta la memoria?",
+                                   "Sei sicuro di voler cancellare la memoria di questa persona?\n(Il profilo utente condiviso viene conservato)",
                                    QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.memory_manager.reset_memory()
@@ -509,57 +1036,101 @@ Estrai solo concetti significativi, non conversazione casuale."""
             QMessageBox.information(self, "Reset Completato", "Memoria cancellata con successo!")
     
     def clear_chat(self):
-        """Pulisce la cronologia chat visuale."""
-        reply = QMessageBox.question(self, "Pulisci Chat", 
+        """Pulisce la chat della scheda attiva e ne inizia una nuova sessione."""
+        reply = QMessageBox.question(self, "Pulisci Chat",
                                    "Vuoi pulire la chat visuale? (La memoria rimane intatta)",
                                    QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
+            session = self.active_session
             self.chat_display.clear()
-            self.session_history = [] # Resetta anche la cronologia in memoria
-            self.show_initial_message()
+            session.restart() # Resetta anche la cronologia in memoria
+            self.show_initial_message(session)
             self.status_label.setText("🧹 Chat pulita!")
-    
+
     def exit_without_saving(self):
         """Esce dall'applicazione senza salvare la memoria della sessione."""
+        if self.closing:
+            return
         reply = QMessageBox.question(self, "Esci Senza Salvare", 
                                    "Sei sicuro di voler uscire senza salvare la sessione corrente?",
                                    QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
-            QApplication.quit()
+            self.shutdown(save=False)
+
+    def sessions_to_save(self):
+        return [session for session in self.sessions if session.history]
+
+    def save_all_sessions(self):
+        """Aggiorna la memoria con tutte le schede che hanno un dialogo."""
+        for session in self.sessions_to_save():
+            self.update_memory_from_session(session)
 
     def exit_with_saving(self):
         """Salva la memoria della sessione e poi esce dall'applicazione."""
-        if self.session_history:
-            reply = QMessageBox.question(self, "Salvataggio", 
+        if self.closing:
+            return
+        if self.sessions_to_save():
+            reply = QMessageBox.question(self, "Salvataggio",
                                        "Vuoi aggiornare la memoria prima di uscire?",
                                        QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
-            if reply == QMessageBox.Yes:
-                self.update_memory_from_session()
-                # Non chiamare QApplication.quit() immediatamente qui per dare tempo al thread
-                # di aggiornamento memoria di completare. La chiusura avverrà tramite closeEvent.
-                QTimer.singleShot(1000, QApplication.quit) # Chiude dopo 1 secondo, sperando che il thread finisca
+            if reply == QMessageBox.Cancel:
                 return
-            elif reply == QMessageBox.Cancel:
-                # Se l'utente annulla, ignora l'evento di chiusura
-                return
-        # Se non c'è session_history o l'utente non vuole salvare, chiudi subito
-        QApplication.quit()
-    
+            self.shutdown(save=reply == QMessageBox.Yes)
+            return
+        # Se non ci sono dialoghi, chiudi subito
+        self.shutdown(save=False)
+
     def closeEvent(self, event):
         """Gestisce l'evento di chiusura della finestra."""
-        if self.session_history:
-            reply = QMessageBox.question(self, "Salvataggio", 
+        if self.closing:
+            # Chiusura già avviata: la finestra resta aperta finché le richieste non sono terminate
+            event.ignore()
+            return
+        save = False
+        if self.sessions_to_save():
+            reply = QMessageBox.question(self, "Salvataggio",
                                        "Vuoi aggiornare la memoria prima di uscire?",
                                        QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
-            if reply == QMessageBox.Yes:
-                self.update_memory_from_session()
-                # Accetta l'evento di chiusura solo quando il thread di aggiornamento ha finito (o dopo un timeout)
-                # Questo è un approccio semplificato; un sistema più robusto userebbe un segnale dal thread
-                QTimer.singleShot(1000, lambda: event.accept()) 
-                event.ignore() # Ignora l'evento corrente per aspettare il salvataggio
-                return
-            elif reply == QMessageBox.Cancel:
+            if reply == QMessageBox.Cancel:
                 event.ignore()
                 return
-        
-        event.accept() # Accetta l'evento di chiusura se non c'è nulla da salvare o l'utente ha detto No
+            save = reply == QMessageBox.Yes
+        event.ignore()  # L'uscita avviene con QApplication.quit() quando tutto è terminato
+        self.shutdown(save)
+
+    def shutdown(self, save):
+        """
+        Chiude l'app senza perdere lavori: i lavori ancora in coda nello
+        scheduler vengono annullati (e registrati nel log), tranne i
+        consolidamenti se si salva; si esce quando tutti i thread partiti
+        sono terminati.
+        """
+        self.closing = True
+        self.set_controls_enabled(False)
+        if self.scheduler:
+            # Chat e lavori in blocco (titoli) non servono più; i consolidamenti sì, se si salva
+            self.scheduler.cancel_pending(("interactive", "batch") if save else None)
+        if save:
+            self.save_all_sessions()
+        self.quit_when_idle()
+
+    def quit_when_idle(self):
+        """
+        Esce solo quando tutti i thread hanno emesso finished (dopo la risposta
+        o l'errore); intanto la finestra resta aperta con lo stato della
+        chiusura. Un map-reduce avvia la richiesta successiva prima che la
+        precedente termini, quindi la catena non lascia mai l'insieme vuoto.
+        """
+        if self.running_threads:
+            saving = sum(1 for thread in self.running_threads if thread.purpose in MEMORY_PURPOSES)
+            if saving:
+                self.status_label.setText(f"💾 Salvataggio memoria in corso ({saving} richieste): "
+                                          "l'app si chiude al termine...")
+            else:
+                self.status_label.setText(f"⏳ Chiusura: attendo {len(self.running_threads)} richieste in corso...")
+            return
+        log_event(logger, logging.INFO, "app.exit", memory_errors=len(self.exit_errors))
+        if self.exit_errors:
+            QMessageBox.warning(self, "Memoria non aggiornata",
+                                "Alcuni aggiornamenti della memoria non sono riusciti:\n\n" + "\n".join(self.exit_errors))
+        QApplication.quit()
@@ -0,0 +1,181 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from chat_logging import get_logger, log_event
+
+logger = get_logger("scheduler")
+
+
+class JobClass:
+    """Classe di priorità: più basso è `priority`, prima parte il lavoro."""
+    def __init__(self, name, priority, max_running):
+        self.name = name
+        self.priority = priority
+        self.max_running = max_running
+
+
+# Turni di chat, poi consolidamento della memoria, poi lavori in blocco (riassunti, esportazioni)
+JOB_CLASSES = (
+    JobClass("interactive", 0, 4),
+    JobClass("background", 1, 2),
+    JobClass("batch", 2, 1),
+)
+
+# Classe di ogni `purpose` di AIResponseThread; gli scopi non elencati sono interattivi
+PURPOSE_CLASSES = {
+    "chat": "interactive",
+    "memoria": "background",
+    "estrazione": "background",
+    "riassunto": "batch",
+    "titolo": "batch",
+    "export": "batch",
+}
+
+# Richieste contemporanee al massimo, di tutte le classi insieme
+MAX_RUNNING = 4
+# Ogni AGING_SECONDS di attesa un lavoro sale di una classe di priorità
+AGING_SECONDS = 10.0
+
+
+def job_class_for(purpose):
+    return PURPOSE_CLASSES.get(purpose, "interactive")
+
+
+class JobCancelled(Exception):
+    """Il lavoro era ancora in coda quando è stato annullato (es. chiusura dell'app)."""
+
+
+class _Ticket:
+    __slots__ = ("job_class", "seq", "enqueued", "granted", "cancelled")
+
+    def __init__(self, job_class, seq):
+        self.job_class = job_class
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+
+class JobScheduler:
+    """
+    Coda con priorità per le richieste all'API, condivisa da tutte le schede.
+    Ogni richiesta prende un posto con acquire() (o il context manager slot())
+    e lo restituisce alla fine. Quando si libera un posto parte il lavoro in
+    attesa con priorità più alta, così un turno di chat passa davanti ai
+    consolidamenti ancora in coda; quelli già partiti non vengono interrotti.
+    Ogni classe ha un limite di richieste contemporanee oltre a quello totale,
+    e l'invecchiamento (aging) evita che i lavori in background restino in
+    coda per sempre. Profondità della coda e attese per classe vanno a
+    MetricsRecorder.record_queue(). Alla chiusura cancel_pending() annulla i
+    lavori ancora in coda: il loro acquire() solleva JobCancelled.
+    """
+    def __init__(self, classes=JOB_CLASSES, max_running=MAX_RUNNING, aging=AGING_SECONDS, metrics=None):
+        self.classes = {job_class.name: job_class for job_class in classes}
+        self.max_running = max_running
+        self.aging = aging
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []
+        self._running = {name: 0 for name in self.classes}
+
+    def _effective_priority(self, ticket, now):
+        priority = self.classes[ticket.job_class].priority
+        if self.aging:
+            priority -= int((now - ticket.enqueued) / self.aging)
+        return priority
+
+    def _dispatch(self):
+        """Assegna i posti liberi ai lavori in attesa, in ordine di priorità (con il lock)."""
+        granted = []
+        while self._waiting and sum(self._running.values()) < self.max_running:
+            now = time.monotonic()
+            eligible = [ticket for ticket in self._waiting
+                        if self._running[ticket.job_class] < self.classes[ticket.job_class].max_running]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (self._effective_priority(t, now), t.seq))
+            self._waiting.remove(ticket)
+            self._running[ticket.job_class] += 1
+            ticket.granted = True
+            granted.append(ticket)
+        if granted:
+            self._cond.notify_all()
+        return granted
+
+    def depth(self, job_class):
+        with self._cond:
+            return sum(1 for ticket in self._waiting if ticket.job_class == job_class)
+
+    def running(self, job_class):
+        with self._cond:
+            return self._running[job_class]
+
+    def _report(self, job_class, wait=None):
+        if self.metrics:
+            depth = sum(1 for ticket in self._waiting if ticket.job_class == job_class)
+            self.metrics.record_queue(job_class, depth, self._running[job_class], wait)
+
+    def acquire(self, job_class):
+        """
+        Attende un posto per un lavoro della classe indicata; restituisce
+        l'attesa in secondi. Solleva JobCancelled se il lavoro viene annullato
+        mentre è in coda.
+        """
+        if job_class not in self.classes:
+            raise ValueError(f"Classe di lavoro sconosciuta: {job_class}")
+        with self._cond:
+            ticket = _Ticket(job_class, next(self._seq))
+            self._waiting.append(ticket)
+            self._dispatch()
+            self._report(job_class)
+            while not ticket.granted:
+                if ticket.cancelled:
+                    raise JobCancelled(job_class)
+                self._cond.wait()
+            wait = time.monotonic() - ticket.enqueued
+            self._report(job_class, wait)
+        log_event(logger, logging.DEBUG, "job.start", job_class=job_class, wait=wait)
+        return wait
+
+    def release(self, job_class):
+        with self._cond:
+            self._running[job_class] -= 1
+            granted = self._dispatch()
+            self._report(job_class)
+            for ticket in granted:
+                if ticket.job_class != job_class:
+                    self._report(ticket.job_class)
+
+    def cancel_pending(self, job_classes=None):
+        """
+        Annulla i lavori in coda (di tutte le classi o solo di job_classes);
+        quelli già partiti proseguono. Restituisce il numero di lavori annullati
+        per classe.
+        """
+        with self._cond:
+            cancelled = [ticket for ticket in self._waiting
+                         if job_classes is None or ticket.job_class in job_classes]
+            counts = {}
+            for ticket in cancelled:
+                self._waiting.remove(ticket)
+                ticket.cancelled = True
+                counts[ticket.job_class] = counts.get(ticket.job_class, 0) + 1
+            for job_class in counts:
+                self._report(job_class)
+            self._cond.notify_all()
+        for job_class, count in counts.items():
+            log_event(logger, logging.INFO, "job.cancelled", job_class=job_class, jobs=count)
+        return counts
+
+    @contextmanager
+    def slot(self, job_class):
+        """with scheduler.slot("interactive") as wait: ... (il posto viene sempre restituito)."""
+        wait = self.acquire(job_class)
+        try:
+            yield wait
+        finally:
+            self.release(job_class)
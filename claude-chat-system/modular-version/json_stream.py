@@ -0,0 +1,68 @@
+import json
+
+
+class JSONObjectScanner:
+    """
+    Riconosce il primo oggetto JSON completo in un testo che arriva a pezzi
+    (streaming). Il testo prima della prima "{" viene ignorato; le parentesi
+    dentro le stringhe non contano. Appena l'oggetto si chiude feed()
+    restituisce True: `value` contiene l'oggetto decodificato oppure `error`
+    il motivo per cui non è JSON valido. `text` è il JSON ricevuto finora.
+    """
+    def __init__(self):
+        self._parts = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+        self.value = None
+        self.error = None
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def feed(self, chunk):
+        if self.complete:
+            return True
+        if not self.started:
+            start = chunk.find("{")
+            if start == -1:
+                return False
+            chunk = chunk[start:]
+            self.started = True
+
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._parts.append(chunk[:i + 1])
+                    self._finish()
+                    return True
+        self._parts.append(chunk)
+        return False
+
+    def _finish(self):
+        self.complete = True
+        try:
+            self.value = json.loads(self.text)
+        except json.JSONDecodeError as e:
+            self.error = f"JSON non valido: {e}"
+
+    def close(self):
+        """Fine dello stream: se l'oggetto non si è chiuso lo segnala in `error`."""
+        if not self.complete:
+            self.error = "JSON incompleto" if self.started else "nessun oggetto JSON nella risposta"
+        return self.error is None
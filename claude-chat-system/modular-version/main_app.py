@@ -1,15 +1,29 @@
 import sys
-from PyQt5.QtWidgets import QApplication
-from gui import MemoryChatGUI
+from startup_profiler import profiler
 
 def main():
+    # --profile-startup (o STARTUP_PROFILE=1) stampa la linea temporale di import e inizializzazione
+    profiler.enable_from_args(sys.argv)
+    profiler.mark("avvio")
+    
+    with profiler.phase("import PyQt5"):
+        from PyQt5.QtWidgets import QApplication
+    with profiler.phase("logging"):
+        from chat_logging import setup_logging, shutdown_logging
+        setup_logging()
     app = QApplication(sys.argv)
     app.setStyle('Fusion') # Applica uno stile moderno
     
-    window = MemoryChatGUI()
+    with profiler.phase("import gui"):
+        from gui import MemoryChatGUI
+    with profiler.phase("costruzione finestra"):
+        window = MemoryChatGUI()
     window.show()
+    profiler.mark("finestra mostrata")
     
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    shutdown_logging() # Scrive i log ancora in coda prima di uscire
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
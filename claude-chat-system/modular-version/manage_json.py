@@ -1,11 +1,17 @@
 import wx
+import copy
 import json
 import os
 
+from file_sync import FileLock, FileSignature, merge, read_json, write_json_atomic
+
 class JSONEditorApp(wx.Frame):
     def __init__(self, json_path):
         super().__init__(parent=None, title='JSON Editor')
         self.json_path = json_path
+        # Stato del file all'ultima lettura/scrittura, per non sovrascrivere modifiche altrui
+        self.signature = FileSignature(json_path)
+        self.base_data = None
         self.data = self.load_json()
 
         panel = wx.Panel(self)
@@ -48,17 +54,31 @@ class JSONEditorApp(wx.Frame):
 
     def load_json(self):
         try:
-            with open(self.json_path, 'r') as f:
-                return json.load(f)
+            with FileLock(self.json_path):
+                data, raw = read_json(self.json_path)
+            self.signature.update(raw)
+            self.base_data = copy.deepcopy(data)
+            return data
         except Exception as e:
             wx.MessageBox(f"Errore nel caricamento: {e}", "Errore", wx.OK | wx.ICON_ERROR)
             return {}
 
     def save_json(self):
         try:
-            with open(self.json_path, 'w') as f:
-                json.dump(self.data, f, indent=4)
-            wx.MessageBox("JSON salvato con successo!", "Successo", wx.OK)
+            merged = False
+            with FileLock(self.json_path):
+                # Se la chat o il JSON Manager hanno salvato nel frattempo, unisce invece di sovrascrivere
+                if self.base_data is not None and self.signature.changed():
+                    theirs, _ = read_json(self.json_path)
+                    self.data = merge(self.base_data, self.data, theirs)
+                    merged = True
+                raw = write_json_atomic(self.json_path, self.data, indent=4)
+            self.signature.update(raw)
+            self.base_data = copy.deepcopy(self.data)
+            if merged:
+                wx.MessageBox("JSON salvato: il file era stato modificato da un altro programma e le modifiche sono state unite.", "Successo", wx.OK)
+            else:
+                wx.MessageBox("JSON salvato con successo!", "Successo", wx.OK)
         except Exception as e:
             wx.MessageBox(f"Errore nel salvataggio: {e}", "Errore", wx.OK | wx.ICON_ERROR)
     
@@ -0,0 +1,253 @@
+"""
+Consolidamento della memoria con output strutturato.
+
+La richiesta obbliga il modello a usare lo strumento `aggiorna_memoria`, il
+cui input è la memoria aggiornata: niente testo prima o dopo il JSON. L'input
+dello strumento arriva in streaming e viene analizzato man mano
+(JSONObjectScanner): appena l'oggetto è completo lo stream viene chiuso. Se
+il JSON non è valido si ritenta con un prompt di riparazione mirato, che
+contiene solo il JSON prodotto e l'errore.
+
+Le sessioni lunghe vengono consolidate con un map-reduce: la cronologia è
+divisa in parti di al massimo CHUNK_TOKENS token, da ogni parte un modello
+veloce estrae i fatti da ricordare (in parallelo, nei limiti dello
+scheduler) e infine i fatti, senza duplicati, aggiornano la memoria.
+"""
+import logging
+import time
+from types import SimpleNamespace
+
+from PyQt5.QtCore import pyqtSignal
+
+from ai_thread import AIResponseThread, logger
+from chat_logging import log_event
+from chat_message import estimate_tokens
+from generation_profiles import resolve_profile
+from json_stream import JSONObjectScanner
+from prompt_pipeline import compile_template, format_session, pretty_json
+
+MEMORY_TOOL = {
+    "name": "aggiorna_memoria",
+    "description": "Salva il profilo utente aggiornato con i concetti chiave del nuovo dialogo. "
+                   "Restituisci tutti i campi, non solo quelli modificati.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "profilo_utente": {"type": "string", "description": "Chi è l'utente"},
+            "progetti_attivi": {"type": "array", "description": "Progetti in corso"},
+            "preferenze": {"type": "array", "description": "Preferenze dell'utente"},
+            "note_varie": {"type": "array", "description": "Altri concetti significativi"},
+        },
+        "required": ["profilo_utente", "progetti_attivi", "preferenze", "note_varie"],
+    },
+}
+
+# Tipi attesi dei campi: quelli gestiti in locale (contatore sessioni, data) vengono ignorati
+MEMORY_FIELD_TYPES = {
+    "profilo_utente": str,
+    "progetti_attivi": list,
+    "preferenze": list,
+    "note_varie": list,
+}
+LOCAL_FIELDS = ("sessioni_totali", "ultimo_aggiornamento")
+
+MAX_REPAIRS = 1
+
+# Sessioni fino a questa dimensione vengono consolidate in una sola richiesta
+CHUNK_TOKENS = 3000
+
+FACTS_TEMPLATE = """Estrai da questa parte di conversazione i fatti da ricordare sull'utente: chi è, progetti, preferenze, decisioni, informazioni personali. Un fatto per riga, ogni riga inizia con "- ". Ignora la conversazione casuale. Se non c'è nulla da ricordare rispondi solo NESSUNO.
+
+CONVERSAZIONE:
+{session_text}"""
+
+REDUCE_TEMPLATE = """Aggiorna questo profilo utente con i fatti emersi da una lunga conversazione.
+
+PROFILO ATTUALE:
+{memory}
+
+FATTI DALLA CONVERSAZIONE:
+{facts}
+
+Integra solo le informazioni importanti e nuove, mantenendo la stessa struttura."""
+
+REPAIR_TEMPLATE = """Il JSON che hai prodotto per aggiornare la memoria non è valido: {error}
+
+JSON PRODOTTO:
+{raw}
+
+Correggi solo questo problema e restituisci l'oggetto completo con lo strumento aggiorna_memoria."""
+
+
+def validate_memory_update(data):
+    """Problemi dell'aggiornamento restituito dal modello; lista vuota se è valido."""
+    if not isinstance(data, dict):
+        return ["la risposta non è un oggetto JSON"]
+    problems = []
+    for key, expected in MEMORY_FIELD_TYPES.items():
+        if key in data and not isinstance(data[key], expected):
+            problems.append(f"il campo '{key}' deve essere di tipo {'stringa' if expected is str else 'lista'}")
+    if not any(key in data for key in MEMORY_FIELD_TYPES):
+        problems.append("nessun campo della memoria presente")
+    return problems
+
+
+def build_repair_prompt(raw, error):
+    return compile_template(REPAIR_TEMPLATE).render({"raw": raw, "error": error})
+
+
+def history_tokens(history):
+    return sum(estimate_tokens(msg["content"]) for msg in history)
+
+
+def split_message(msg, max_tokens=CHUNK_TOKENS):
+    """
+    Divide un messaggio più lungo di max_tokens token stimati in pezzi con lo
+    stesso ruolo, tagliando se possibile a un a capo o a uno spazio.
+    """
+    content = msg["content"]
+    if estimate_tokens(content) <= max_tokens:
+        return [msg]
+    limit = max_tokens * 4
+    pieces = []
+    while len(content) > limit:
+        cut = max(content.rfind("\n", 0, limit), content.rfind(" ", 0, limit))
+        if cut < limit // 2:
+            cut = limit  # Nessun separatore utile: taglio netto
+        pieces.append({"role": msg["role"], "content": content[:cut]})
+        content = content[cut:].lstrip()
+    if content:
+        pieces.append({"role": msg["role"], "content": content})
+    return pieces
+
+
+def chunk_history(history, max_tokens=CHUNK_TOKENS):
+    """
+    Divide la cronologia in parti consecutive di al massimo max_tokens token
+    stimati; un messaggio più lungo di una parte viene diviso su più parti.
+    """
+    chunks, current, size = [], [], 0
+    for msg in (piece for message in history for piece in split_message(message, max_tokens)):
+        tokens = estimate_tokens(msg["content"])
+        if current and size + tokens > max_tokens:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(msg)
+        size += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_facts_prompt(chunk):
+    return compile_template(FACTS_TEMPLATE).render({"session_text": format_session(chunk, len(chunk))})
+
+
+def parse_facts(text):
+    """Righe "- fatto" della risposta di estrazione (nessuna se il modello risponde NESSUNO)."""
+    facts = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(("- ", "* ", "• ")):
+            fact = line[2:].strip()
+            if fact:
+                facts.append(fact)
+    return facts
+
+
+def merge_facts(fact_lists):
+    """Unisce i fatti delle varie parti nell'ordine della sessione, senza duplicati."""
+    seen, merged = set(), []
+    for facts in fact_lists:
+        for fact in facts:
+            key = " ".join(fact.lower().split()).rstrip(".")
+            if key not in seen:
+                seen.add(key)
+                merged.append(fact)
+    return merged
+
+
+def build_reduce_prompt(memory, facts):
+    """Prompt di consolidamento dai fatti estratti (fase reduce)."""
+    return compile_template(REDUCE_TEMPLATE).render({
+        "memory": pretty_json(memory),
+        "facts": "\n".join(f"- {fact}" for fact in facts),
+    })
+
+
+class MemoryConsolidationThread(AIResponseThread):
+    """
+    AIResponseThread per il consolidamento: emette memory_received con
+    l'aggiornamento già decodificato e validato (senza i campi locali).
+    """
+    memory_received = pyqtSignal(dict)
+
+    def __init__(self, client, prompt, memory, model_config, **kwargs):
+        kwargs.setdefault("purpose", "memoria")
+        kwargs.setdefault("profile", resolve_profile("consolidation", model_config))
+        super().__init__(client, prompt, [], memory, model_config, **kwargs)
+
+    def request_extra(self):
+        return {"tools": [MEMORY_TOOL], "tool_choice": {"type": "tool", "name": MEMORY_TOOL["name"]}}
+
+    def _consume_stream(self, stream, stats, started, attempt=None):
+        """Analizza l'input dello strumento man mano e chiude lo stream appena l'oggetto è completo."""
+        scanner = JSONObjectScanner()
+        early_stop = False
+        for event in stream:
+            if event.type != "content_block_delta":
+                continue
+            delta = event.delta
+            if delta.type == "input_json_delta":
+                chunk = delta.partial_json
+            elif delta.type == "text_delta":
+                chunk = delta.text  # Modelli o proxy senza strumenti: JSON nel testo
+            else:
+                continue
+            self._on_chunk(stats, started, attempt)
+            if scanner.feed(chunk):
+                early_stop = True
+                break
+        if not early_stop:
+            scanner.close()
+
+        usage = stream.current_message_snapshot.usage
+        # Con lo stream chiuso in anticipo i token in uscita non sono ancora stati comunicati
+        output_tokens = max(usage.output_tokens or 0, estimate_tokens(scanner.text))
+        data, error = scanner.value, scanner.error
+        if error is None:
+            problems = validate_memory_update(data)
+            error = "; ".join(problems) or None
+        return SimpleNamespace(
+            data=data, raw=scanner.text, error=error, early_stop=early_stop,
+            usage=SimpleNamespace(input_tokens=usage.input_tokens, output_tokens=output_tokens,
+                                  cache_read_input_tokens=getattr(usage, 'cache_read_input_tokens', None),
+                                  cache_creation_input_tokens=getattr(usage, 'cache_creation_input_tokens', None)))
+
+    def _request(self, messages, stats, started):
+        """Richiesta con riparazione: se il JSON non è valido si chiede di correggerlo (MAX_REPAIRS volte)."""
+        response = super()._request(messages, stats, started)
+        stats["early_stop"] = response.early_stop
+        repairs = 0
+        while response.error and repairs < MAX_REPAIRS:
+            repairs += 1
+            log_event(logger, logging.WARNING, "memory.repair", model=stats["model"], attempt=repairs,
+                      error=response.error)
+            # Con il JSON a disposizione basta il prompt mirato; senza, si ripete la richiesta originale
+            repair_messages = messages
+            if response.raw:
+                repair_messages = [{"role": "user", "content": build_repair_prompt(response.raw, response.error)}]
+            repair_stats = {"model": stats["model"], "retries": 0}
+            previous_usage = response.usage
+            response = super()._request(repair_messages, repair_stats, time.monotonic())
+            stats["retries"] += repair_stats["retries"]
+            for key in ("input_tokens", "output_tokens"):
+                setattr(response.usage, key, getattr(response.usage, key) + getattr(previous_usage, key))
+        stats["repairs"] = repairs
+        if response.error:
+            raise ValueError(f"aggiornamento della memoria non valido: {response.error}")
+        return response
+
+    def _emit(self, response):
+        data = {key: value for key, value in response.data.items() if key not in LOCAL_FIELDS}
+        self.memory_received.emit(data)
@@ -0,0 +1,141 @@
+"""
+Pre-filtro locale dei turni da ricordare.
+
+Ogni turno completo viene valutato subito, in handle_ai_response(), solo con
+regole locali sul messaggio dell'utente:
+
+    indizi lessicali     "mi chiamo", "preferisco", "il mio progetto", "ricordati"...
+    entità               nomi propri a metà frase, date e anni, email e link
+    prima persona        "io", "sono", "lavoro", "vivo"...
+    novità               parole che non compaiono ancora nella memoria
+
+Saluti e conferme valgono zero. I turni con punteggio almeno MEMORY_THRESHOLD
+vengono segnalati e il consolidamento riceve solo quelli (domanda e
+risposta), preceduti da un pezzo della risposta precedente come contesto.
+Con MEMORY_PREFILTER=false il consolidamento riceve di nuovo tutta la
+sessione.
+"""
+import logging
+import os
+import re
+import time
+
+from chat_logging import get_logger, log_event
+from model_router import question_type
+
+logger = get_logger("memory_filter")
+
+MEMORY_PREFILTER_ENV = "MEMORY_PREFILTER"
+
+MEMORY_THRESHOLD = 2
+# Caratteri della risposta precedente inviati come contesto di un turno segnalato
+CONTEXT_CHARS = 200
+
+_CUES = re.compile(r"\b(mi chiamo|ricorda\w*|preferisc\w*|mi piace|non mi piace|odio|adoro|detesto|"
+                   r"lavoro (come|a|in|per|presso)|vivo a|abito a|sono nat[oa]|studio|mi sono laureat[oa]|"
+                   r"sto lavorando|il mio progetto|progett\w*|obiettiv\w*|ho deciso|abbiamo deciso|"
+                   r"d'ora in (poi|avanti)|da ora in poi|sempre|mai più|compleanno|sposat[oa]|mia moglie|"
+                   r"mio marito|mi[oa] figli[oa]|allergic[oa])\b", re.IGNORECASE)
+_FIRST_PERSON = re.compile(r"\b(io|sono|ho|mio|mia|miei|mie|lavoro|vivo|abito|uso|voglio|vorrei|sto|faccio)\b",
+                           re.IGNORECASE)
+# Parola maiuscola dopo una minuscola: un nome proprio, non l'inizio di una frase
+_PROPER_NOUN = re.compile(r"(?<=[a-zàèéìòù,;:] )[A-Z][\wàèéìòù]+")
+_DATE = re.compile(r"\b\d{1,2}[/.-]\d{1,2}([/.-]\d{2,4})?\b|\b(19|20)\d{2}\b")
+_CONTACT = re.compile(r"\S+@\S+\.\w+|https?://\S+|www\.\S+")
+_WORD = re.compile(r"[a-zàèéìòù]{5,}")
+
+SMALL_TALK = ("saluto", "conferma")
+
+
+def prefilter_enabled():
+    return os.getenv(MEMORY_PREFILTER_ENV, "true").lower() != "false"
+
+
+def memory_vocabulary(memory):
+    """Parole (di almeno 5 lettere) presenti nei valori della memoria."""
+    words = set()
+    stack = list(memory.values())
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            words.update(_WORD.findall(value.lower()))
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return words
+
+
+def score_message(message, vocabulary):
+    """Restituisce (punteggio, motivi) di un messaggio dell'utente."""
+    if question_type(message) in SMALL_TALK and len(message) < 80:
+        return 0, ["chiacchiera"]
+    score, reasons = 0, []
+    if _CUES.search(message):
+        score += 2
+        reasons.append("indizio")
+    if _FIRST_PERSON.search(message):
+        score += 1
+        reasons.append("prima_persona")
+    entities = sum(1 for pattern in (_PROPER_NOUN, _DATE, _CONTACT) if pattern.search(message))
+    if entities:
+        score += min(entities, 2)
+        reasons.append("entità")
+    # La novità conta solo per i messaggi che parlano dell'utente
+    words = set(_WORD.findall(message.lower()))
+    if words and ("indizio" in reasons or "prima_persona" in reasons):
+        novelty = len(words - vocabulary) / len(words)
+        if novelty >= 0.5:
+            score += 1
+            reasons.append("novità")
+        elif novelty < 0.2:
+            score -= 1  # Già tutto in memoria
+            reasons.append("già_noto")
+    return score, reasons
+
+
+class MemoryFilter:
+    """Valuta i turni; il vocabolario della memoria viene ricalcolato solo quando cambia la revisione."""
+    def __init__(self, threshold=MEMORY_THRESHOLD):
+        self.threshold = threshold
+        self._vocabulary = {}
+
+    def vocabulary(self, memory_manager):
+        revision = memory_manager.revision
+        cached = self._vocabulary.get(id(memory_manager))
+        if cached is None or cached[0] != revision:
+            cached = (revision, memory_vocabulary(memory_manager.get_memory_content()))
+            self._vocabulary[id(memory_manager)] = cached
+        return cached[1]
+
+    def is_memory_worthy(self, message, memory_manager):
+        started = time.perf_counter()
+        score, reasons = score_message(message, self.vocabulary(memory_manager))
+        worthy = score >= self.threshold
+        log_event(logger, logging.DEBUG, "memory.prefilter.turn", worthy=worthy, score=score,
+                  reasons=",".join(reasons), score_time=time.perf_counter() - started)
+        return worthy
+
+
+def select_memory_turns(history, flagged, context_chars=CONTEXT_CHARS):
+    """
+    Messaggi da consolidare: i turni segnalati (indici dei messaggi utente in
+    `history`) con la loro risposta, preceduti dall'inizio della risposta
+    precedente come contesto.
+    """
+    selected, included = [], set()
+    for index in sorted(flagged):
+        if index >= len(history):
+            continue
+        previous = index - 1
+        if previous >= 0 and previous not in included and history[previous]["role"] == "assistant":
+            content = history[previous]["content"]
+            if len(content) > context_chars:
+                content = content[:context_chars] + "…"
+            selected.append({"role": "assistant", "content": content})
+            included.add(previous)
+        for position in (index, index + 1):
+            if position < len(history) and position not in included:
+                selected.append(history[position])
+                included.add(position)
+    return selected
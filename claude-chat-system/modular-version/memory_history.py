@@ -0,0 +1,184 @@
+import copy
+import json
+import os
+from datetime import datetime
+
+from file_sync import FileLock
+
+# Ogni N versioni viene salvato uno snapshot completo, così la ricostruzione
+# di una versione non deve riapplicare tutta la storia dall'inizio
+KEYFRAME_INTERVAL = 20
+
+
+def history_file_for(memory_file):
+    """Percorso del file cronologia associato a un file di memoria."""
+    return os.path.splitext(memory_file)[0] + ".history.jsonl"
+
+
+def diff(old, new, path=None):
+    """
+    Differenza strutturale tra due documenti JSON, lineare nella dimensione.
+    Restituisce una lista di operazioni:
+      ["set", path, valore], ["del", path], ["splice", path, indice, n_rimossi, elementi]
+    """
+    path = path or []
+    ops = []
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(["del", path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["set", path + [key], value])
+            else:
+                ops.extend(diff(old[key], value, path + [key]))
+    elif isinstance(old, list) and isinstance(new, list):
+        # Taglia prefisso e suffisso comuni: le liste di memoria crescono per aggiunte
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and old[start] == new[start]:
+            start += 1
+        old_end, new_end = len(old), len(new)
+        while old_end > start and new_end > start and old[old_end - 1] == new[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if old_end - start == new_end - start:
+            for i in range(start, old_end):
+                ops.extend(diff(old[i], new[i], path + [i]))
+        else:
+            ops.append(["splice", path, start, old_end - start, new[start:new_end]])
+    elif type(old) is not type(new) or old != new:
+        ops.append(["set", path, new])
+    return ops
+
+
+def apply_delta(document, ops):
+    """Applica le operazioni prodotte da diff() e restituisce il nuovo documento."""
+    document = copy.deepcopy(document)
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path and kind == "set":
+            document = copy.deepcopy(op[2])
+            continue
+        target = document
+        last = path[-1] if path else None
+        for key in (path[:-1] if kind != "splice" else path):
+            target = target[key]
+        if kind == "set":
+            target[last] = copy.deepcopy(op[2])
+        elif kind == "del":
+            del target[last]
+        elif kind == "splice":
+            index, removed, items = op[2], op[3], op[4]
+            target[index:index + removed] = copy.deepcopy(items)
+    return document
+
+
+class MemoryHistory:
+    """
+    Cronologia versionata della memoria in un file JSONL append-only.
+    Ogni riga è una versione con delta rispetto alla precedente (o uno
+    snapshot completo ogni KEYFRAME_INTERVAL versioni), più sessione e modello
+    che hanno prodotto la modifica.
+
+    Sullo stesso file scrivono più programmi (le due chat, altre schede) e la
+    memoria cambia anche senza passare di qui (JSON Manager). Per questo ogni
+    aggiunta avviene sotto il FileLock del file di memoria, rileggendo dal
+    file l'ultima versione e il suo stato: se lo stato di partenza di chi
+    registra è diverso, la versione viene salvata come snapshot completo
+    invece che come delta.
+    """
+    def __init__(self, history_file, lock_path=None):
+        self.history_file = history_file
+        self.lock_path = lock_path or history_file
+        # (dimensione del file, ultima versione, stato) dopo l'ultima lettura o scrittura
+        self._tail = None
+
+    def _read_entries(self):
+        if not os.path.exists(self.history_file):
+            return []
+        entries = []
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Riga troncata (es. crash durante la scrittura): la ignora
+                        continue
+        return entries
+
+    def _file_size(self):
+        try:
+            return os.path.getsize(self.history_file)
+        except OSError:
+            return 0
+
+    def _last_state(self):
+        """(ultima versione, stato della memoria a quella versione) letti dal file; (-1, None) se vuoto."""
+        if self._tail and self._tail[0] == self._file_size():
+            return self._tail[1], self._tail[2]
+        version, state = -1, None
+        for entry in self._read_entries():
+            version = entry["version"]
+            if "snapshot" in entry:
+                state = entry["snapshot"]
+            elif state is not None:
+                state = apply_delta(state, entry["delta"])
+        return version, state
+
+    def _append(self, entry, state):
+        with open(self.history_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._tail = (self._file_size(), entry["version"], copy.deepcopy(state))
+
+    def last_version(self):
+        return self._last_state()[0]
+
+    def record(self, old_memory, new_memory, session_id=None, model=None, origin="consolidamento"):
+        """Registra il passaggio da old_memory a new_memory come nuova versione."""
+        ops = diff(old_memory, new_memory)
+        if not ops:
+            return None
+        with FileLock(self.lock_path):
+            last, state = self._last_state()
+            if last < 0:
+                # Prima modifica registrata: salva lo stato di partenza come versione 0
+                self._append({"version": 0, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                              "origin": "baseline", "snapshot": old_memory}, old_memory)
+                last, state = 0, old_memory
+            version = last + 1
+            entry = {
+                "version": version,
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "origin": origin,
+                "session_id": session_id,
+                "model": model,
+            }
+            # Un delta vale solo se parte dallo stato dell'ultima versione nel file
+            if version % KEYFRAME_INTERVAL == 0 or state != old_memory:
+                entry["snapshot"] = new_memory
+            else:
+                entry["delta"] = ops
+            self._append(entry, new_memory)
+        return version
+
+    def list_versions(self):
+        """Metadati delle versioni (senza delta né snapshot)."""
+        return [{k: v for k, v in entry.items() if k not in ("delta", "snapshot")}
+                for entry in self._read_entries()]
+
+    def get_version(self, version):
+        """Ricostruisce la memoria alla versione indicata partendo dall'ultimo snapshot utile."""
+        state = None
+        for entry in self._read_entries():
+            if entry["version"] > version:
+                break
+            if "snapshot" in entry:
+                state = entry["snapshot"]
+            elif state is not None:
+                state = apply_delta(state, entry["delta"])
+        if state is None:
+            raise KeyError(f"Versione {version} non trovata")
+        return state
@@ -1,69 +1,408 @@
-import json
+import copy
+import itertools
+import logging
 import os
+import re
 from datetime import datetime
 
+from file_sync import FileLock, FileSignature, merge, read_json, write_json_atomic
+from memory_history import MemoryHistory, history_file_for
+from snapshot_format import SnapshotError, clone, read_snapshot, snapshot_file_for, snapshots_enabled, write_snapshot
+from chat_logging import get_logger, log_event
+
+logger = get_logger("memory")
+
+# Struttura di memoria predefinita
+DEFAULT_MEMORY = {
+    "profilo_utente": "",
+    "progetti_attivi": [],
+    "preferenze": [],
+    "note_varie": [],
+    "ultimo_aggiornamento": "",
+    "sessioni_totali": 0
+}
+
+# Livello condiviso: chi è l'utente non cambia da una persona all'altra
+SHARED_KEYS = ("profilo_utente", "preferenze")
+SHARED_MEMORY_FILE = "memoria_condivisa.json"
+# File che prima dei namespace conteneva tutta la memoria (profilo compreso)
+LEGACY_MEMORY_FILE = "claudia_memory.json"
+
+# Tentativi di caricamento se il file è bloccato da un altro programma (ognuno attende il timeout del lock)
+LOAD_ATTEMPTS = 3
+
+# Revisioni uniche tra tutte le istanze: identificano un contenuto della memoria (cache dei prompt)
+_revisions = itertools.count(1)
+
+
+def default_memory(keys=None):
+    """Copia della struttura predefinita, eventualmente limitata ad alcune chiavi."""
+    keys = keys or DEFAULT_MEMORY.keys()
+    return {key: copy.deepcopy(DEFAULT_MEMORY[key]) for key in keys}
+
+
+def rebase_update(base, current, update):
+    """
+    Riporta sulla memoria attuale (current) le modifiche che il modello ha fatto
+    partendo da base. Per ogni chiave dell'aggiornamento: se il modello non l'ha
+    cambiata resta quella attuale; se è cambiata solo nell'aggiornamento vale la
+    sua; se sono cambiate entrambe liste e dict vengono uniti (merge a tre vie),
+    mentre per gli altri valori resta quello attuale e la chiave è in conflitto.
+    Restituisce (dati da applicare, chiavi in conflitto).
+    """
+    rebased, conflicts = {}, []
+    for key, value in update.items():
+        old, now = base.get(key), current.get(key)
+        if value == old:
+            continue
+        if now == old or now == value:
+            rebased[key] = value
+        elif type(old) is type(now) is type(value) and isinstance(value, (list, dict)):
+            rebased[key] = merge(old, now, value)
+        else:
+            conflicts.append(key)
+    return rebased, conflicts
+
+
+def format_memory(memory):
+    """Formatta una memoria per una visualizzazione leggibile."""
+    formatted = ""
+    if memory.get("profilo_utente"):
+        formatted += f"• Profilo: {memory['profilo_utente']}\n"
+    if memory.get("progetti_attivi"):
+        formatted += f"• Progetti: {', '.join(memory['progetti_attivi'])}\n"
+    if memory.get("preferenze"):
+        formatted += f"• Preferenze: {', '.join(memory['preferenze'])}\n"
+    if memory.get("note_varie"):
+        formatted += f"• Note: {', '.join(memory['note_varie'])}\n"
+    return formatted.strip() or "Niente di specifico ancora salvato."
+
+
 class MemoryManager:
-    def __init__(self, memory_file="claudia_memory.json"):
+    def __init__(self, memory_file="claudia_memory.json", keys=None, exclude=(), snapshot=None):
         self.memory_file = memory_file
+        # Snapshot binario accanto al JSON (BINARY_SNAPSHOTS=true): caricamento molto più veloce
+        use_snapshot = snapshots_enabled() if snapshot is None else snapshot
+        self.snapshot_file = snapshot_file_for(memory_file) if use_snapshot else None
+        # Chiavi gestite da questo file (None = tutte) e chiavi che appartengono a un altro livello
+        self.keys = keys
+        self.exclude = tuple(exclude)
+        # Stato del file all'ultima lettura/scrittura: base del merge e rilevamento modifiche esterne
+        self.signature = FileSignature(memory_file)
+        self._base = None
         self.memory = self._load_memory()
+        self.revision = next(_revisions)
+        # Stesso lock del file di memoria: la cronologia è condivisa da tutti i programmi che la scrivono
+        self.history = MemoryHistory(history_file_for(memory_file), lock_path=memory_file)
 
     def _load_memory(self):
-        """Carica la memoria dal file JSON."""
+        """
+        Carica la memoria dallo snapshot binario se è ancora aggiornato,
+        altrimenti dal JSON. Se il file resta bloccato da un altro programma
+        solleva TimeoutError: partire dalla memoria vuota la farebbe scrivere
+        al posto di quella vera.
+        """
         if os.path.exists(self.memory_file):
-            try:
-                with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                # In caso di errore o file corrotto, reinizializza la memoria
-                pass
+            for attempt in range(1, LOAD_ATTEMPTS + 1):
+                try:
+                    return self._read_memory()
+                except TimeoutError as e:
+                    log_event(logger, logging.WARNING, "memory.load_locked", file=self.memory_file, attempt=attempt,
+                              error=str(e))
+                    if attempt == LOAD_ATTEMPTS:
+                        raise
+                except Exception:
+                    # In caso di errore o file corrotto, reinizializza la memoria
+                    logger.exception("memory.load_failed", extra={"event": "memory.load_failed",
+                                                                   "fields": {"file": self.memory_file}})
+                    break
         
-        # Struttura di memoria predefinita
-        return {
-            "profilo_utente": "",
-            "progetti_attivi": [],
-            "preferenze": [],
-            "note_varie": [],
-            "ultimo_aggiornamento": "",
-            "sessioni_totali": 0
-        }
+        return self._default_memory()
+
+    def _read_memory(self):
+        with FileLock(self.memory_file):
+            memory = self._read_snapshot()
+            if memory is None:
+                memory, raw = read_json(self.memory_file)
+                self.signature.update(raw)
+                self._write_snapshot(memory)
+        self._base = clone(memory)
+        # Chiavi spostate in un altro livello: spariranno dal file al prossimo salvataggio
+        for key in self.exclude:
+            memory.pop(key, None)
+        return memory
+
+    def _read_snapshot(self):
+        """Memoria dallo snapshot, o None se manca o se il JSON è stato modificato dopo."""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return None
+        stat = os.stat(self.memory_file)
+        is_current = lambda meta: (meta.get("source_size"), meta.get("source_mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+        try:
+            meta, memory = read_snapshot(self.snapshot_file, accept=is_current)
+        except SnapshotError as e:
+            log_event(logger, logging.WARNING, "memory.snapshot_unreadable", file=self.snapshot_file, error=str(e))
+            return None
+        if memory is None:
+            log_event(logger, logging.INFO, "memory.snapshot_stale", file=self.snapshot_file)
+            return None
+        self.signature.assume(meta["source_sha256"])
+        return memory
+
+    def _write_snapshot(self, memory):
+        """Aggiorna lo snapshot legandolo allo stato attuale del file JSON."""
+        if not self.snapshot_file:
+            return
+        try:
+            size = write_snapshot(self.snapshot_file, memory, {
+                "source": os.path.basename(self.memory_file),
+                "source_sha256": self.signature.digest,
+                "source_size": self.signature.size,
+                "source_mtime_ns": self.signature.mtime_ns,
+            })
+            log_event(logger, logging.DEBUG, "memory.snapshot_saved", file=self.snapshot_file, bytes=size)
+        except OSError as e:
+            log_event(logger, logging.WARNING, "memory.snapshot_failed", file=self.snapshot_file, error=str(e))
+
+    def _default_memory(self):
+        keys = self.keys or [key for key in DEFAULT_MEMORY if key not in self.exclude]
+        return default_memory(keys)
     
     def save_memory(self):
-        """Salva la memoria corrente nel file JSON."""
+        """
+        Salva la memoria corrente nel file JSON. Se nel frattempo un altro
+        programma ha modificato il file, le sue modifiche vengono unite alle
+        nostre invece di essere sovrascritte.
+        """
         self.memory["ultimo_aggiornamento"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        with open(self.memory_file, 'w', encoding='utf-8') as f:
-            json.dump(self.memory, f, indent=2, ensure_ascii=False)
+        with FileLock(self.memory_file):
+            if os.path.exists(self.memory_file) and self.signature.changed():
+                # Senza base (file illeggibile al caricamento) si unisce partendo dalla memoria vuota:
+                # le chiavi non toccate qui restano quelle del file
+                base = self._base if self._base is not None else self._default_memory()
+                try:
+                    theirs, _ = read_json(self.memory_file)
+                    merged = merge(base, self.memory, theirs)
+                    for key in self.exclude:
+                        merged.pop(key, None)
+                    self._update_in_place(merged)
+                    log_event(logger, logging.INFO, "memory.merged", file=self.memory_file)
+                except ValueError:
+                    # File esterno corrotto: prevale la versione locale
+                    log_event(logger, logging.WARNING, "memory.merge_skipped", file=self.memory_file)
+            raw = write_json_atomic(self.memory_file, self.memory)
+            self.signature.update(raw)
+            self._write_snapshot(self.memory)
+        log_event(logger, logging.DEBUG, "memory.saved", file=self.memory_file, bytes=len(raw))
+        self._base = clone(self.memory)
+        self.revision = next(_revisions)
+
+    def reload_if_changed(self):
+        """
+        Ricarica la memoria se il file è stato modificato da un altro programma.
+        Aggiorna solo le chiavi cambiate (il dict resta lo stesso oggetto) e
+        restituisce la lista delle chiavi modificate.
+        """
+        if not self.signature.changed():
+            return []
+        try:
+            with FileLock(self.memory_file):
+                theirs, raw = read_json(self.memory_file)
+        except (OSError, ValueError, TimeoutError) as e:
+            log_event(logger, logging.WARNING, "memory.reload_failed", file=self.memory_file, error=str(e))
+            return []
+        # Eventuali modifiche locali non ancora salvate vengono preservate
+        merged = theirs if self._base is None else merge(self._base, self.memory, theirs)
+        changed = self._update_in_place(merged)
+        self.signature.update(raw)
+        self._base = clone(theirs)
+        if changed:
+            self.revision = next(_revisions)
+        log_event(logger, logging.INFO, "memory.reloaded", file=self.memory_file, keys=changed)
+        return changed
+
+    def _update_in_place(self, new_memory):
+        """Porta self.memory a new_memory toccando solo le chiavi diverse."""
+        changed = [key for key in self.memory if key not in new_memory]
+        for key in changed:
+            del self.memory[key]
+        for key, value in new_memory.items():
+            if self.memory.get(key, None) != value or key not in self.memory:
+                self.memory[key] = value
+                changed.append(key)
+        return changed
 
     def get_memory_content(self):
         """Restituisce il contenuto completo della memoria."""
         return self.memory
 
-    def update_memory_data(self, updated_data):
+    def snapshot(self):
+        """(revisione, copia della memoria): la base di un aggiornamento da applicare con compare_and_update()."""
+        return self.revision, clone(self.memory)
+
+    def rebase(self, base_revision, base_memory, updated_data):
+        """
+        Prepara un aggiornamento calcolato su una versione precedente. Se la
+        revisione non è cambiata i dati restano quelli; altrimenti vengono
+        riportati sulla memoria attuale con rebase_update(). Restituisce
+        (dati da applicare, esito "applied" o "rebased", chiavi in conflitto).
+        """
+        self.reload_if_changed()  # Le modifiche esterne non ancora viste contano come versione nuova
+        if self.revision == base_revision:
+            return updated_data, "applied", []
+        data, conflicts = rebase_update(base_memory, self.memory, updated_data)
+        return data, "rebased", conflicts
+
+    def compare_and_update(self, base_revision, base_memory, updated_data, session_id=None, model=None,
+                           rebase_conflicts=True):
+        """
+        Aggiornamento con concorrenza ottimistica: non sovrascrive mai uno stato
+        più recente di base_revision. Con conflitti e rebase_conflicts=False non
+        scrive nulla ed esito è "conflict" (l'aggiornamento va ricalcolato).
+        Restituisce (esito, chiavi in conflitto).
+        """
+        data, status, conflicts = self.rebase(base_revision, base_memory, updated_data)
+        if conflicts and not rebase_conflicts:
+            status = "conflict"
+        else:
+            self.update_memory_data(data, session_id=session_id, model=model)
+        log_event(logger, logging.INFO, "memory.cas", file=self.memory_file, status=status, conflicts=conflicts)
+        return status, conflicts
+
+    def update_memory_data(self, updated_data, session_id=None, model=None):
         """Aggiorna la memoria con i nuovi dati e incrementa il contatore sessioni."""
+        previous = clone(self.memory)
         self.memory.update(updated_data)
-        self.memory["sessioni_totali"] += 1
+        if "sessioni_totali" in self.memory:
+            self.memory["sessioni_totali"] += 1
         self.save_memory()
+        self.history.record(previous, self.memory, session_id=session_id, model=model)
 
     def format_memory_for_display(self):
         """Formatta la memoria per una visualizzazione leggibile."""
-        formatted = ""
-        if self.memory["profilo_utente"]:
-            formatted += f"• Profilo: {self.memory['profilo_utente']}\n"
-        if self.memory["progetti_attivi"]:
-            formatted += f"• Progetti: {', '.join(self.memory['progetti_attivi'])}\n"
-        if self.memory["preferenze"]:
-            formatted += f"• Preferenze: {', '.join(self.memory['preferenze'])}\n"
-        if self.memory["note_varie"]:
-            formatted += f"• Note: {', '.join(self.memory['note_varie'])}\n"
-        return formatted.strip() or "Niente di specifico ancora salvato."
+        return format_memory(self.memory)
         
     def reset_memory(self):
         """Reinizializza la memoria allo stato predefinito."""
-        self.memory = {
-            "profilo_utente": "",
-            "progetti_attivi": [],
-            "preferenze": [],
-            "note_varie": [],
-            "ultimo_aggiornamento": "",
-            "sessioni_totali": 0
-        }
+        previous = self.memory
+        self.memory = self._default_memory()
         self.save_memory() # Salva lo stato resettato
+        self.history.record(previous, self.memory, origin="reset")
+
+
+class LayeredMemory:
+    """
+    Memoria vista da una persona: il livello condiviso (profilo utente e
+    preferenze, comune a tutti i modelli) sovrapposto al livello della persona
+    (progetti, note, contatore sessioni). Espone la stessa interfaccia di MemoryManager.
+    """
+    def __init__(self, namespace, shared, persona):
+        self.namespace = namespace
+        self.shared = shared
+        self.persona = persona
+        self.memory_file = persona.memory_file
+
+    @property
+    def revision(self):
+        return (self.shared.revision, self.persona.revision)
+
+    @property
+    def memory_files(self):
+        return [self.shared.memory_file, self.persona.memory_file]
+
+    def get_memory_content(self):
+        """Vista unificata dei due livelli (un nuovo dict a ogni chiamata)."""
+        merged = {key: self.shared.memory[key] for key in SHARED_KEYS if key in self.shared.memory}
+        merged.update(self.persona.memory)
+        return merged
+
+    def snapshot(self):
+        return self.revision, clone(self.get_memory_content())
+
+    def compare_and_update(self, base_revision, base_memory, updated_data, session_id=None, model=None,
+                           rebase_conflicts=True):
+        """Come MemoryManager.compare_and_update(), con i conflitti controllati su entrambi i livelli prima di scrivere."""
+        shared_revision, persona_revision = base_revision
+        shared_data, shared_status, shared_conflicts = self.shared.rebase(
+            shared_revision, base_memory, {key: updated_data[key] for key in SHARED_KEYS if key in updated_data})
+        persona_data, persona_status, persona_conflicts = self.persona.rebase(
+            persona_revision, base_memory, {key: value for key, value in updated_data.items() if key not in SHARED_KEYS})
+        conflicts = shared_conflicts + persona_conflicts
+        status = "rebased" if "rebased" in (shared_status, persona_status) else "applied"
+        if conflicts and not rebase_conflicts:
+            status = "conflict"
+        else:
+            self.update_memory_data({**shared_data, **persona_data}, session_id=session_id, model=model)
+        log_event(logger, logging.INFO, "memory.cas", namespace=self.namespace, status=status, conflicts=conflicts)
+        return status, conflicts
+
+    def update_memory_data(self, updated_data, session_id=None, model=None):
+        """Divide i dati aggiornati tra i due livelli; il file condiviso viene scritto solo se cambia."""
+        shared_data = {key: updated_data[key] for key in SHARED_KEYS if key in updated_data}
+        persona_data = {key: value for key, value in updated_data.items() if key not in SHARED_KEYS}
+        if any(self.shared.memory.get(key) != value for key, value in shared_data.items()):
+            self.shared.update_memory_data(shared_data, session_id=session_id, model=model)
+        self.persona.update_memory_data(persona_data, session_id=session_id, model=model)
+
+    def save_memory(self):
+        self.shared.save_memory()
+        self.persona.save_memory()
+
+    def reload_if_changed(self):
+        return self.shared.reload_if_changed() + self.persona.reload_if_changed()
+
+    def format_memory_for_display(self):
+        return format_memory(self.get_memory_content())
+
+    def reset_memory(self):
+        """Reinizializza solo il livello della persona: il profilo utente resta alle altre."""
+        self.persona.reset_memory()
+
+
+class MemoryStore:
+    """
+    Memorie di tutte le persone, caricate solo quando servono. Ogni voce di
+    models.json può indicare "memory_namespace" e "memory_file"; modelli con lo
+    stesso namespace condividono la memoria. Una volta caricato, un namespace
+    resta in cache: cambiare modello non rilegge i file delle altre persone.
+    """
+    def __init__(self, shared_file=SHARED_MEMORY_FILE):
+        self.shared_file = shared_file
+        self._shared = None
+        self._personas = {}
+
+    @staticmethod
+    def namespace_for(model_name, model_config):
+        namespace = (model_config or {}).get("memory_namespace")
+        return namespace or re.sub(r"[^a-z0-9]+", "_", model_name.lower()).strip("_")
+
+    def _load_shared(self):
+        seed = None
+        if not os.path.exists(self.shared_file) and os.path.exists(LEGACY_MEMORY_FILE):
+            # Primo avvio con i namespace: il profilo viene preso dalla vecchia memoria unica
+            try:
+                with FileLock(LEGACY_MEMORY_FILE):
+                    legacy, _ = read_json(LEGACY_MEMORY_FILE)
+                seed = {key: legacy[key] for key in SHARED_KEYS if key in legacy}
+            except (OSError, ValueError, TimeoutError):
+                pass
+        shared = MemoryManager(self.shared_file, keys=SHARED_KEYS + ("ultimo_aggiornamento",))
+        if seed:
+            shared.memory.update(seed)
+            shared.save_memory()
+        return shared
+
+    def for_model(self, model_name, model_config):
+        """Memoria (LayeredMemory) della persona associata al modello."""
+        if self._shared is None:
+            self._shared = self._load_shared()
+        namespace = self.namespace_for(model_name, model_config)
+        if namespace not in self._personas:
+            memory_file = (model_config or {}).get("memory_file") or f"memoria_{namespace}.json"
+            persona = MemoryManager(memory_file, exclude=SHARED_KEYS)
+            self._personas[namespace] = LayeredMemory(namespace, self._shared, persona)
+            log_event(logger, logging.INFO, "memory.namespace_loaded", namespace=namespace, file=memory_file)
+        return self._personas[namespace]
+
+    def loaded_namespaces(self):
+        return list(self._personas)
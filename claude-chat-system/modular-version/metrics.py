@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+METRICS_LOG_FILE = "metrics.jsonl"
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+# Porta dell'endpoint Prometheus: attivo solo se la variabile d'ambiente è impostata
+METRICS_PORT_ENV = "METRICS_PORT"
+
+# Prezzi in dollari per milione di token: (input, output, lettura cache, scrittura cache)
+PRICING = {
+    "claude-3-haiku-20240307": (0.25, 1.25, 0.03, 0.30),
+    "claude-3-sonnet-20240229": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-5-haiku-20241022": (0.80, 4.00, 0.08, 1.00),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-5-sonnet-20240620": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-7-sonnet-20250219": (3.00, 15.00, 0.30, 3.75),
+    "claude-sonnet-4-20250514": (3.00, 15.00, 0.30, 3.75),
+}
+
+# Limiti superiori (secondi) degli istogrammi di latenza esportati
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+def estimate_cost(api_model, input_tokens=0, output_tokens=0, cache_read_tokens=0, cache_write_tokens=0):
+    """Costo stimato in dollari di una richiesta; None se il modello non è nel listino."""
+    prices = PRICING.get(api_model)
+    if prices is None:
+        return None
+    tokens = (input_tokens, output_tokens, cache_read_tokens, cache_write_tokens)
+    return sum(count * price for count, price in zip(tokens, prices)) / 1_000_000
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRecorder:
+    """
+    Raccoglie le metriche di ogni richiesta all'API: attesa in coda, tempo al
+    primo token, latenza totale, token (input/output/cache), tentativi, modello
+    e costo stimato. Ogni richiesta viene scritta su un log JSONL a rotazione;
+    gli aggregati per modello alimentano il pannello della GUI e l'endpoint
+    Prometheus. Può essere usato da più thread contemporaneamente.
+    Riceve anche dallo scheduler (job_scheduler.py) la profondità della coda
+    e le attese di ogni classe di lavoro, e dal pre-filtro della memoria
+    (memory_filter.py) i token risparmiati nei consolidamenti.
+    """
+    def __init__(self, log_file=METRICS_LOG_FILE, max_bytes=METRICS_LOG_MAX_BYTES,
+                 backups=METRICS_LOG_BACKUPS, recent_size=200):
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=recent_size)
+        self.totals = {}
+        self._latency = {}
+        self._ttft = {}
+        self.queues = {}
+        self._queue_wait = {}
+        self.prefilter = {"consolidations": 0, "turns": 0, "flagged": 0, "tokens_saved": 0}
+        self._server = None
+
+        self._log = logging.getLogger(f"metrics.{id(self)}")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        if log_file:
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log.addHandler(handler)
+
+    def record(self, entry):
+        """
+        Registra una richiesta. entry è un dict con almeno "model"; le altre
+        chiavi note sono purpose, job_class, queue_wait, ttft, latency, input_tokens,
+        output_tokens, cache_read_tokens, cache_write_tokens, retries, error e,
+        per le richieste con fallback, requested_model, attempts e hedged; per
+        quelle dirottate dal router routed_from, route_reason e route_saving;
+        cancelled per le richieste che hanno perso la gara dell'hedging (contano
+        nei token e nel costo del modello).
+        Restituisce l'entry completata con timestamp e costo.
+        """
+        entry = dict(entry)
+        entry.setdefault("timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        entry["cost"] = estimate_cost(entry["model"], entry.get("input_tokens", 0),
+                                      entry.get("output_tokens", 0), entry.get("cache_read_tokens", 0),
+                                      entry.get("cache_write_tokens", 0))
+        with self._lock:
+            self.recent.append(entry)
+            totals = self.totals.setdefault(entry["model"], {
+                "requests": 0, "errors": 0, "retries": 0, "input_tokens": 0, "output_tokens": 0,
+                "cache_read_tokens": 0, "cache_write_tokens": 0, "cost": 0.0,
+            })
+            totals["requests"] += 1
+            totals["errors"] += 1 if entry.get("error") else 0
+            totals["retries"] += entry.get("retries", 0)
+            for key in ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens"):
+                totals[key] += entry.get(key, 0)
+            totals["cost"] += entry["cost"] or 0.0
+            if entry.get("latency") is not None:
+                self._latency.setdefault(entry["model"], _Histogram()).observe(entry["latency"])
+            if entry.get("ttft") is not None:
+                self._ttft.setdefault(entry["model"], _Histogram()).observe(entry["ttft"])
+        self._log.info(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        return entry
+
+    def record_queue(self, job_class, depth, running, wait=None):
+        """Stato della coda di una classe di lavoro; wait è l'attesa di un lavoro appena partito."""
+        with self._lock:
+            queue = self.queues.setdefault(job_class, {"depth": 0, "running": 0, "jobs": 0, "max_wait": 0.0})
+            queue["depth"] = depth
+            queue["running"] = running
+            if wait is not None:
+                queue["jobs"] += 1
+                queue["max_wait"] = max(queue["max_wait"], wait)
+                self._queue_wait.setdefault(job_class, _Histogram()).observe(wait)
+
+    def record_prefilter(self, turns, flagged, tokens_saved):
+        """Un consolidamento pre-filtrato: turni della sessione, turni segnalati e token non inviati."""
+        with self._lock:
+            self.prefilter["consolidations"] += 1
+            self.prefilter["turns"] += turns
+            self.prefilter["flagged"] += flagged
+            self.prefilter["tokens_saved"] += tokens_saved
+
+    def recent_percentile(self, model, pct, field="ttft", min_samples=1):
+        """
+        Percentile di un tempo (ttft o latency) nelle richieste recenti riuscite
+        di un modello; None se i campioni sono meno di min_samples.
+        """
+        with self._lock:
+            samples = sorted(entry[field] for entry in self.recent
+                             if entry["model"] == model and entry.get(field) is not None and not entry.get("error"))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+        return samples[index]
+
+    def summary(self):
+        """Aggregati per modello, con latenze medie, per il pannello della GUI."""
+        with self._lock:
+            result = {}
+            for model, totals in self.totals.items():
+                row = dict(totals)
+                latency, ttft = self._latency.get(model), self._ttft.get(model)
+                row["avg_latency"] = latency.total / latency.count if latency and latency.count else None
+                row["avg_ttft"] = ttft.total / ttft.count if ttft and ttft.count else None
+                result[model] = row
+            return result
+
+    def format_summary(self):
+        """Testo leggibile per il pannello metriche."""
+        lines = []
+        # Copia sotto lock: i thread delle richieste aggiungono voci mentre il pannello si aggiorna
+        with self._lock:
+            recent = list(self.recent)
+        last = next((entry for entry in reversed(recent) if not entry.get("cancelled")), None)
+        if last:
+            lines.append(f"Ultima richiesta ({last.get('purpose', 'chat')}, {last['model']}):")
+            lines.append(f"  attesa coda {_fmt_seconds(last.get('queue_wait'))}, "
+                         f"primo token {_fmt_seconds(last.get('ttft'))}, totale {_fmt_seconds(last.get('latency'))}")
+            lines.append(f"  token in/out/cache {last.get('input_tokens', 0)}/{last.get('output_tokens', 0)}/"
+                         f"{last.get('cache_read_tokens', 0)}, tentativi {last.get('retries', 0)}, "
+                         f"costo {_fmt_cost(last['cost'])}")
+            if last.get("error"):
+                lines.append(f"  errore: {last['error']}")
+            lines.append("")
+        for model, row in self.summary().items():
+            lines.append(f"{model}: {row['requests']} richieste ({row['errors']} errori), "
+                         f"media {_fmt_seconds(row['avg_latency'])}, primo token {_fmt_seconds(row['avg_ttft'])}")
+            lines.append(f"  token in/out {row['input_tokens']}/{row['output_tokens']}, "
+                         f"cache {row['cache_read_tokens']}, costo {_fmt_cost(row['cost'])}")
+        with self._lock:
+            queues = {name: (dict(queue), self._queue_wait.get(name)) for name, queue in self.queues.items()}
+        if queues:
+            if lines:
+                lines.append("")
+            lines.append("Code:")
+        for name, (queue, wait) in queues.items():
+            avg_wait = wait.total / wait.count if wait and wait.count else None
+            lines.append(f"  {name}: {queue['depth']} in coda, {queue['running']} in corso, "
+                         f"attesa media {_fmt_seconds(avg_wait)}, massima {_fmt_seconds(queue['max_wait'])}")
+        with self._lock:
+            prefilter = dict(self.prefilter)
+        if prefilter["consolidations"]:
+            if lines:
+                lines.append("")
+            lines.append(f"Pre-filtro memoria: {prefilter['flagged']}/{prefilter['turns']} turni da ricordare, "
+                         f"{prefilter['tokens_saved']} token risparmiati in {prefilter['consolidations']} consolidamenti")
+        return "\n".join(lines) or "Nessuna richiesta registrata."
+
+    def prometheus_text(self):
+        """Esportazione nel formato testuale di Prometheus."""
+        lines = []
+        counters = (
+            ("chat_requests_total", "requests", "Richieste all'API"),
+            ("chat_request_errors_total", "errors", "Richieste fallite"),
+            ("chat_request_retries_total", "retries", "Tentativi ripetuti"),
+            ("chat_input_tokens_total", "input_tokens", "Token in input"),
+            ("chat_output_tokens_total", "output_tokens", "Token in output"),
+            ("chat_cache_read_tokens_total", "cache_read_tokens", "Token letti dalla cache"),
+            ("chat_cache_write_tokens_total", "cache_write_tokens", "Token scritti in cache"),
+            ("chat_cost_dollars_total", "cost", "Costo stimato in dollari"),
+        )
+        with self._lock:
+            for name, key, help_text in counters:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for model, totals in self.totals.items():
+                    lines.append(f'{name}{{model="{model}"}} {totals[key]}')
+            for name, key, help_text in (
+                    ("chat_queue_depth", "depth", "Lavori in coda per classe"),
+                    ("chat_queue_running", "running", "Lavori in corso per classe")):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for job_class, queue in self.queues.items():
+                    lines.append(f'{name}{{job_class="{job_class}"}} {queue[key]}')
+            for name, key, help_text in (
+                    ("chat_memory_prefilter_turns_total", "turns", "Turni valutati dal pre-filtro della memoria"),
+                    ("chat_memory_prefilter_flagged_total", "flagged", "Turni segnalati come da ricordare"),
+                    ("chat_memory_prefilter_tokens_saved_total", "tokens_saved",
+                     "Token non inviati al consolidamento grazie al pre-filtro")):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {self.prefilter[key]}")
+            for name, label, histograms, help_text in (
+                    ("chat_request_latency_seconds", "model", self._latency, "Latenza totale della richiesta"),
+                    ("chat_time_to_first_token_seconds", "model", self._ttft, "Tempo al primo token"),
+                    ("chat_queue_wait_seconds", "job_class", self._queue_wait, "Attesa in coda per classe")):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for value, histogram in histograms.items():
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                        lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.total}')
+                    lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port, host="127.0.0.1"):
+        """Avvia in un thread separato l'endpoint /metrics per Prometheus."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # solo se l'endpoint è attivo
+        recorder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Nessun output per ogni richiesta di scraping
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def start_http_server_from_env(self):
+        """Avvia l'endpoint se METRICS_PORT è impostata; restituisce la porta o None."""
+        port = os.getenv(METRICS_PORT_ENV)
+        if not port:
+            return None
+        try:
+            return self.start_http_server(int(port))
+        except (ValueError, OSError):
+            return None
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for handler in list(self._log.handlers):
+            handler.close()
+            self._log.removeHandler(handler)
+
+
+def _fmt_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def _fmt_cost(value):
+    return "n/d" if value is None else f"${value:.4f}"
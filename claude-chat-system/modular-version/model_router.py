@@ -0,0 +1,125 @@
+"""
+Router dei modelli: i messaggi semplici (saluti, conferme, domande brevi)
+vanno a un modello più veloce, quelli impegnativi al modello scelto.
+
+La classificazione usa solo caratteristiche locali del messaggio (lunghezza,
+codice, tipo di domanda) e la profondità della cronologia, quindi costa
+pochi microsecondi. Si attiva per modello con la chiave "router" di
+models.json:
+
+    "router": {"enabled": true, "fast_model": "Haiku 3.5", "max_chars": 280, "max_history": 40}
+
+Il modello veloce riceve il prompt della persona e la memoria del modello
+scelto: cambia solo chi genera la risposta.
+"""
+import logging
+import re
+import time
+
+from chat_logging import get_logger, log_event
+
+logger = get_logger("router")
+
+# Soglie predefinite, sovrascrivibili nella chiave "router" del modello
+ROUTER_DEFAULTS = {
+    "enabled": False,
+    "fast_model": None,
+    "max_chars": 280,     # oltre questa lunghezza il messaggio resta al modello scelto
+    "max_history": 40,    # conversazioni lunghe: serve il modello più capace per il contesto
+}
+
+_CODE = re.compile(r"```|^\s*(def |class |import |from \S+ import |for .+:|if .+:|#include|SELECT )|[{};]\s*$",
+                   re.MULTILINE)
+_GREETING = re.compile(r"^\s*(ciao|salve|buongiorno|buonasera|buonanotte|hey|ehi|grazie|ok|va bene|perfetto|"
+                       r"a dopo|alla prossima)\b", re.IGNORECASE)
+_CONFIRMATION = re.compile(r"^\s*(s[iì]|no|certo|esatto|giusto|d'accordo|forse)\b[\s.!?]*$", re.IGNORECASE)
+_COMPLEX = re.compile(r"\b(perch[eé]|spiega\w*|analizz\w*|confront\w*|come funziona|scriv\w*|codice|"
+                      r"programm\w*|riassum\w*|traduc\w*|dimostr\w*|calcol\w*|progett\w*|debug\w*|errore)\b",
+                      re.IGNORECASE)
+
+# Tipi di messaggio che il modello veloce gestisce bene
+SIMPLE_TYPES = ("saluto", "conferma", "domanda_breve", "frase_breve")
+
+
+def question_type(message):
+    """Tipo di messaggio: saluto, conferma, richiesta_complessa, domanda_breve o frase_breve."""
+    if _COMPLEX.search(message):
+        return "richiesta_complessa"
+    if _GREETING.match(message):
+        return "saluto"
+    if _CONFIRMATION.match(message):
+        return "conferma"
+    if message.rstrip().endswith("?"):
+        return "domanda_breve"
+    return "frase_breve"
+
+
+def extract_features(message, history):
+    """Caratteristiche locali del turno usate per decidere."""
+    return {
+        "chars": len(message),
+        "lines": message.count("\n") + 1,
+        "has_code": bool(_CODE.search(message)),
+        "question_type": question_type(message),
+        "history_depth": len(history),
+    }
+
+
+class RouteDecision:
+    """Esito del router: modello (nome e configurazione) che risponde al turno, modello scelto e motivo."""
+    __slots__ = ("model_name", "model_config", "requested_model", "requested_config", "reason", "features")
+
+    def __init__(self, model_name, model_config, requested_model, requested_config, reason, features):
+        self.model_name = model_name
+        self.model_config = model_config
+        self.requested_model = requested_model
+        self.requested_config = requested_config
+        self.reason = reason
+        self.features = features
+
+    @property
+    def routed(self):
+        return self.model_name != self.requested_model
+
+
+class ModelRouter:
+    """Sceglie il modello di ogni turno in base alla chiave "router" del modello scelto."""
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+
+    def settings(self, model_config):
+        return {**ROUTER_DEFAULTS, **(model_config.get('router') or {})}
+
+    def classify(self, message, history, settings):
+        """Restituisce (semplice, motivo, caratteristiche)."""
+        features = extract_features(message, history)
+        if features["has_code"]:
+            return False, "codice", features
+        if features["chars"] > settings["max_chars"]:
+            return False, "messaggio_lungo", features
+        if features["history_depth"] > settings["max_history"]:
+            return False, "cronologia_lunga", features
+        if features["question_type"] not in SIMPLE_TYPES:
+            return False, features["question_type"], features
+        return True, features["question_type"], features
+
+    def route(self, message, history, model_name, model_config):
+        settings = self.settings(model_config)
+        fast_name = settings["fast_model"]
+        fast_config = self.config_manager.get_model_config(fast_name) if fast_name else None
+        if not settings["enabled"] or fast_config is None or fast_name == model_name:
+            return RouteDecision(model_name, model_config, model_name, model_config, "disattivato", None)
+
+        started = time.perf_counter()
+        simple, reason, features = self.classify(message, history, settings)
+        if simple:
+            # Risponde il modello veloce, ma con la persona (prompt iniziale) del modello scelto
+            routed_config = dict(fast_config, preferences_prompt=model_config.get('preferences_prompt'))
+            routed_config.pop('router', None)
+            decision = RouteDecision(fast_name, routed_config, model_name, model_config, reason, features)
+        else:
+            decision = RouteDecision(model_name, model_config, model_name, model_config, reason, features)
+        # Decisioni nel log, per tarare le soglie (il risparmio di latenza è in "router.saving")
+        log_event(logger, logging.INFO, "router.decision", requested=model_name, model=decision.model_name,
+                  routed=decision.routed, reason=reason, classify_time=time.perf_counter() - started, **features)
+        return decision
@@ -0,0 +1,172 @@
+"""
+Riproduce sessioni registrate (journal in sessions/, vedi session_journal.py)
+in parallelo contro il motore di chat, passando per la stessa costruzione dei
+messaggi di AIResponseThread. Senza --base-url avvia il server finto in locale.
+
+Uso:
+    python replay.py sessions/ --sessions 50 --rate 5 --concurrency 10
+    python replay.py sessions/20250101_120000_ab12cd.jsonl --base-url http://127.0.0.1:8765 --speed 1
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import summarize
+from chat_message import ChatMessage
+from fake_anthropic_server import FakeAnthropicServer, add_server_arguments, config_from_args
+from session_journal import find_journals, load_journal
+
+MODELS_FILE = "models.json"
+
+
+def load_session(path):
+    """Trasforma un journal in (memoria, lista di turni utente con la risposta registrata)."""
+    header, events = load_journal(path)
+    turns = []
+    for event in events:
+        if event.get("type") != "turn":
+            continue
+        if event["role"] == "user":
+            turns.append({"t": event["t"], "content": event["content"], "model": event.get("model"), "reply": None})
+        elif turns and turns[-1]["reply"] is None:
+            turns[-1]["reply"] = event["content"]
+            turns[-1]["reply_t"] = event["t"]
+    return header.get("memory") or {}, turns
+
+
+def model_configs_by_api_model(models_file=MODELS_FILE):
+    try:
+        with open(models_file, 'r', encoding='utf-8') as f:
+            return {config['api_model']: config for config in json.load(f).values()}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+class ReplayStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.turns = 0
+        self.error_samples = []
+
+    def add(self, latency, error=None):
+        with self._lock:
+            self.turns += 1
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(error)
+
+
+def replay_session(client, session, configs, args, stats):
+    from ai_thread import AIResponseThread
+    from prompt_pipeline import IncrementalMessages
+
+    memory, turns = session
+    history = []
+    message_list = IncrementalMessages()
+    previous_t = None
+    for turn in turns:
+        if args.speed and previous_t is not None:
+            # Tempo di "riflessione" dell'utente registrato, scalato
+            time.sleep(max(0.0, turn["t"] - previous_t) * args.speed)
+        api_model = args.model or turn["model"] or "claude-sonnet-4-20250514"
+        model_config = configs.get(api_model, {"api_model": api_model})
+
+        result = {}
+        thread = AIResponseThread(client, turn["content"], history, memory, model_config,
+                                  memory_revision=id(memory), message_list=message_list)
+        thread.response_received.connect(lambda text: result.update(text=text))
+        thread.error_occurred.connect(lambda error: result.update(error=error))
+        started = time.perf_counter()
+        thread.run()  # Nel thread del pool: si misura il motore, non l'event loop di Qt
+        stats.add(time.perf_counter() - started, result.get("error"))
+
+        # La cronologia segue la sessione registrata, così i prompt restano quelli originali
+        reply = turn["reply"] if turn["reply"] is not None else result.get("text", "")
+        history.extend([ChatMessage("user", turn["content"]), ChatMessage("assistant", reply)])
+        previous_t = turn.get("reply_t", turn["t"])
+
+
+def run_replay(client, sessions, args):
+    configs = model_configs_by_api_model()
+    stats = ReplayStats()
+    interval = 1.0 / args.rate if args.rate else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = []
+        for i in range(args.sessions):
+            if interval:
+                # Avvii a ritmo costante, indipendenti dalla durata delle sessioni precedenti
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(replay_session, client, sessions[i % len(sessions)], configs, args, stats))
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - started
+    return {
+        "sessions": args.sessions,
+        "turns": stats.turns,
+        "duration": duration,
+        "throughput": stats.turns / duration if duration else None,
+        "error_rate": stats.errors / stats.turns if stats.turns else 0.0,
+        "errors": stats.errors,
+        "error_samples": stats.error_samples,
+        "latency": summarize(stats.latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay concorrente di sessioni registrate")
+    parser.add_argument("journals", nargs="+", help="File journal o cartelle (es. sessions/)")
+    parser.add_argument("--sessions", type=int, default=None, help="Sessioni da avviare (predefinito: una per journal)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Sessioni avviate al secondo (0 = tutte subito)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sessioni contemporanee al massimo")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Scala delle pause registrate tra i turni (0 = nessuna pausa, 1 = tempo reale)")
+    parser.add_argument("--model", help="Forza un api_model per tutti i turni")
+    parser.add_argument("--base-url", help="API da usare; senza, avvia il server finto in locale")
+    parser.add_argument("--output", help="Salva il report JSON")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    from anthropic import Anthropic
+
+    sessions = [session for session in (load_session(path) for path in find_journals(args.journals)) if session[1]]
+    if not sessions:
+        print("Nessuna sessione con turni da riprodurre.")
+        sys.exit(1)
+    args.sessions = args.sessions or len(sessions)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = FakeAnthropicServer(config_from_args(args)).start()
+        base_url = server.base_url
+    try:
+        client = Anthropic(api_key="finta" if server else None, base_url=base_url)
+        report = run_replay(client, sessions, args)
+    finally:
+        if server:
+            server.stop()
+    report["base_url"] = base_url
+
+    latency = report["latency"]
+    print(f"Sessioni: {report['sessions']}  Turni: {report['turns']}  Durata: {report['duration']:.1f}s")
+    print(f"Throughput: {report['throughput']:.2f} turni/s  Errori: {report['error_rate']:.1%}")
+    if latency["n"]:
+        print(f"Latenza p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  p99 {latency['p99']:.3f}s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Report salvato in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from snapshot_format import SNAPSHOT_EXTENSION, read_snapshot, snapshots_enabled, write_snapshot
+
+SESSIONS_DIR = "sessions"
+# Le trascrizioni contengono l'intera conversazione: la registrazione è attiva solo su richiesta
+RECORD_SESSIONS_ENV = "RECORD_SESSIONS"
+
+
+def recording_enabled():
+    return os.getenv(RECORD_SESSIONS_ENV, "false").lower() == "true"
+
+
+class SessionJournal:
+    """
+    Registra una sessione di chat in un file JSONL append-only: un'intestazione
+    con la memoria all'avvio, poi un evento per ogni messaggio (con l'istante
+    relativo all'inizio e il modello usato). Serve a riprodurre le sessioni
+    con replay.py.
+    """
+    def __init__(self, session_id, memory, folder=SESSIONS_DIR):
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"{session_id}.jsonl")
+        self.started = time.monotonic()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._write({"type": "session", "session_id": session_id,
+                     "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "memory": memory})
+
+    def _write(self, entry):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def _elapsed(self):
+        return round(time.monotonic() - self.started, 3)
+
+    def record_message(self, message, api_model=None):
+        """Registra un ChatMessage; api_model si indica per i messaggi dell'utente."""
+        entry = {"type": "turn", "t": self._elapsed(), "role": message.role, "content": message.content,
+                 "ts": message.timestamp}
+        if api_model:
+            entry["model"] = api_model
+        self._write(entry)
+
+    def record_error(self, error):
+        self._write({"type": "error", "t": self._elapsed(), "error": error})
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            if snapshots_enabled():
+                archive_journal(self.path)
+
+
+def archive_journal(path):
+    """
+    Compatta un journal concluso in un archivio binario (.snap) e rimuove il
+    JSONL. Restituisce il percorso dell'archivio; export_journal() riporta in JSONL.
+    """
+    header, events = load_journal(path)
+    archive_path = os.path.splitext(path)[0] + SNAPSHOT_EXTENSION
+    write_snapshot(archive_path, [header] + events, {"source": os.path.basename(path), "kind": "session"})
+    os.remove(path)
+    return archive_path
+
+
+def export_journal(archive_path, jsonl_path):
+    """Riscrive un archivio .snap come journal JSONL leggibile."""
+    header, events = load_journal(archive_path)
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for entry in [header] + events:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def load_journal(path):
+    """
+    Legge un journal (JSONL o archivio .snap): restituisce (intestazione,
+    lista di eventi). Le righe troncate vengono ignorate.
+    """
+    if path.endswith(SNAPSHOT_EXTENSION):
+        _, entries = read_snapshot(path)
+        if not entries or entries[0].get("type") != "session":
+            raise ValueError(f"{path}: intestazione di sessione mancante")
+        return entries[0], entries[1:]
+    header, events = None, []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("type") == "session":
+                header = entry
+            else:
+                events.append(entry)
+    if header is None:
+        raise ValueError(f"{path}: intestazione di sessione mancante")
+    return header, events
+
+
+def find_journals(paths):
+    """Espande file e cartelle nell'elenco ordinato dei journal (.jsonl e archivi .snap)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.endswith((".jsonl", SNAPSHOT_EXTENSION)))
+        else:
+            found.append(path)
+    return found
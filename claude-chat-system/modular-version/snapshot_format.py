@@ -0,0 +1,157 @@
+"""
+Formato binario compatto per gli snapshot di memoria e gli archivi di sessione.
+
+Il file è una sequenza di record con prefisso di lunghezza:
+    MAGIC | record | record | ...
+    record = tipo (1 byte) | lunghezza (uint32 LE) | crc32 (uint32 LE) | payload
+Il record "M" contiene i metadati in JSON (es. hash del file JSON da cui lo
+snapshot è stato generato); il record "D" contiene i dati serializzati con
+marshal dopo l'interning delle stringhe, così chiavi e valori ripetuti sono
+scritti una sola volta e in memoria diventano lo stesso oggetto.
+
+Il JSON resta la fonte di verità (modificabile a mano o con JSON Manager):
+lo snapshot è una copia veloce da caricare, usata solo se corrisponde ancora
+al JSON. marshal dipende dalla versione di Python: se lo snapshot non è
+leggibile si torna al JSON.
+
+Uso da riga di comando:
+    python snapshot_format.py export memoria.snap memoria.json
+    python snapshot_format.py pack memoria.json memoria.snap
+"""
+import json
+import marshal
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime
+
+MAGIC = b"CMSNAP1\n"
+MARSHAL_VERSION = 4
+_RECORD_HEADER = struct.Struct("<cII")
+SNAPSHOT_EXTENSION = ".snap"
+# Snapshot binari attivi solo su richiesta: BINARY_SNAPSHOTS=true
+SNAPSHOTS_ENV = "BINARY_SNAPSHOTS"
+
+
+class SnapshotError(ValueError):
+    """Snapshot assente, troncato, corrotto o scritto da una versione di Python incompatibile."""
+
+
+def snapshots_enabled():
+    return os.getenv(SNAPSHOTS_ENV, "false").lower() == "true"
+
+
+def snapshot_file_for(json_file):
+    """File snapshot accanto al JSON: claudia_memory.json -> claudia_memory.snap"""
+    return os.path.splitext(json_file)[0] + SNAPSHOT_EXTENSION
+
+
+def intern_strings(value, table=None):
+    """Copia del documento in cui le stringhe uguali sono lo stesso oggetto."""
+    if table is None:
+        table = {}
+    if isinstance(value, str):
+        return table.setdefault(value, value)
+    if isinstance(value, dict):
+        return {table.setdefault(key, key): intern_strings(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [intern_strings(item, table) for item in value]
+    return value
+
+
+def clone(value):
+    """Copia profonda di un documento JSON, molto più veloce di copy.deepcopy."""
+    return marshal.loads(marshal.dumps(value, MARSHAL_VERSION))
+
+
+def _record(kind, payload):
+    return _RECORD_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+
+def encode(data, meta=None):
+    """Bytes dello snapshot: record dei metadati e record dei dati."""
+    meta = dict(meta or {})
+    meta.setdefault("created", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    meta["python"] = "%d.%d" % sys.version_info[:2]
+    payload = marshal.dumps(intern_strings(data), MARSHAL_VERSION)
+    return MAGIC + _record(b"M", json.dumps(meta).encode('utf-8')) + _record(b"D", payload)
+
+
+def _iter_records(raw):
+    if not raw.startswith(MAGIC):
+        raise SnapshotError("Formato snapshot non riconosciuto")
+    offset = len(MAGIC)
+    while offset < len(raw):
+        if offset + _RECORD_HEADER.size > len(raw):
+            raise SnapshotError("Snapshot troncato")
+        kind, length, crc = _RECORD_HEADER.unpack_from(raw, offset)
+        offset += _RECORD_HEADER.size
+        payload = raw[offset:offset + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise SnapshotError("Snapshot troncato o corrotto")
+        offset += length
+        yield kind, payload
+
+
+def decode(raw, accept=None):
+    """
+    Restituisce (metadati, dati). Se accept(metadati) è falso i dati non
+    vengono decodificati e al loro posto c'è None.
+    """
+    meta, data = {}, None
+    for kind, payload in _iter_records(raw):
+        if kind == b"M":
+            meta = json.loads(payload.decode('utf-8'))
+            if accept is not None and not accept(meta):
+                return meta, None
+        elif kind == b"D":
+            try:
+                data = marshal.loads(payload)
+            except (ValueError, EOFError, TypeError) as e:
+                raise SnapshotError(f"Dati dello snapshot non leggibili: {e}") from e
+    return meta, data
+
+
+def write_snapshot(path, data, meta=None):
+    """Scrive lo snapshot in modo atomico. Restituisce la dimensione in byte."""
+    raw = encode(data, meta)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
+    return len(raw)
+
+
+def read_snapshot(path, accept=None):
+    """Legge uno snapshot: (metadati, dati), con dati None se rifiutato da accept."""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        raise SnapshotError(str(e)) from e
+    return decode(raw, accept)
+
+
+def export_json(snapshot_path, json_path, indent=2):
+    """Esporta lo snapshot in JSON leggibile (per modificarlo a mano o con JSON Manager)."""
+    _, data = read_snapshot(snapshot_path)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("export", "pack"):
+        print(__doc__.split("Uso da riga di comando:")[1])
+        sys.exit(1)
+    command, source, target = sys.argv[1:]
+    if command == "export":
+        export_json(source, target)
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            write_snapshot(target, json.load(f), {"source": os.path.basename(source)})
+    print(f"{source} -> {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import builtins
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Attivabile con --profile-startup sulla riga di comando o STARTUP_PROFILE=1
+PROFILE_FLAG = "--profile-startup"
+PROFILE_ENV = "STARTUP_PROFILE"
+
+
+class StartupProfiler:
+    """
+    Linea temporale dell'avvio: tappe (mark), fasi con durata (phase) e, in
+    modalità profilo, il tempo dei moduli importati per la prima volta.
+    Quando è disattivato ogni chiamata è un semplice return.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.t0 = time.perf_counter()
+        self.events = []
+        self.imports = []
+        self._original_import = None
+        self._depth = 0
+        self._reported = False
+
+    def enable_from_args(self, argv):
+        """Attiva il profilo se richiesto; rimuove l'opzione da argv (Qt non la conosce)."""
+        if PROFILE_FLAG in argv:
+            argv.remove(PROFILE_FLAG)
+            self.enable()
+        elif os.getenv(PROFILE_ENV, "") not in ("", "0", "false"):
+            self.enable()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Solo gli import di primo livello di moduli non ancora caricati (tempo cumulativo)
+        if self._depth or level or name in sys.modules:
+            self._depth += 1
+            try:
+                return self._original_import(name, globals, locals, fromlist, level)
+            finally:
+                self._depth -= 1
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self.imports.append((name, time.perf_counter() - start))
+
+    def mark(self, label):
+        if self.enabled:
+            self.events.append((time.perf_counter() - self.t0, label, None))
+
+    @contextmanager
+    def phase(self, label):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append((start - self.t0, label, end - start))
+
+    def report(self, file=None):
+        """Stampa la linea temporale (una sola volta) e ripristina l'import originale."""
+        if not self.enabled or self._reported:
+            return
+        self._reported = True
+        builtins.__import__ = self._original_import
+        file = file or sys.stderr
+        print("\n=== Profilo di avvio ===", file=file)
+        for offset, label, duration in sorted(self.events, key=lambda event: event[0]):
+            extra = f"  ({duration * 1000:7.1f} ms)" if duration is not None else ""
+            print(f"{offset * 1000:8.1f} ms  {label}{extra}", file=file)
+        if self.imports:
+            print("--- Import più lenti ---", file=file)
+            for name, duration in sorted(self.imports, key=lambda item: item[1], reverse=True)[:15]:
+                print(f"{duration * 1000:8.1f} ms  {name}", file=file)
+
+
+profiler = StartupProfiler()
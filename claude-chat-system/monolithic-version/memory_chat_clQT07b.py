@@ -10,6 +10,18 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
 from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor
 
+# Prompt per aggiornare il profilo utente con i concetti emersi nella sessione
+MEMORY_UPDATE_TEMPLATE = """Aggiorna questo profilo utente con i nuovi concetti chiave dal dialogo.
+
+PROFILO ATTUALE:
+{memory}
+
+NUOVO DIALOGO:
+{session_text}
+
+Rispondi SOLO con un JSON aggiornato che integra le nuove informazioni importanti, mantenendo la stessa struttura.
+Estrai solo concetti significativi, non conversazione casuale."""
+
 class AIResponseThread(QThread):
     response_received = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
@@ -563,16 +575,9 @@ Di cosa parliamo oggi?"""
         
         session_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in self.session_history[-10:]])
         
-        prompt = f"""Aggiorna questo profilo utente con i nuovi concetti chiave dal dialogo.
-        
-PROFILO ATTUALE:
-{json.dumps(self.memory, indent=2, ensure_ascii=False)}
-
-NUOVO DIALOGO:
-{session_text}
-
-Rispondi SOLO con un JSON aggiornato che integra le nuove informazioni importanti, mantenendo la stessa struttura.
-Estrai solo concetti significativi, non conversazione casuale."""
+        prompt = MEMORY_UPDATE_TEMPLATE.format(
+            memory=json.dumps(self.memory, indent=2, ensure_ascii=False),
+            session_text=session_text)
         
         # Usa sempre Sonnet 4 per aggiornare la memoria (più intelligente)
         sonnet4_config = None
@@ -1,7 +1,8 @@
 # api_handler.py
-import json
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from prompt_pipeline import chat_pipeline
+
 class AIResponseThread(QThread):
     """
     Gestisce la chiamata all'API di Anthropic in un thread separato
@@ -17,37 +18,15 @@ class AIResponseThread(QThread):
         self.conversation_history = conversation_history
         self.memory = memory
         self.model_config = model_config # Configurazione modello completa
+        self.stage_sizes = {}  # Caratteri per stadio del prompt (vedi prompt_pipeline.py)
     
     def run(self):
         try:
-            messages = []
-            
-            # AGGIUNGI IL PROMPT PREFERENZE COME PRIMO MESSAGGIO
-            if self.model_config.get('preferences_prompt'):
-                messages.append({
-                    "role": "user", 
-                    "content": f"PROMPT INIZIALE: {self.model_config['preferences_prompt']}"
-                })
-            
-            # Aggiungi memoria se presente
-            if self.memory:
-                memory_context = f"MEMORIA PERSISTENTE: {json.dumps(self.memory, ensure_ascii=False)}"
-                messages.append({
-                    "role": "user",
-                    "content": memory_context
-                })
-                                
-            # Aggiungi cronologia conversazione
-            for msg in self.conversation_history:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Aggiungi messaggio corrente
-            messages.append({
-                "role": "user",
-                "content": self.message
+            messages, self.stage_sizes = chat_pipeline.build({
+                "preferences": self.model_config.get('preferences_prompt'),
+                "memory": self.memory,
+                "history": self.conversation_history,
+                "message": self.message,
             })
             
             response = self.client.messages.create(
@@ -0,0 +1,94 @@
+# Modulo condiviso: copie identiche in claude-chat-system/modular-version e
+# claudia-chat-system/modular-version. Ogni modifica va riportata in entrambe.
+import hashlib
+import sys
+import time
+from collections.abc import Mapping
+from datetime import datetime
+
+# Ruoli condivisi: ogni messaggio punta alla stessa stringa
+_ROLES = {"user": "user", "assistant": "assistant"}
+
+
+def estimate_tokens(text):
+    """Stima veloce dei token (circa 4 caratteri per token), senza tokenizer."""
+    return (len(text) + 3) // 4
+
+
+class ChatMessage(Mapping):
+    """
+    Messaggio della cronologia di sessione: ruolo, testo e istante di invio,
+    con token stimati, forma renderizzata e hash del testo calcolati una
+    volta sola e solo se servono. Con __slots__ occupa molto meno di un dict
+    e, essendo un Mapping con le sole chiavi "role" e "content", entra così
+    com'è nella lista dei messaggi (IncrementalMessages non crea un dict per
+    ogni messaggio della cronologia). L'SDK lo serializza comunque in un
+    dict nuovo a ogni richiesta.
+    """
+    __slots__ = ("role", "content", "timestamp", "_tokens", "_rendered", "_digest")
+
+    def __init__(self, role, content, timestamp=None):
+        self.role = _ROLES.get(role) or sys.intern(role)
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._tokens = None
+        self._rendered = None
+        self._digest = None
+
+    # --- Vista dict per l'API: {"role": ..., "content": ...} ---
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("role", "content"))
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"ChatMessage({self.role!r}, {self.content[:40]!r})"
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = estimate_tokens(self.content)
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, value):
+        """Conteggio esatto (es. dall'usage dell'API) al posto della stima."""
+        self._tokens = value
+
+    @property
+    def digest(self):
+        """Hash breve del testo, per riconoscere messaggi uguali."""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.content.encode('utf-8'), digest_size=8).hexdigest()
+        return self._digest
+
+    def time_label(self, fmt="%H:%M"):
+        return datetime.fromtimestamp(self.timestamp).strftime(fmt)
+
+    def render(self, renderer):
+        """Forma renderizzata (es. HTML della chat), calcolata con renderer(self) la prima volta."""
+        if self._rendered is None:
+            self._rendered = renderer(self)
+        return self._rendered
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["role"], data["content"], data.get("timestamp"))
+
+
+def api_message(message):
+    """Messaggio pronto per l'API: i ChatMessage vanno bene così, i dict vengono ridotti a ruolo e testo."""
+    if isinstance(message, ChatMessage):
+        return message
+    return {"role": message["role"], "content": message["content"]}
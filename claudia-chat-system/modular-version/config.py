@@ -3,4 +3,9 @@
 Contiene le costanti di configurazione per l'applicazione.
 """
 MEMORY_FILE = "claudia_memory.json"
-MODELS_FILE = "model.json"
\ No newline at end of file
+MODELS_FILE = "model.json"
+
+
+def memory_file_for(model_config):
+    """File di memoria della persona: una voce di model.json può indicarne uno proprio con "memory_file"."""
+    return (model_config or {}).get("memory_file") or MEMORY_FILE
@@ -3,47 +3,87 @@ import json
 import os
 import sys
 from datetime import datetime
-from dotenv import load_dotenv
-from anthropic import Anthropic
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
                              QWidget, QTextEdit, QLineEdit, QPushButton, QLabel,
                              QMessageBox, QSplitter, QGroupBox, QScrollArea, QComboBox, QToolBar)
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, QFileSystemWatcher
 from PyQt5.QtGui import QFont
 
 # Importa dai moduli locali
 from api_handler import AIResponseThread
+from chat_message import ChatMessage
+from prompt_pipeline import build_consolidation_prompt
 from memory_manager import MemoryManager
-from config import MEMORY_FILE, MODELS_FILE
+from config import MODELS_FILE, memory_file_for
 
 class MemoryChatGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         
-        # Carica variabili d'ambiente
-        load_dotenv()
-        self.api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not self.api_key:
-            QMessageBox.critical(self, "Errore", "ANTHROPIC_API_KEY non trovata nel file .env")
-            sys.exit(1)
-        
-        self.client = Anthropic(api_key=self.api_key)
+        # Il client (con dotenv e anthropic) viene creato al primo invio: vedi get_client()
+        self.client = None
         self.session_history = []
+        self.pending_message = None  # Messaggio utente in attesa di risposta
         
         # Flag per evitare aggiornamenti multipli di memoria
         self.memory_update_in_progress = False
         
-        # Usa i moduli esterni
-        self.memory_manager = MemoryManager(MEMORY_FILE)
-        self.memory = self.memory_manager.load()
-        
         # Carica configurazioni modelli e imposta il modello unico
         self.models_config = self.load_models_config()
         self.current_model_name = self.get_single_model_name()
         self.current_model_config = self.models_config[self.current_model_name]
         
+        # Usa i moduli esterni: la memoria è quella della persona configurata
+        self.memory_manager = MemoryManager(memory_file_for(self.current_model_config))
+        try:
+            self.memory = self.memory_manager.load()
+        except TimeoutError as e:
+            # Memoria bloccata da un altro programma: si parte vuoti, al salvataggio le modifiche vengono unite al file
+            QMessageBox.warning(self, "Memoria non caricata",
+                                f"{e}\n\nLa chat parte con una memoria vuota; salvando, le novità verranno unite "
+                                "alla memoria esistente.")
+            self.memory = self.memory_manager._get_default_memory()
+        
         self.init_ui()
         self.show_initial_message()
+        self.setup_memory_watcher()
+        
+    def get_client(self):
+        """Client Anthropic, creato al primo utilizzo per non rallentare l'avvio."""
+        if self.client is None:
+            from dotenv import load_dotenv
+            from anthropic import Anthropic
+            
+            # Carica variabili d'ambiente
+            load_dotenv()
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            if not api_key:
+                QMessageBox.critical(self, "Errore", "ANTHROPIC_API_KEY non trovata nel file .env")
+                sys.exit(1)
+            self.client = Anthropic(api_key=api_key)
+        return self.client
+    
+    def setup_memory_watcher(self):
+        """Osserva il file memoria per ricaricarlo se lo modifica un altro programma."""
+        self.memory_watcher = QFileSystemWatcher(self)
+        self.memory_watcher.addPath(self.memory_manager.filepath)
+        self.memory_reload_timer = QTimer(self)
+        self.memory_reload_timer.setSingleShot(True)
+        self.memory_reload_timer.setInterval(300)
+        self.memory_reload_timer.timeout.connect(self.on_memory_file_changed)
+        self.memory_watcher.fileChanged.connect(lambda _: self.memory_reload_timer.start())
+
+    def on_memory_file_changed(self):
+        """Ricarica in modo incrementale la memoria modificata esternamente."""
+        # Le scritture atomiche (rename) fanno perdere il watch: va ripristinato
+        if self.memory_manager.filepath not in self.memory_watcher.files():
+            self.memory_watcher.addPath(self.memory_manager.filepath)
+        changed = self.memory_manager.reload_if_changed(self.memory)
+        if changed:
+            self.status_label.setText(f"🔄 Memoria ricaricata: {', '.join(changed)}")
+            QTimer.singleShot(3000, lambda: self.status_label.setText("Pronta! 💙"))
+            if self.memory_group.isVisible():
+                self.show_memory_content()
         
     def load_models_config(self):
         """Carica la configurazione dei modelli."""
@@ -204,10 +244,9 @@ class MemoryChatGUI(QMainWindow):
         if not message:
             return
         
-        self.add_message_to_chat("Tu", message, "#FF9800")
-        
-        # AGGIUNGE IL MESSAGGIO UTENTE ALLA CRONOLOGIA UNA SOLA VOLTA
-        self.session_history.append({"role": "user", "content": message})
+        # Il messaggio entra in cronologia con la risposta: qui viene inviato come messaggio corrente
+        self.pending_message = ChatMessage("user", message)
+        self.add_message_to_chat("Tu", self.pending_message, "#FF9800")
 
         self.message_input.clear()
         
@@ -216,7 +255,7 @@ class MemoryChatGUI(QMainWindow):
         self.status_label.setText("L'AI sta pensando... 🤔")
         
         # Usa AIResponseThread dal suo modulo
-        self.ai_thread = AIResponseThread(self.client, message, self.session_history, self.memory, self.current_model_config)
+        self.ai_thread = AIResponseThread(self.get_client(), message, self.session_history, self.memory, self.current_model_config)
         self.ai_thread.response_received.connect(self.handle_ai_response)
         self.ai_thread.error_occurred.connect(self.handle_ai_error)
         self.ai_thread.start()
@@ -233,21 +272,10 @@ class MemoryChatGUI(QMainWindow):
         
         self.memory_update_in_progress = True
         
-        # Usa solo gli ultimi 10 messaggi per evitare prompt troppo lunghi
-        recent_history = self.session_history[-10:]
-        session_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_history])
-        
-        prompt = f"""Aggiorna questo profilo utente con i nuovi concetti chiave dal dialogo.
-        PROFILO ATTUALE:
-        {json.dumps(self.memory, indent=2, ensure_ascii=False)}
-
-        NUOVO DIALOGO:
-        {session_text}
-
-        Rispondi SOLO con un JSON aggiornato che integra le nuove informazioni importanti, mantenendo la stessa struttura.
-        Estrai solo concetti significativi, non conversazione casuale."""
+        # Solo gli ultimi messaggi (CONSOLIDATION_TURNS) per evitare prompt troppo lunghi
+        prompt = build_consolidation_prompt(self.memory, self.session_history)
         
-        self.memory_thread = AIResponseThread(self.client, prompt, [], self.memory, self.current_model_config)
+        self.memory_thread = AIResponseThread(self.get_client(), prompt, [], self.memory, self.current_model_config)
         self.memory_thread.response_received.connect(self.handle_memory_update)
         self.memory_thread.error_occurred.connect(self.handle_memory_error)
         self.memory_thread.start()
@@ -304,17 +332,24 @@ class MemoryChatGUI(QMainWindow):
         return formatted or "Niente di specifico ancora salvato."
     
     def add_message_to_chat(self, sender, message, color):
-        timestamp = datetime.now().strftime("%H:%M")
+        if isinstance(message, ChatMessage):
+            timestamp, message = message.time_label(), message.content
+        else:
+            timestamp = datetime.now().strftime("%H:%M")
         self.chat_display.append(f'<div style="margin: 10px 0;"><strong style="color: {color};">[{timestamp}] {sender}:</strong><br><span style="color: #FFFFFF; margin-left: 20px;">{message.replace(chr(10), "<br>")}</span></div>')
         self.chat_display.verticalScrollBar().setValue(self.chat_display.verticalScrollBar().maximum())
     
     def handle_ai_response(self, response):
         ai_name = "Claudia" if "Sonnet 4" in self.current_model_name else self.current_model_name
         color = "#2196F3" if "Sonnet 4" in self.current_model_name else "#FF9800"
-        self.add_message_to_chat(ai_name, response, color)
+        reply = ChatMessage("assistant", response)
+        self.add_message_to_chat(ai_name, reply, color)
         
-        # AGGIUNGE LA RISPOSTA AI ALLA CRONOLOGIA UNA SOLA VOLTA
-        self.session_history.append({"role": "assistant", "content": response})
+        # AGGIUNGE DOMANDA E RISPOSTA ALLA CRONOLOGIA UNA SOLA VOLTA
+        if self.pending_message is not None:
+            self.session_history.append(self.pending_message)
+            self.pending_message = None
+        self.session_history.append(reply)
         
         self.message_input.setEnabled(True)
         self.send_button.setEnabled(True)
@@ -322,6 +357,7 @@ class MemoryChatGUI(QMainWindow):
         self.status_label.setText("Pronta! 💙")
     
     def handle_ai_error(self, error):
+        self.pending_message = None
         self.add_message_to_chat("Sistema", f"Errore: {error}", "#F44336")
         self.message_input.setEnabled(True)
         self.send_button.setEnabled(True)
@@ -1,17 +1,29 @@
 # main.py
 import sys
-from PyQt5.QtWidgets import QApplication
-from gui_manager import MemoryChatGUI
+from startup_profiler import profiler
 
 def main():
     """
     Funzione principale per avviare l'applicazione.
+    Con --profile-startup (o STARTUP_PROFILE=1) stampa la linea temporale dell'avvio.
     """
+    profiler.enable_from_args(sys.argv)
+    profiler.mark("avvio")
+    
+    with profiler.phase("import PyQt5"):
+        from PyQt5.QtWidgets import QApplication
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
     
-    window = MemoryChatGUI()
+    with profiler.phase("import gui_manager"):
+        from gui_manager import MemoryChatGUI
+    with profiler.phase("costruzione finestra"):
+        window = MemoryChatGUI()
     window.show()
+    profiler.mark("finestra mostrata")
+    # Il report viene stampato al primo giro del ciclo eventi, a finestra disegnata
+    from PyQt5.QtCore import QTimer
+    QTimer.singleShot(0, lambda: (profiler.mark("primo ciclo eventi"), profiler.report()))
     
     sys.exit(app.exec_())
 
@@ -1,31 +1,92 @@
 # memory_manager.py
+import copy
 import json
 import os
 from datetime import datetime
 
+from file_sync import FileLock, FileSignature, merge, read_json, write_json_atomic
+
+# Tentativi di caricamento se il file è bloccato da un altro programma
+LOAD_ATTEMPTS = 3
+
 class MemoryManager:
     """
     Gestisce il caricamento e il salvataggio della memoria dell'AI.
+    Il file può essere modificato anche da altri programmi (JSON Manager,
+    la chat multi-modello): le scritture avvengono sotto lock e uniscono
+    le modifiche esterne invece di sovrascriverle.
     """
     def __init__(self, filepath):
         self.filepath = filepath
+        self.signature = FileSignature(filepath)
+        self._base = None  # Contenuto del file all'ultima lettura/scrittura
 
     def load(self):
-        """Carica la memoria dal file JSON."""
+        """
+        Carica la memoria dal file JSON. Se il file resta bloccato da un altro
+        programma solleva TimeoutError invece di ripartire dalla memoria vuota.
+        """
         if os.path.exists(self.filepath):
-            try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                # Se il file è corrotto o illeggibile, ritorna la struttura di default
-                pass
+            for attempt in range(1, LOAD_ATTEMPTS + 1):
+                try:
+                    with FileLock(self.filepath):
+                        memory, raw = read_json(self.filepath)
+                    self.signature.update(raw)
+                    self._base = copy.deepcopy(memory)
+                    return memory
+                except TimeoutError:
+                    if attempt == LOAD_ATTEMPTS:
+                        raise
+                except (json.JSONDecodeError, IOError):
+                    # Se il file è corrotto o illeggibile, ritorna la struttura di default
+                    break
         return self._get_default_memory()
 
     def save(self, memory_data):
-        """Salva la memoria nel file JSON."""
+        """Salva la memoria nel file JSON unendo eventuali modifiche esterne (memory_data viene aggiornato)."""
         memory_data["ultimo_aggiornamento"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        with open(self.filepath, 'w', encoding='utf-8') as f:
-            json.dump(memory_data, f, indent=2, ensure_ascii=False)
+        with FileLock(self.filepath):
+            if os.path.exists(self.filepath) and self.signature.changed():
+                # Senza base (file non caricato) si unisce partendo dalla memoria vuota
+                base = self._base if self._base is not None else self._get_default_memory()
+                try:
+                    theirs, _ = read_json(self.filepath)
+                    self._update_in_place(memory_data, merge(base, memory_data, theirs))
+                except ValueError:
+                    pass  # File esterno corrotto: prevale la versione locale
+            raw = write_json_atomic(self.filepath, memory_data)
+        self.signature.update(raw)
+        self._base = copy.deepcopy(memory_data)
+
+    def reload_if_changed(self, memory_data):
+        """
+        Se il file è stato modificato da un altro programma aggiorna memory_data
+        solo nelle chiavi cambiate e restituisce la lista di tali chiavi.
+        """
+        if not self.signature.changed():
+            return []
+        try:
+            with FileLock(self.filepath):
+                theirs, raw = read_json(self.filepath)
+        except (ValueError, IOError, TimeoutError):
+            return []
+        merged = theirs if self._base is None else merge(self._base, memory_data, theirs)
+        changed = self._update_in_place(memory_data, merged)
+        self.signature.update(raw)
+        self._base = copy.deepcopy(theirs)
+        return changed
+
+    @staticmethod
+    def _update_in_place(memory_data, new_memory):
+        """Porta memory_data a new_memory toccando solo le chiavi diverse."""
+        changed = [key for key in memory_data if key not in new_memory]
+        for key in changed:
+            del memory_data[key]
+        for key, value in new_memory.items():
+            if key not in memory_data or memory_data[key] != value:
+                memory_data[key] = value
+                changed.append(key)
+        return changed
 
     def _get_default_memory(self):
         """Restituisce la struttura di default per la memoria."""
@@ -0,0 +1,261 @@
+# Modulo condiviso: copie identiche in claude-chat-system/modular-version e
+# claudia-chat-system/modular-version. Ogni modifica va riportata in entrambe.
+"""
+Costruzione dei prompt a stadi dichiarativi.
+
+Ogni stadio produce zero o più messaggi a partire da un contesto (dict):
+    preferences  PROMPT INIZIALE dal file dei modelli
+    memory       MEMORIA PERSISTENTE (JSON compatto)
+    summary      riassunto della conversazione precedente, se presente
+    history      cronologia della sessione
+    message      messaggio corrente dell'utente
+
+I template sono compilati una volta sola (segmenti letterali e segnaposto) e
+gli stadi stabili tra un turno e l'altro (preferenze, memoria) riusano il
+messaggio già costruito finché la loro chiave di cache non cambia: la
+memoria viene riserializzata solo quando cambia la sua revisione.
+"""
+import json
+import threading
+from functools import lru_cache
+from string import Formatter
+
+from chat_message import api_message
+
+# Prompt per consolidare la sessione nel profilo utente
+CONSOLIDATION_TEMPLATE = """Aggiorna questo profilo utente con i nuovi concetti chiave dal dialogo.
+
+PROFILO ATTUALE:
+{memory}
+
+NUOVO DIALOGO:
+{session_text}
+
+Rispondi SOLO con un JSON aggiornato che integra le nuove informazioni importanti, mantenendo la stessa struttura.
+Estrai solo concetti significativi, non conversazione casuale."""
+
+# Turni recenti della sessione inclusi nel prompt di consolidamento
+CONSOLIDATION_TURNS = 10
+
+# Prompt per il titolo breve di una conversazione (primo scambio)
+TITLE_TEMPLATE = """Dai un titolo di al massimo 5 parole a questa conversazione. Rispondi solo con il titolo.
+
+{session_text}"""
+TITLE_TURNS = 2
+
+
+class Template:
+    """Template con segnaposto {nome}, analizzato una sola volta."""
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        self.fields = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if spec or conversion:
+                raise ValueError(f"Formato non supportato nel template: {{{field}!{conversion}:{spec}}}")
+            self.parts.append((literal, field))
+            if field is not None:
+                self.fields.append(field)
+
+    def render(self, values):
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+
+@lru_cache(maxsize=64)
+def compile_template(text):
+    return Template(text)
+
+
+def compact_json(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def pretty_json(value):
+    return json.dumps(value, indent=2, ensure_ascii=False)
+
+
+class Stage:
+    """
+    Stadio della pipeline. Con template produce un messaggio (saltato se il
+    campo `source` del contesto è vuoto); con expand copia la lista di
+    messaggi indicata. `serialize` trasforma il valore prima del template;
+    `cache_key` indica il campo del contesto che identifica il risultato
+    (es. la revisione della memoria): finché non cambia il messaggio è riusato.
+    """
+    def __init__(self, name, template=None, source=None, role="user", serialize=None, cache_key=None, expand=None):
+        self.name = name
+        self.template = compile_template(template) if template is not None else None
+        self.source = source
+        self.role = role
+        self.serialize = serialize
+        self.cache_key = cache_key
+        self.expand = expand
+
+    def render(self, context):
+        """Messaggi prodotti dallo stadio per questo contesto."""
+        if self.expand:
+            return [api_message(msg) for msg in context.get(self.expand) or ()]
+        value = context.get(self.source)
+        if not value:
+            return []
+        if self.serialize:
+            value = self.serialize(value)
+        return [{"role": self.role, "content": self.template.render({self.source: value})}]
+
+
+# Stadi dei messaggi di chat, nell'ordine in cui vengono inviati
+CHAT_STAGES = (
+    Stage("preferences", "PROMPT INIZIALE: {preferences}", source="preferences", cache_key="preferences"),
+    Stage("memory", "MEMORIA PERSISTENTE: {memory}", source="memory", serialize=compact_json,
+          cache_key="memory_revision"),
+    Stage("summary", "RIASSUNTO DELLA CONVERSAZIONE PRECEDENTE: {summary}", source="summary"),
+    Stage("history", expand="history"),
+    Stage("message", "{message}", source="message"),
+)
+
+
+class PromptPipeline:
+    """
+    Applica gli stadi a un contesto e restituisce i messaggi per l'API.
+    Dopo ogni build() `last_sizes` contiene i caratteri prodotti da ogni stadio.
+    Un'istanza va condivisa tra i turni per sfruttare la cache.
+    """
+    def __init__(self, stages=CHAT_STAGES):
+        self.stages = tuple(stages)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.last_sizes = {}
+
+    def _render_stage(self, stage, context):
+        key = context.get(stage.cache_key) if stage.cache_key else None
+        if key is None:
+            return stage.render(context)
+        with self._lock:
+            cached = self._cache.get(stage.name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        messages = stage.render(context)
+        with self._lock:
+            self._cache[stage.name] = (key, messages)
+        return messages
+
+    def build(self, context):
+        """Restituisce (messaggi, caratteri per stadio)."""
+        messages, sizes = [], {}
+        for stage in self.stages:
+            produced = self._render_stage(stage, context)
+            messages.extend(produced)
+            sizes[stage.name] = sum(len(msg["content"]) for msg in produced)
+        self.last_sizes = sizes
+        return messages, sizes
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# Pipeline predefinita dei messaggi di chat, condivisa da tutti i thread
+chat_pipeline = PromptPipeline(CHAT_STAGES)
+
+
+class IncrementalMessages:
+    """
+    Lista dei messaggi per l'API di una conversazione, mantenuta tra i turni.
+    Gli stadi prima della cronologia formano la testa, la cronologia viene
+    solo allungata (i ChatMessage entrano così come sono, i dict vengono
+    convertiti una volta sola; l'SDK serializza comunque ogni messaggio a
+    ogni richiesta) e in coda c'è il messaggio corrente, sostituito
+    al turno dopo. Se cambia una chiave della testa (es. revisione della
+    memoria) o la cronologia non è più la stessa lista (chat pulita), la
+    lista viene ricostruita da capo.
+    La cronologia deve essere append-only; la lista restituita da build()
+    resta valida fino al build() successivo.
+    """
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline or chat_pipeline
+        expand = [i for i, stage in enumerate(self.pipeline.stages) if stage.expand]
+        split = expand[0] if expand else len(self.pipeline.stages)
+        self.head_stages = self.pipeline.stages[:split]
+        self.history_stage = self.pipeline.stages[split] if expand else None
+        self.tail_stages = self.pipeline.stages[split + 1:]
+        self.messages = []
+        self._lock = threading.Lock()
+        self._head_key = None
+        self._head_sizes = {}
+        self._history = None
+        self._history_len = 0
+        self._history_chars = 0
+        self._tail_len = 0
+        self.last_sizes = {}
+
+    def head_key(self, context):
+        """Chiave della testa; None se non è identificabile (es. memoria senza revisione)."""
+        keys = []
+        for stage in self.head_stages:
+            key = context.get(stage.cache_key or stage.source)
+            if stage.cache_key and key is None:
+                return None
+            keys.append(key)
+        return tuple(keys)
+
+    def _render(self, stages, context, sizes):
+        messages = []
+        for stage in stages:
+            produced = self.pipeline._render_stage(stage, context)
+            messages.extend(produced)
+            sizes[stage.name] = sum(len(msg["content"]) for msg in produced)
+        return messages
+
+    def build(self, context):
+        """Stessa interfaccia di PromptPipeline.build(): (messaggi, caratteri per stadio)."""
+        history = context.get(self.history_stage.expand) if self.history_stage else None
+        history = history if history is not None else []
+        head_key = self.head_key(context)
+
+        with self._lock:
+            if (head_key is not None and head_key == self._head_key and history is self._history
+                    and len(history) >= self._history_len):
+                if self._tail_len:
+                    del self.messages[-self._tail_len:]
+            else:
+                # Lista nuova: la precedente potrebbe essere ancora in uso
+                self._head_sizes = {}
+                self.messages = self._render(self.head_stages, context, self._head_sizes)
+                self._head_key = head_key
+                self._history = history
+                self._history_len = self._history_chars = 0
+            for msg in history[self._history_len:]:
+                self.messages.append(api_message(msg))
+                self._history_chars += len(msg["content"])
+            self._history_len = len(history)
+
+            sizes = dict(self._head_sizes)
+            if self.history_stage:
+                sizes[self.history_stage.name] = self._history_chars
+            tail = self._render(self.tail_stages, context, sizes)
+            self.messages.extend(tail)
+            self._tail_len = len(tail)
+            self.last_sizes = sizes
+            return self.messages, sizes
+
+
+def format_session(history, turns=CONSOLIDATION_TURNS):
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in history[-turns:])
+
+
+def build_consolidation_prompt(memory, history, turns=CONSOLIDATION_TURNS):
+    """Prompt per aggiornare il profilo con gli ultimi turni della sessione."""
+    return compile_template(CONSOLIDATION_TEMPLATE).render({
+        "memory": pretty_json(memory),
+        "session_text": format_session(history, turns),
+    })
+
+
+def build_title_prompt(history, turns=TITLE_TURNS):
+    """Prompt per il titolo della conversazione, dai primi turni."""
+    return compile_template(TITLE_TEMPLATE).render({"session_text": format_session(history[:turns], turns)})